@@ -0,0 +1,53 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from feature_store import features_to_gdf, read_layer, write_layer
+from synthetic_data import road_network
+
+# Processed layers benchmarked when they exist; synthetic layers are used otherwise
+LAYERS = {
+    'roads': 'data/data_processed/motorways.geojson',
+    'rail': 'data/data_processed/railways.geojson',
+}
+EXTENSIONS = ['.geojson', '.parquet', '.fgb']
+
+def load_or_generate(name, path, feature_count):
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return features_to_gdf(data['features'], crs="EPSG:25832")
+    print(f"{path} not found, using {feature_count} synthetic {name} features")
+    return features_to_gdf(road_network(feature_count, 30, seed=len(name)), crs="EPSG:4326")
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def benchmark_layer(name, gdf, directory):
+    # Bounding box covering the central ~4% of the layer extent
+    xmin, ymin, xmax, ymax = gdf.total_bounds
+    width, height = xmax - xmin, ymax - ymin
+    bbox = (xmin + 0.4 * width, ymin + 0.4 * height, xmin + 0.6 * width, ymin + 0.6 * height)
+    column = [c for c in gdf.columns if c != gdf.geometry.name][:1]
+
+    for extension in EXTENSIONS:
+        path = os.path.join(directory, f"{name}{extension}")
+        _, write_seconds = timed(write_layer, gdf, path)
+        _, read_seconds = timed(read_layer, path)
+        _, column_seconds = timed(read_layer, path, columns=column)
+        subset, bbox_seconds = timed(read_layer, path, bbox=bbox)
+        size_mb = os.path.getsize(path) / 1024 ** 2
+        print(f"{name:<6} {extension:<9} {size_mb:>9.1f} {write_seconds:>8.2f} {read_seconds:>8.2f} "
+              f"{column_seconds:>9.2f} {bbox_seconds:>8.2f} {len(subset):>8}")
+
+def main(feature_count=100000):
+    print(f"{'layer':<6} {'format':<9} {'size [MB]':>9} {'write':>8} {'read':>8} {'columns':>9} {'bbox':>8} {'in bbox':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, path in LAYERS.items():
+            benchmark_layer(name, load_or_generate(name, path, feature_count), directory)
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
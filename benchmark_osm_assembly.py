@@ -0,0 +1,82 @@
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+from geojson import Feature, LineString
+from osm_assembly import assemble_ways, iter_elements, ways_to_features
+
+def make_overpass_payload(way_count, nodes_per_way=12, seed=0):
+    """
+    Creates a synthetic Overpass JSON response ('out body; >; out skel qt;') with
+    way_count highway ways. Consecutive ways share their end node, and node ids are
+    shuffled like in real responses.
+    """
+    rng = np.random.default_rng(seed)
+    node_count = way_count * (nodes_per_way - 1) + 1
+    node_ids = rng.permutation(node_count) * 7 + 1000000
+    coords = np.column_stack((rng.uniform(8.0, 12.5, node_count), rng.uniform(54.5, 57.7, node_count)))
+    elements = []
+    for way in range(way_count):
+        start = way * (nodes_per_way - 1)
+        elements.append({
+            'type': 'way', 'id': 500000 + way,
+            'nodes': node_ids[start:start + nodes_per_way].tolist(),
+            'tags': {'highway': 'primary', 'name': f'Road {way}'}
+        })
+    for node_id, (lon, lat) in zip(node_ids.tolist(), coords.tolist()):
+        elements.append({'type': 'node', 'id': node_id, 'lat': lat, 'lon': lon})
+    return json.dumps({'version': 0.6, 'elements': elements}).encode('utf-8')
+
+def assemble_with_dicts(content):
+    # The original download_roads.py assembly: node dict plus a geojson.LineString per way
+    data = json.loads(content)
+    nodes = {}
+    for element in data['elements']:
+        if element['type'] == 'node':
+            nodes[element['id']] = (element['lon'], element['lat'])
+    features = []
+    for element in data['elements']:
+        if element['type'] == 'way':
+            coordinates = [nodes[node_id] for node_id in element['nodes'] if node_id in nodes]
+            if coordinates:
+                features.append(Feature(geometry=LineString(coordinates),
+                                        properties={'highway': element.get('tags', {}).get('highway')}))
+    return features
+
+def assemble_with_arrays(content):
+    return assemble_ways(json.loads(content)['elements'], 'highway')
+
+def assemble_streaming(content):
+    return assemble_ways(iter_elements(content), 'highway')
+
+def measure(func, content):
+    # Time without tracing first; tracemalloc slows allocation-heavy code down considerably
+    start = time.perf_counter()
+    result = func(content)
+    seconds = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result = func(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 1024 ** 2
+
+def main(way_count=100000):
+    content = make_overpass_payload(way_count)
+    print(f"Synthetic payload: {way_count} ways, {len(content) / 1024 ** 2:.1f} MB")
+    print(f"{'assembly':<28} {'seconds':>8} {'peak [MB]':>10}")
+    reference, seconds, peak = measure(assemble_with_dicts, content)
+    print(f"{'dict + geojson (original)':<28} {seconds:>8.2f} {peak:>10.0f}")
+    for name, func in (('arrays', assemble_with_arrays), ('arrays + streaming parser', assemble_streaming)):
+        ways, seconds, peak = measure(func, content)
+        print(f"{name:<28} {seconds:>8.2f} {peak:>10.0f}")
+    # geojson rounds coordinates to 6 decimals, the array assembly keeps them as parsed
+    features = ways_to_features(ways, 'highway')
+    assert len(features) == len(reference)
+    for feature, expected in zip(features, reference):
+        assert feature['properties'] == expected['properties']
+        assert np.allclose(feature['geometry']['coordinates'], expected['geometry']['coordinates'], atol=1e-6)
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,34 @@
+import time
+from reproject_and_separate import initialize_transformer, reproject_coords, reproject_features
+from synthetic_data import road_network
+
+def reproject_features_per_vertex(features_by_type, transformer):
+    # The original path: one Transformer.transform call per vertex
+    reprojected_data = {}
+    for feature_type, features in features_by_type.items():
+        reprojected_features = []
+        for feature in features:
+            geometry = feature['geometry']
+            new_geometry = {'type': 'LineString', 'coordinates': reproject_coords(geometry['coordinates'], transformer)}
+            reprojected_features.append({'type': 'Feature', 'geometry': new_geometry, 'properties': feature['properties']})
+        reprojected_data[feature_type] = reprojected_features
+    return reprojected_data
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+def main(feature_counts=(1000, 10000, 50000), vertices_per_feature=20, target_epsg=25832):
+    transformer = initialize_transformer(target_epsg)
+    print(f"{'features':>10} {'vertices':>10} {'per-vertex [s]':>15} {'vectorized [s]':>15} {'speedup':>8}")
+    for feature_count in feature_counts:
+        features_by_type = {'all': road_network(feature_count, vertices_per_feature)}
+        vertex_count = feature_count * vertices_per_feature
+        per_vertex = time_call(reproject_features_per_vertex, features_by_type, transformer)
+        vectorized = time_call(reproject_features, features_by_type, transformer)
+        print(f"{feature_count:>10} {vertex_count:>10} {per_vertex:>15.3f} {vectorized:>15.3f} {per_vertex / vectorized:>7.1f}x")
+        print(f"{'':>10} {'':>10} {vertex_count / per_vertex:>13.0f}/s {vertex_count / vectorized:>13.0f}/s")
+
+if __name__ == "__main__":
+    main()
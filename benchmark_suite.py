@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import synthetic_data
+
+# Recorded with --save at the 10k scale; compare only against results from the same machine
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_THRESHOLD = 0.2
+
+def setup_reproject(feature_count):
+    from reproject_and_separate import initialize_transformer, reproject_features
+    features_by_type = {'all': synthetic_data.road_network(feature_count)}
+    transformer = initialize_transformer(25832)
+    return lambda: reproject_features(features_by_type, transformer)
+
+def setup_process_features(feature_count):
+    from reproject_and_separate import process_features
+    data = {'features': synthetic_data.road_network(feature_count)}
+    feature_mapping = {'motorway': 'motorways.geojson', 'primary': 'primary.geojson'}
+    link_mapping = {'motorway_link': 'motorway', 'primary_link': 'primary'}
+    return lambda: process_features(data, 'highway', feature_mapping, link_mapping)
+
+def setup_simplify(feature_count):
+    from simplify import simplify_features_vectorized
+    features = synthetic_data.rail_network(feature_count)
+    return lambda: simplify_features_vectorized(features, 0.0005)
+
+def setup_centerline(feature_count):
+    from centerline_parallel_lines import create_centerline
+    gdf = synthetic_data.carriageway_pairs(feature_count // 2)
+    return lambda: create_centerline(gdf, 20)
+
+def setup_centerlines(feature_count):
+    from centerline_parallel_lines import create_centerlines
+    gdf = synthetic_data.carriageway_pairs(feature_count // 2)
+    return lambda: create_centerlines(gdf)
+
+def setup_urban_area(feature_count):
+    from def_urban_area import buffer_and_dissolve
+    layer = synthetic_data.polygon_layer(feature_count)
+    directory = tempfile.TemporaryDirectory()
+    output_file = os.path.join(directory.name, "urban_area.parquet")
+    return lambda: buffer_and_dissolve(layer.copy(), 50, output_file, tiled=True), directory.cleanup
+
+# Benchmark name -> setup(feature_count) returning the function to time, or the
+# function and a teardown that removes what the setup created
+BENCHMARKS = {
+    "process_features": setup_process_features,
+    "reproject_features": setup_reproject,
+    "simplify_features": setup_simplify,
+    "create_centerline": setup_centerline,
+    "create_centerlines": setup_centerlines,
+    "buffer_and_dissolve": setup_urban_area,
+}
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux; worker processes are reported as children
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+def run_benchmark(name, scale, repeat):
+    # Runs one benchmark in this process: the synthetic data is built first and not timed
+    run = BENCHMARKS[name](synthetic_data.SCALES[scale])
+    run, teardown = run if isinstance(run, tuple) else (run, None)
+    try:
+        setup_rss = peak_rss_mb()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        peak = peak_rss_mb()
+    finally:
+        if teardown is not None:
+            teardown()
+    return {"name": name, "scale": scale, "repeat": repeat, "min": min(times), "median": statistics.median(times),
+            "max": max(times), "peak_rss_mb": peak, "stage_rss_mb": peak - setup_rss}
+
+def measure(name, scale, repeat):
+    # Each benchmark runs in a fresh interpreter, so peak memory is not shared between them
+    output = subprocess.run([sys.executable, __file__, "--run", name, scale, str(repeat)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def machine():
+    return {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()}
+
+def load_baseline(baseline_file):
+    if not os.path.exists(baseline_file):
+        return None
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_baseline(results, baseline_file):
+    # Merge into the existing baseline, so scales can be recorded separately
+    baseline = load_baseline(baseline_file) or {"results": {}}
+    baseline["machine"] = machine()
+    for result in results:
+        baseline["results"][f"{result['name']}@{result['scale']}"] = result
+    with open(baseline_file, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=4)
+    print(f"Baseline saved to {baseline_file}")
+
+def compare(results, baseline, threshold):
+    """
+    Returns the results whose median time or stage memory exceeds the baseline by more than threshold.
+    """
+    if baseline.get("machine") != machine():
+        print(f"Warning: the baseline was recorded on {baseline.get('machine')}, this is {machine()}")
+    regressions = []
+    for result in results:
+        reference = baseline["results"].get(f"{result['name']}@{result['scale']}")
+        if reference is None:
+            continue
+        time_ratio = result["median"] / reference["median"]
+        memory_ratio = (result["stage_rss_mb"] + 1) / (reference["stage_rss_mb"] + 1)
+        result["time_ratio"], result["memory_ratio"] = time_ratio, memory_ratio
+        if time_ratio > 1 + threshold or memory_ratio > 1 + threshold:
+            regressions.append(result)
+    return regressions
+
+def print_results(results):
+    print(f"{'benchmark':<22} {'scale':>5} {'min [s]':>9} {'median [s]':>11} {'peak [MB]':>10} {'stage [MB]':>11} "
+          f"{'vs baseline':>12}")
+    for result in results:
+        ratio = f"{result['time_ratio']:.2f}x" if "time_ratio" in result else "-"
+        print(f"{result['name']:<22} {result['scale']:>5} {result['min']:>9.3f} {result['median']:>11.3f} "
+              f"{result['peak_rss_mb']:>10.0f} {result['stage_rss_mb']:>11.0f} {ratio:>12}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the processing stages on synthetic national-scale data.")
+    parser.add_argument("benchmarks", nargs="*", default=list(BENCHMARKS), help=f"Any of {', '.join(BENCHMARKS)}")
+    parser.add_argument("--scale", nargs="+", default=["10k"], choices=list(synthetic_data.SCALES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown or memory growth relative to the baseline, e.g. 0.2 for 20%%")
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {sorted(unknown)}")
+    results = []
+    for scale in args.scale:
+        for name in args.benchmarks:
+            results.append(measure(name, scale, args.repeat))
+            print(f"{name}@{scale}: median {results[-1]['median']:.3f} s", file=sys.stderr)
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None and not args.save:
+        print(f"No baseline in {args.baseline}; record one with --save", file=sys.stderr)
+    regressions = compare(results, baseline, args.threshold) if baseline and not args.save else []
+    print_results(results)
+    if args.save:
+        save_baseline(results, args.baseline)
+    elif regressions:
+        for result in regressions:
+            print(f"Regression: {result['name']}@{result['scale']} time {result['time_ratio']:.2f}x, "
+                  f"memory {result['memory_ratio']:.2f}x of the baseline")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "--run":
+        print(json.dumps(run_benchmark(sys.argv[2], sys.argv[3], int(sys.argv[4]))))
+    else:
+        main()
@@ -0,0 +1,46 @@
+import json
+import resource
+import subprocess
+import sys
+import time
+import geopandas as gpd
+from def_urban_area import dissolve_tiled
+from synthetic_data import polygon_layer
+
+def run_mode(mode, feature_count, buffer_distance):
+    # Runs one dissolve in this process and returns its runtime, peak RSS and result
+    layer = polygon_layer(feature_count)
+    start = time.perf_counter()
+    buffered = layer.geometry.buffer(buffer_distance)
+    if mode == "tiled":
+        dissolved = dissolve_tiled(buffered.values.to_numpy())
+    else:
+        dissolved = gpd.GeoDataFrame(geometry=buffered).dissolve().geometry.iloc[0]
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux; worker processes are reported as children
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {"mode": mode, "features": feature_count, "seconds": seconds,
+            "peak_rss_mb": peak_kb / 1024, "area": dissolved.area}
+
+def measure(mode, feature_count, buffer_distance):
+    # Each measurement runs in a fresh interpreter so peak RSS is not shared between runs
+    output = subprocess.run([sys.executable, __file__, "--run", mode, str(feature_count), str(buffer_distance)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main(feature_counts=(10000, 100000, 300000), buffer_distance=50):
+    print(f"{'features':>10} {'mode':>8} {'seconds':>9} {'peak RSS [MB]':>14} {'area diff':>10}")
+    for feature_count in feature_counts:
+        results = [measure(mode, feature_count, buffer_distance) for mode in ("global", "tiled")]
+        reference_area = results[0]["area"]
+        for result in results:
+            area_diff = abs(result["area"] - reference_area) / reference_area
+            print(f"{feature_count:>10} {result['mode']:>8} {result['seconds']:>9.2f} "
+                  f"{result['peak_rss_mb']:>14.0f} {area_diff:>10.2e}")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "--run":
+        print(json.dumps(run_mode(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))))
+    else:
+        main()
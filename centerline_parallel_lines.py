@@ -1,6 +1,14 @@
+import argparse
+import time
 import geopandas as gpd
+import numpy as np
+import shapely
+from concurrent.futures import ProcessPoolExecutor
+from crs_cache import reproject_gdf, same_crs
+import instrumentation
+from layer_chunks import LayerWriter, grid_windows, indexed_layer, layer_schema, read_window, scan_layer, window_numbers
 from shapely.geometry import LineString, MultiLineString, MultiPolygon, Polygon
-from shapely.ops import unary_union, linemerge
+from shapely.ops import unary_union, linemerge, substring
 import logging
 
 # Set up logging
@@ -12,18 +20,25 @@ input_geojson_path = "motorways.geojson"
 output_geojson_path = "centerline_motorways.geojson"
 buffer_distance = 10  # Buffer distance in meters
 simplify_tolerance = 0.001  # Simplify tolerance in meters
+pair_distance = 40  # Maximum distance in meters between two carriageways of one road
+resample_distance = 10  # Spacing in meters of the points the median line is computed from
+max_angle = 30  # Maximum deviation in degrees from anti-parallel for paired carriageways
 
+@instrumentation.instrumented()
 def create_centerline(motorway_gdf, buffer_distance):
     # Ensure geometries are valid
     motorway_gdf = motorway_gdf[motorway_gdf.is_valid]
     logger.info(f"Valid geometries count: {len(motorway_gdf)}")
+    instrumentation.count("features", len(motorway_gdf))
 
     # Create a buffer around each line
-    buffered = motorway_gdf.buffer(buffer_distance, cap_style=2)
+    with instrumentation.span("centerline.buffer"):
+        buffered = motorway_gdf.buffer(buffer_distance, cap_style=2)
     logger.info(f"Buffered geometries created.")
 
     # Dissolve the buffers into a single geometry
-    dissolved = unary_union(buffered)
+    with instrumentation.span("centerline.dissolve"):
+        dissolved = unary_union(buffered)
     logger.info(f"Geometries dissolved.")
 
     # Convert dissolved Polygon or MultiPolygon into lines
@@ -41,7 +56,8 @@ def create_centerline(motorway_gdf, buffer_distance):
 
     # Merge the lines into a single centerline
     if isinstance(dissolved, (MultiLineString, LineString)):
-        centerline = linemerge(dissolved)
+        with instrumentation.span("centerline.linemerge"):
+            centerline = linemerge(dissolved)
     else:
         logger.warning(f"Unexpected geometry type after converting: {type(dissolved)}")
         raise ValueError(f"Unexpected geometry type after converting: {type(dissolved)}")
@@ -54,24 +70,338 @@ def simplify_centerline(centerline, tolerance):
     logger.info(f"Centerline simplified.")
     return simplified_centerline
 
-# Load the motorway vector data from GeoJSON
-motorway_gdf = gpd.read_file(input_geojson_path)
-logger.info(f"Motorway data loaded: {len(motorway_gdf)} features")
+def connected_components(count, pairs):
+    # Union-find over candidate pairs; returns a list of index arrays, one per component
+    parent = np.arange(count)
 
-# Check CRS and reproject if necessary
-if motorway_gdf.crs != "EPSG:25832":
-    motorway_gdf = motorway_gdf.to_crs("EPSG:25832")
-    logger.info(f"Data reprojected to EPSG:25832")
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
 
-# Merge the parallel lines into a single centerline
-centerline = create_centerline(motorway_gdf, buffer_distance)
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    roots = np.array([find(i) for i in range(count)])
+    order = np.argsort(roots, kind="stable")
+    _, starts = np.unique(roots[order], return_index=True)
+    return np.split(order, starts[1:])
 
-# Simplify the centerline
-simplified_centerline = simplify_centerline(centerline, simplify_tolerance)
+def chained_pairs(lines, pairs):
+    """
+    Flags candidate pairs that are consecutive ways of the same carriageway.
 
-# Create a GeoDataFrame to save the result
-centerline_gdf = gpd.GeoDataFrame(geometry=[simplified_centerline], crs=motorway_gdf.crs)
+    Two ways are chained when one ends where the other starts and the road continues
+    in roughly the same direction. Opposite carriageways meeting where a divided road
+    becomes single (one ends and the other starts at the node, but they turn back on
+    each other) are not chained.
+    """
+    if len(pairs) == 0:
+        return np.zeros(0, dtype=bool)
+    coordinates = [shapely.get_coordinates(line) for line in lines]
+    starts = np.array([coords[0] for coords in coordinates])
+    ends = np.array([coords[-1] for coords in coordinates])
+    first_steps = np.array([coords[1] - coords[0] for coords in coordinates])
+    last_steps = np.array([coords[-1] - coords[-2] for coords in coordinates])
 
-# Save the centerline to a new GeoJSON file
-centerline_gdf.to_file(output_geojson_path, driver='GeoJSON')
-logger.info(f"Centerline created and saved successfully to {output_geojson_path}")
+    i, j = pairs[:, 0], pairs[:, 1]
+    i_into_j = np.all(ends[i] == starts[j], axis=1) & (np.sum(last_steps[i] * first_steps[j], axis=1) > 0)
+    j_into_i = np.all(ends[j] == starts[i], axis=1) & (np.sum(last_steps[j] * first_steps[i], axis=1) > 0)
+    return i_into_j | j_into_i
+
+def pair_samples(line_a, line_b, pair_distance, resample_distance, min_cos, require_opposite=True):
+    """
+    Matches two carriageways sample by sample, or returns None if they do not form a pair.
+
+    The shorter line is resampled every resample_distance meters and each sample is
+    matched with the nearest point on the other line. Samples further apart than
+    pair_distance or beyond the end of the other line are not paired, and the pair is
+    rejected if the local headings are not (anti-)parallel.
+
+    Returns:
+    samples (numpy.ndarray): Numbers of the paired samples; consecutive numbers are adjacent.
+    along_a, along_b (numpy.ndarray): Distance along line_a and line_b of each paired sample.
+    midpoints (numpy.ndarray): Coordinates of the median line at each paired sample.
+    """
+    reference, other = (line_a, line_b) if line_a.length <= line_b.length else (line_b, line_a)
+    sample_count = max(int(reference.length // resample_distance), 1) + 1
+    distances = np.linspace(0, reference.length, sample_count)
+    points = shapely.line_interpolate_point(reference, distances)
+    positions = shapely.line_locate_point(other, points)
+    nearest = shapely.line_interpolate_point(other, positions)
+    # Samples projecting onto an end point of the other line lie beyond its extent
+    within = ((shapely.distance(points, nearest) <= pair_distance) &
+              (positions > 0) & (positions < other.length))
+    if within.sum() < 2:
+        return None
+
+    # Compare local headings from a one meter step along both lines
+    step = min(1.0, reference.length / 2)
+    heading_a = shapely.get_coordinates(shapely.line_interpolate_point(reference, np.minimum(distances + step, reference.length))) - shapely.get_coordinates(points)
+    heading_b = shapely.get_coordinates(shapely.line_interpolate_point(other, np.minimum(positions + step, other.length))) - shapely.get_coordinates(nearest)
+    norms = np.linalg.norm(heading_a, axis=1) * np.linalg.norm(heading_b, axis=1)
+    valid = within & (norms > 0)
+    if valid.sum() < 2:
+        return None
+    mean_cos = np.mean(np.sum(heading_a[valid] * heading_b[valid], axis=1) / norms[valid])
+    if (-mean_cos if require_opposite else abs(mean_cos)) < min_cos:
+        return None
+
+    samples = np.flatnonzero(within)
+    midpoints = (shapely.get_coordinates(points[within]) + shapely.get_coordinates(nearest[within])) / 2
+    if reference is line_a:
+        return samples, distances[within], positions[within], midpoints
+    return samples, positions[within], distances[within], midpoints
+
+def covered(intervals, values):
+    # Whether each value lies strictly inside one of the (start, end) intervals
+    result = np.zeros(len(values), dtype=bool)
+    for start, end in intervals:
+        result |= (values > start) & (values < end)
+    return result
+
+def uncovered(intervals, length, min_length):
+    # The (start, end) parts of [0, length] outside the intervals that are longer than min_length
+    parts, position = [], 0.0
+    for start, end in sorted(intervals):
+        if start - position > min_length:
+            parts.append((position, start))
+        position = max(position, end)
+    if length - position > min_length:
+        parts.append((position, length))
+    return parts
+
+def centerlines_for_component(lines, candidate_pairs, pair_distance, resample_distance, min_cos, require_opposite=True):
+    """
+    Pairs the carriageways of one connected component and returns their median lines.
+
+    Pairs are taken in order of their number of paired samples. Each median covers a
+    span of both its lines, and the samples of later pairs that fall in a span already
+    covered are dropped, so a line with several partners gets medians that meet
+    instead of overlapping. Every run of consecutive paired samples becomes a median.
+    The parts of a line outside its covered spans are passed through unchanged as
+    unpaired segments. Parts up to twice resample_distance long are dropped: samples
+    are less than that apart, so a median ends up to that far short of its line ends.
+
+    Returns:
+    segments (list): (source indices, geometry, paired) per output road segment, with
+        indices local to lines. Lines without a partner are passed through unchanged.
+    """
+    matches = []
+    for i, j in candidate_pairs:
+        match = pair_samples(lines[i], lines[j], pair_distance, resample_distance, min_cos, require_opposite)
+        if match is not None:
+            matches.append(((i, j), match))
+    matches.sort(key=lambda item: -len(item[1][0]))
+
+    segments = []
+    spans = [[] for _ in lines]  # Covered (start, end) distances along each line
+    for (i, j), (samples, along_i, along_j, midpoints) in matches:
+        free = ~(covered(spans[i], along_i) | covered(spans[j], along_j))
+        indices = np.flatnonzero(free)
+        for run in np.split(indices, np.flatnonzero(np.diff(samples[indices]) != 1) + 1):
+            if len(run) < 2:
+                continue
+            segments.append(((i, j), LineString(midpoints[run]), True))
+            spans[i].append((along_i[run].min(), along_i[run].max()))
+            spans[j].append((along_j[run].min(), along_j[run].max()))
+
+    for i, line in enumerate(lines):
+        if not spans[i]:
+            segments.append(((i,), line, False))
+            continue
+        for start, end in uncovered(spans[i], line.length, 2 * resample_distance):
+            segments.append(((i,), substring(line, start, end), False))
+    return segments
+
+@instrumentation.instrumented()
+def create_centerlines(motorway_gdf, pair_distance=pair_distance, resample_distance=resample_distance, max_angle=max_angle, max_workers=None, require_opposite=True, executor=None):
+    """
+    Collapses divided carriageways into centerlines, one feature per road segment.
+
+    Carriageways within pair_distance of each other are found with an STRtree and grouped
+    into connected components, which are paired and averaged independently in a process pool.
+
+    Parameters:
+    motorway_gdf (geopandas.GeoDataFrame): Line features in a projected CRS (meters).
+    pair_distance (float): Maximum distance between paired carriageways.
+    resample_distance (float): Sample spacing along the carriageways.
+    max_angle (float): Maximum deviation in degrees from anti-parallel (or parallel if
+        require_opposite is False) for two carriageways to be paired.
+    max_workers (int, optional): Number of worker processes; 1 runs in-process.
+    executor (concurrent.futures.Executor, optional): Pool to use instead of starting one,
+        e.g. shared by many calls.
+
+    Returns:
+    centerline_gdf (geopandas.GeoDataFrame): Centerlines with the attributes of the first
+        source line, the 'source_ids' of the input rows and a 'paired' flag.
+    timings (dict): Seconds spent per stage.
+    """
+    timings = {}
+    start = time.perf_counter()
+    lines_gdf = motorway_gdf[motorway_gdf.is_valid & ~motorway_gdf.is_empty].explode(index_parts=False)
+    lines_gdf = lines_gdf[lines_gdf.geom_type == "LineString"]
+    lines = lines_gdf.geometry.values.to_numpy()
+    timings["prepare"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tree = shapely.STRtree(lines)
+    left, right = tree.query(lines, predicate="dwithin", distance=pair_distance)
+    keep = left < right
+    candidate_pairs = np.column_stack((left[keep], right[keep]))
+    # Consecutive ways of one carriageway are never pairs, and keeping them would
+    # join the whole network into a single component
+    candidate_pairs = candidate_pairs[~chained_pairs(lines, candidate_pairs)]
+    timings["index"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    components = connected_components(len(lines), candidate_pairs)
+    local_index = np.empty(len(lines), dtype=np.int64)
+    component_of = np.empty(len(lines), dtype=np.int64)
+    for number, members in enumerate(components):
+        local_index[members] = np.arange(len(members))
+        component_of[members] = number
+    pairs_by_component = [[] for _ in components]
+    for i, j in candidate_pairs:
+        pairs_by_component[component_of[i]].append((local_index[i], local_index[j]))
+    timings["components"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    min_cos = np.cos(np.radians(max_angle))
+    arguments = ([lines[members] for members in components], pairs_by_component,
+                 [pair_distance] * len(components), [resample_distance] * len(components),
+                 [min_cos] * len(components), [require_opposite] * len(components))
+    if executor is not None:
+        results = list(executor.map(centerlines_for_component, *arguments, chunksize=64))
+    elif max_workers == 1:
+        results = list(map(centerlines_for_component, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(centerlines_for_component, *arguments, chunksize=64))
+    timings["median"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows, geometries, source_ids, paired = [], [], [], []
+    for members, segments in zip(components, results):
+        for local_ids, geometry, is_paired in segments:
+            sources = members[list(local_ids)]
+            rows.append(sources[0])
+            geometries.append(geometry)
+            source_ids.append(",".join(str(lines_gdf.index[source]) for source in sources))
+            paired.append(is_paired)
+    centerline_gdf = gpd.GeoDataFrame(lines_gdf.iloc[rows].drop(columns=lines_gdf.geometry.name).reset_index(drop=True),
+                                      geometry=geometries, crs=lines_gdf.crs)
+    centerline_gdf["source_ids"] = source_ids
+    centerline_gdf["paired"] = paired
+    timings["assemble"] = time.perf_counter() - start
+
+    instrumentation.count("features", len(lines))
+    for stage, seconds in timings.items():
+        logger.info(f"Stage {stage}: {seconds:.2f} s")
+    logger.info(f"{len(lines)} carriageways -> {len(centerline_gdf)} centerline segments ({sum(paired)} paired)")
+    return centerline_gdf, timings
+
+def create_centerlines_windowed(input_path, window_size, pair_distance=pair_distance, resample_distance=resample_distance,
+                                max_angle=max_angle, max_workers=None, require_opposite=True):
+    """
+    Out-of-core create_centerlines for layers larger than memory, window by window.
+
+    The layer is split into square windows of window_size. Each window is read together
+    with a margin of pair_distance plus half the largest feature extent, so every
+    carriageway whose bounding box centre lies in the window is read with all its
+    candidate partners. Of the segments computed in a window it keeps those whose
+    lowest-numbered source window is its own, so every segment is written once. The
+    result matches create_centerlines on the whole layer as long as every group of
+    carriageways paired with each other lies within one window and its margin; longer
+    chains of partners, e.g. interchanges spanning several windows, may be split
+    differently at the window borders. Layers without a spatial index are first copied
+    to one (see layer_chunks.indexed_layer), and the windows share one process pool.
+
+    Parameters:
+    input_path (str): Line layer (GeoJSON, GeoParquet or FlatGeobuf) in a projected CRS (meters).
+    window_size (float): Window edge length in meters; bounds the features held in memory.
+
+    Returns:
+    centerlines (iterator): Centerline GeoDataFrames per window, as from create_centerlines.
+        Their 'source_ids' are the feature ids of the layer, i.e. row numbers for
+        GeoParquet, the same as create_centerlines gives for the whole layer read with
+        fid_as_index.
+    """
+    bounds, max_extent, crs, count = scan_layer(input_path)
+    if count == 0:
+        return
+    if crs is not None and crs.is_geographic:
+        raise ValueError(f"{input_path} is in a geographic CRS; reproject it to EPSG:25832 first")
+    margin = max_extent / 2 + pair_distance
+    windows = grid_windows(bounds, window_size)
+    logger.info(f"{count} features in {len(windows)} windows of {window_size} m with a margin of {margin:.0f} m")
+
+    # One pool for all windows rather than one per window
+    executor = ProcessPoolExecutor(max_workers=max_workers) if max_workers != 1 else None
+    try:
+        with indexed_layer(input_path) as indexed_path:
+            for number, window in windows:
+                # In layer order, as the spatially indexed copy may hold the features in another
+                window_gdf = read_window(indexed_path, window, margin).sort_index()
+                window_gdf = window_gdf[~window_gdf.geometry.isna() & ~window_gdf.is_empty]
+                owners = window_numbers(window_gdf.geometry.values.to_numpy(), bounds, window_size)
+                if not (owners == number).any():
+                    continue
+                centerline_gdf, _ = create_centerlines(window_gdf, pair_distance, resample_distance, max_angle,
+                                                       max_workers, require_opposite, executor)
+                owner_by_id = dict(zip((str(label) for label in window_gdf.index), owners.tolist()))
+                owned = [min(owner_by_id[source] for source in source_ids.split(",")) == number
+                         for source_ids in centerline_gdf["source_ids"]]
+                yield centerline_gdf[owned].reset_index(drop=True)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Collapse divided motorway carriageways into centerlines.")
+    parser.add_argument("input", nargs="?", default=input_geojson_path, help="Input line GeoJSON")
+    parser.add_argument("output", nargs="?", default=output_geojson_path, help="Output GeoJSON")
+    parser.add_argument("--pair-distance", type=float, default=pair_distance)
+    parser.add_argument("--resample-distance", type=float, default=resample_distance)
+    parser.add_argument("--max-angle", type=float, default=max_angle)
+    parser.add_argument("--simplify-tolerance", type=float, default=simplify_tolerance)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--window-size", type=float, default=None,
+                        help="Process the layer out of core in square windows of this size in meters; "
+                             "the input must be in a projected CRS")
+    args = parser.parse_args()
+
+    if args.window_size:
+        # Write each window's centerlines before the next window is read
+        with LayerWriter(args.output, layer_schema(args.input)) as writer:
+            for centerline_gdf in create_centerlines_windowed(args.input, args.window_size, args.pair_distance,
+                                                              args.resample_distance, args.max_angle, args.workers):
+                centerline_gdf["geometry"] = centerline_gdf.geometry.simplify(args.simplify_tolerance)
+                writer.write(centerline_gdf)
+        logger.info(f"{writer.count} centerlines created and saved successfully to {args.output}")
+        return
+
+    # Load the motorway vector data from GeoJSON
+    motorway_gdf = gpd.read_file(args.input)
+    logger.info(f"Motorway data loaded: {len(motorway_gdf)} features")
+
+    # Check CRS and reproject if necessary
+    if not same_crs(motorway_gdf.crs, "EPSG:25832"):
+        motorway_gdf = reproject_gdf(motorway_gdf, "EPSG:25832")
+        logger.info(f"Data reprojected to EPSG:25832")
+
+    # Merge the parallel lines into centerlines
+    centerline_gdf, timings = create_centerlines(motorway_gdf, args.pair_distance, args.resample_distance,
+                                                 args.max_angle, args.workers)
+
+    # Simplify the centerlines
+    centerline_gdf["geometry"] = centerline_gdf.geometry.simplify(args.simplify_tolerance)
+
+    # Save the centerlines to a new GeoJSON file
+    centerline_gdf.to_file(args.output, driver='GeoJSON')
+    logger.info(f"Centerlines created and saved successfully to {args.output}")
+
+if __name__ == "__main__":
+    main()
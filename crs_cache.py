@@ -0,0 +1,95 @@
+import os
+import re
+import threading
+from functools import lru_cache
+import shapely
+from pyproj import CRS, Transformer
+
+# Maximum number of cached CRS and Transformer objects per process
+CACHE_SIZE = int(os.environ.get("CRS_CACHE_SIZE", 64))
+
+# "EPSG:25832", "epsg:25832", "urn:ogc:def:crs:EPSG::25832", "urn:ogc:def:crs:EPSG:6.6:25832"
+AUTHORITY_PATTERN = re.compile(r'^(?:urn:ogc:def:crs:)?([A-Za-z]+):(?:[\d.]*:)?(\w+)$')
+
+def crs_spec(crs):
+    # A hashable CRS specification: authority strings and codes as given, CRS objects by their input string
+    if isinstance(crs, int):
+        return f"EPSG:{crs}"
+    if isinstance(crs, CRS):
+        return crs.srs
+    if isinstance(crs, dict) and crs.get('type') == 'name':
+        return crs['properties']['name']  # GeoJSON 'crs' member
+    return crs
+
+@lru_cache(maxsize=CACHE_SIZE)
+def get_crs(spec):
+    return CRS.from_user_input(spec)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def authority_code(spec):
+    """
+    Returns "AUTHORITY:CODE" for a CRS specification, or None when it has no authority code.
+
+    Authority strings are parsed without building a pyproj CRS; other specifications
+    (WKT, PROJ strings) are identified once and cached.
+    """
+    if spec is None:
+        return None
+    match = AUTHORITY_PATTERN.match(str(spec).strip())
+    if match:
+        return f"{match.group(1).upper()}:{match.group(2)}"
+    authority = get_crs(spec).to_authority()
+    return f"{authority[0]}:{authority[1]}" if authority else None
+
+def same_crs(source, target):
+    """
+    Returns True when source and target denote the same CRS.
+
+    CRS with authority codes are compared by code; full CRS equality is only used
+    when one of them has no code.
+    """
+    source, target = crs_spec(source), crs_spec(target)
+    if source == target:
+        return True
+    source_code, target_code = authority_code(source), authority_code(target)
+    if source_code is not None and target_code is not None:
+        return source_code == target_code
+    return get_crs(source) == get_crs(target)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _transformer(source, target, always_xy, options, thread_id):
+    return Transformer.from_crs(get_crs(source), get_crs(target), always_xy=always_xy, **dict(options))
+
+def get_transformer(source, target, always_xy=True, **options):
+    """
+    Returns a cached pyproj Transformer from source to target.
+
+    Transformers are kept in a bounded LRU cache keyed by (source, target, options).
+    pyproj transformers must not be shared between threads, so each thread gets its own.
+    """
+    source, target = crs_spec(source), crs_spec(target)
+    return _transformer(authority_code(source) or source, authority_code(target) or target,
+                        always_xy, tuple(sorted(options.items())), threading.get_ident())
+
+def cache_info():
+    return {"crs": get_crs.cache_info(), "authority": authority_code.cache_info(),
+            "transformer": _transformer.cache_info()}
+
+def reproject_gdf(gdf, target_crs, assume_crs=None):
+    """
+    Reprojects a GeoDataFrame with a cached transformer; returns it unchanged when it is already in target_crs.
+
+    Parameters:
+    gdf (geopandas.GeoDataFrame): Data to reproject.
+    target_crs (str or int or pyproj.CRS): Target CRS specification.
+    assume_crs (str or int or pyproj.CRS, optional): CRS of the data when it has none,
+        e.g. "EPSG:4326". Without it, data without CRS raises a ValueError like to_crs.
+    """
+    source_crs = gdf.crs if gdf.crs is not None else assume_crs
+    if source_crs is None:
+        raise ValueError("Cannot transform naive geometries. Please set a crs on the object first.")
+    if same_crs(source_crs, target_crs):
+        return gdf if gdf.crs is not None else gdf.set_crs(get_crs(crs_spec(target_crs)))
+    transformer = get_transformer(source_crs, target_crs)
+    geometries = shapely.transform(gdf.geometry.values.to_numpy(), transformer.transform, interleaved=False)
+    return gdf.set_geometry(geometries, crs=get_crs(crs_spec(target_crs)))
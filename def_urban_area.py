@@ -1,35 +1,216 @@
+import os
 import geopandas as gpd
+import numpy as np
+import shapely
+from concurrent.futures import ProcessPoolExecutor
+from crs_cache import reproject_gdf
+from feature_store import read_layer, write_layer
+from layer_chunks import DEFAULT_CHUNK_SIZE, iter_chunks
+import instrumentation
 from shapely.geometry import shape
 import json
 
-def buffer_and_dissolve(input_geojson, buffer_distance, output_geojson):
+def load_layer(input_geojson):
+    # If input_geojson is a string (file path), load the file into a GeoDataFrame
+    if isinstance(input_geojson, str):
+        return read_layer(input_geojson)
+    elif isinstance(input_geojson, gpd.GeoDataFrame):
+        return input_geojson
+    else:
+        raise TypeError("input_geojson should be either a file path (str) or a GeoDataFrame (geopandas.GeoDataFrame)")
+
+def union_tile(geometries):
+    # Union the geometries of one tile and return the resulting polygons
+    return shapely.get_parts(shapely.union_all(geometries))
+
+def assign_tiles(geometries, tile_size):
+    """
+    Groups geometries into square grid tiles by the centre of their bounding box.
+
+    Returns:
+    tiles (list): (cell bounds, geometry array) per non-empty tile.
+    """
+    bounds = shapely.bounds(geometries)
+    centers_x = (bounds[:, 0] + bounds[:, 2]) / 2
+    centers_y = (bounds[:, 1] + bounds[:, 3]) / 2
+    origin_x, origin_y = bounds[:, 0].min(), bounds[:, 1].min()
+    columns = ((centers_x - origin_x) // tile_size).astype(np.int64)
+    rows = ((centers_y - origin_y) // tile_size).astype(np.int64)
+
+    tile_ids = rows * (columns.max() + 1) + columns
+    order = np.argsort(tile_ids, kind="stable")
+    unique_ids, starts = np.unique(tile_ids[order], return_index=True)
+    tiles = []
+    for tile_id, indices in zip(unique_ids, np.split(order, starts[1:])):
+        row, column = divmod(tile_id, columns.max() + 1)
+        cell = (origin_x + column * tile_size, origin_y + row * tile_size,
+                origin_x + (column + 1) * tile_size, origin_y + (row + 1) * tile_size)
+        tiles.append((cell, geometries[indices]))
+    return tiles
+
+def stitch_tiles(tile_results):
+    """
+    Merges per-tile union results into the global union.
+
+    Only polygons that extend beyond their own tile cell can overlap polygons of
+    other tiles. Those are unioned together with the interior polygons they touch;
+    all other interior polygons are already final.
+    """
+    interior, crossing = [], []
+    for cell, parts in tile_results:
+        if len(parts) == 0:
+            continue
+        bounds = shapely.bounds(parts)
+        inside = ((bounds[:, 0] > cell[0]) & (bounds[:, 1] > cell[1]) &
+                  (bounds[:, 2] < cell[2]) & (bounds[:, 3] < cell[3]))
+        interior.append(parts[inside])
+        crossing.append(parts[~inside])
+    if not interior:
+        return np.array([], dtype=object)
+    interior = np.concatenate(interior)
+    crossing = np.concatenate(crossing)
+    if len(crossing) == 0:
+        return interior
+
+    # Interior polygons touched by a crossing polygon take part in the final merge
+    _, touched = shapely.STRtree(interior).query(crossing, predicate="intersects")
+    touched = np.unique(touched)
+    untouched = np.ones(len(interior), dtype=bool)
+    untouched[touched] = False
+
+    merged = union_tile(np.concatenate([crossing, interior[touched]]))
+    return np.concatenate([interior[untouched], merged])
+
+def dissolve_tiled(geometries, tile_size=None, max_workers=None):
+    """
+    Unions geometries tile by tile in a process pool and stitches the tiles together.
+
+    Parameters:
+    geometries (numpy.ndarray): Array of shapely geometries.
+    tile_size (float, optional): Tile edge length in CRS units. By default the extent is
+        split into roughly 16 tiles per worker.
+    max_workers (int, optional): Number of worker processes.
+
+    Returns:
+    dissolved (shapely.Geometry): The union of all geometries.
+    """
+    geometries = geometries[~shapely.is_empty(geometries) & ~shapely.is_missing(geometries)]
+    if len(geometries) == 0:
+        return shapely.union_all(geometries)
+    if tile_size is None:
+        xmin, ymin, xmax, ymax = shapely.total_bounds(geometries)
+        tile_count = 16 * (max_workers or os.cpu_count() or 1)
+        tile_size = max(xmax - xmin, ymax - ymin, 1.0) / np.sqrt(tile_count)
+
+    tiles = assign_tiles(geometries, tile_size)
+    cells = [cell for cell, _ in tiles]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        tile_parts = list(executor.map(union_tile, [tile for _, tile in tiles]))
+
+    parts = stitch_tiles(list(zip(cells, tile_parts)))
+    return shapely.multipolygons(parts) if len(parts) > 1 else parts[0]
+
+def merge_parts(parts, new_parts):
+    """
+    Adds the union of new_parts to disjoint polygons parts, keeping them disjoint.
+
+    Only the parts intersecting the new polygons are unioned again, so the cost of a
+    merge depends on the new polygons rather than on everything merged so far.
+    """
+    new_parts = union_tile(new_parts)
+    if len(parts) == 0:
+        return new_parts
+    _, touched = shapely.STRtree(parts).query(new_parts, predicate="intersects")
+    touched = np.unique(touched)
+    untouched = np.ones(len(parts), dtype=bool)
+    untouched[touched] = False
+    return np.concatenate([parts[untouched], union_tile(np.concatenate([new_parts, parts[touched]]))])
+
+@instrumentation.instrumented()
+def buffer_and_dissolve_chunked(input_file, buffer_distance, output_geojson, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Out-of-core buffer_and_dissolve for layers larger than memory.
+
+    The layer is read in chunks of chunk_size features; each chunk is reprojected,
+    stripped of empty geometries, buffered and unioned into the disjoint polygons of
+    the running result. The final reduction assembles those polygons into one feature,
+    so peak memory is bounded by one chunk plus the dissolved result.
+
+    Parameters:
+    input_file (str): Path to the input file (GeoJSON, GeoParquet or FlatGeobuf).
+    buffer_distance (float): Buffer distance in meters.
+    output_geojson (str): Path to the output file; the extension selects the format.
+    chunk_size (int): Features per chunk.
+    """
+    parts = np.array([], dtype=object)
+    first_row = None
+    for number, chunk in enumerate(iter_chunks(input_file, chunk_size)):
+        instrumentation.count("features", len(chunk))
+        with instrumentation.span("urban_area.reproject"):
+            chunk = reproject_gdf(chunk, 25832)
+        geometries = chunk.geometry.values.to_numpy()
+        present = ~shapely.is_missing(geometries) & ~shapely.is_empty(geometries)
+        if not present.any():
+            continue
+        if first_row is None:
+            first_row = chunk[present].iloc[:1].copy()
+        with instrumentation.span("urban_area.buffer"):
+            buffered = chunk.geometry[present].buffer(buffer_distance).values.to_numpy()
+        with instrumentation.span("urban_area.dissolve", chunked=True):
+            parts = merge_parts(parts, buffered)
+        print(f"Chunk {number}: {len(chunk)} features, {len(parts)} dissolved polygons so far")
+
+    if first_row is None:
+        raise ValueError(f"No geometries in {input_file}")
+    # Same result as dissolve(): one row with the union and the attributes of the first feature
+    first_row['geometry'] = [shapely.multipolygons(parts) if len(parts) > 1 else parts[0]]
+    with instrumentation.span("urban_area.write"):
+        write_layer(first_row, output_geojson)
+
+@instrumentation.instrumented()
+def buffer_and_dissolve(input_geojson, buffer_distance, output_geojson, tiled=False, tile_size=None, max_workers=None,
+                        chunk_size=None):
     """
     Adds a buffer to polygons in a GeoJSON file or GeoDataFrame and dissolves overlapping polygons.
-    
+
     Parameters:
-    input_geojson (str or geopandas.GeoDataFrame): Path to the input GeoJSON file or GeoDataFrame.
+    input_geojson (str or geopandas.GeoDataFrame): Path to the input file (GeoJSON, GeoParquet or FlatGeobuf) or GeoDataFrame.
     buffer_distance (float): Buffer distance in meters.
-    output_geojson (str): Path to the output GeoJSON file.
+    output_geojson (str): Path to the output file; the extension selects the format.
+    tiled (bool): Dissolve tile by tile in a process pool instead of one global union.
+    tile_size (float, optional): Tile edge length in meters for the tiled mode.
+    max_workers (int, optional): Number of worker processes for the tiled mode.
+    chunk_size (int, optional): Read an input file out of core in chunks of this many
+        features (see buffer_and_dissolve_chunked).
     """
-    # If input_geojson is a string (file path), load GeoJSON file into a GeoDataFrame
-    if isinstance(input_geojson, str):
-        layer_A = gpd.read_file(input_geojson)
-    elif isinstance(input_geojson, gpd.GeoDataFrame):
-        layer_A = input_geojson
-    else:
-        raise TypeError("input_geojson should be either a file path (str) or a GeoDataFrame (geopandas.GeoDataFrame)")
+    if chunk_size and isinstance(input_geojson, str):
+        return buffer_and_dissolve_chunked(input_geojson, buffer_distance, output_geojson, chunk_size)
+
+    with instrumentation.span("urban_area.read"):
+        layer_A = load_layer(input_geojson)
+    instrumentation.count("features", len(layer_A))
 
     # Ensure the CRS is in meters (assumes EPSG:25832 based on the example)
-    layer_A = layer_A.to_crs(epsg=25832)
+    with instrumentation.span("urban_area.reproject"):
+        layer_A = reproject_gdf(layer_A, 25832)
 
     # Add a buffer to each polygon
-    layer_A['geometry'] = layer_A['geometry'].buffer(buffer_distance)
+    with instrumentation.span("urban_area.buffer"):
+        layer_A['geometry'] = layer_A['geometry'].buffer(buffer_distance)
 
-    # Dissolve overlapping polygons into a single polygon
-    dissolved_layer_A = layer_A.dissolve()
+    with instrumentation.span("urban_area.dissolve", tiled=tiled):
+        if tiled:
+            # Same result as dissolve(): one row with the union and the attributes of the first feature
+            dissolved = dissolve_tiled(layer_A.geometry.values.to_numpy(), tile_size, max_workers)
+            dissolved_layer_A = layer_A.iloc[:1].copy()
+            dissolved_layer_A['geometry'] = [dissolved]
+        else:
+            # Dissolve overlapping polygons into a single polygon
+            dissolved_layer_A = layer_A.dissolve()
 
-    # Save the resulting GeoDataFrame to a new GeoJSON file
-    dissolved_layer_A.to_file(output_geojson, driver='GeoJSON')
+    # Save the resulting GeoDataFrame in the format given by the output extension
+    with instrumentation.span("urban_area.write"):
+        write_layer(dissolved_layer_A, output_geojson)
 
 # Example usage
 if __name__ == "__main__":
@@ -1,10 +1,14 @@
-import requests
+from overpass_cache import fetch_overpass
 import osm2geojson
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import instrumentation
 
 # Define the function to process an area
-def process_area(area_id, area_name, polygon_type):
+@instrumentation.instrumented()
+def process_area(area_id, area_name, polygon_type, retries=0):
     # Check if the polygon_type is in the form "key=value"
     if "=" in polygon_type:
         print ("found =")
@@ -37,8 +41,19 @@ def process_area(area_id, area_name, polygon_type):
         """
         tag_key = polygon_key
 
-    # Send the request to the Overpass API
-    response = requests.post("http://overpass-api.de/api/interpreter", data=overpass_query)
+    # Send the request to the Overpass API (served from the local cache when available)
+    start = time.perf_counter()
+    response = fetch_overpass(overpass_query, retries=retries)
+    result = {
+        "area_id": area_id,
+        "area_name": area_name,
+        "polygon_type": polygon_type,
+        "output_file": output_file_path,
+        "status_code": response.status_code,
+        "bytes": len(response.content),
+        "from_cache": response.from_cache,
+        "features": 0,
+    }
 
     # Check if the response was successful
     if response.status_code == 200:
@@ -46,7 +61,8 @@ def process_area(area_id, area_name, polygon_type):
         xml_data = response.content.decode('utf-8')
 
         # Convert the XML to GeoJSON using osm2geojson
-        geojson_data = osm2geojson.xml2geojson(xml_data)
+        with instrumentation.span("parse", area_id=area_id, polygon_type=polygon_type):
+            geojson_data = osm2geojson.xml2geojson(xml_data)
 
         # Filter the GeoJSON to include only polygons and multipolygons and include only the user-defined property
         filtered_features = []
@@ -74,10 +90,81 @@ def process_area(area_id, area_name, polygon_type):
         os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
 
         # Save the filtered GeoJSON data to the output file
-        with open(output_file_path, "w", encoding="utf-8") as file:
+        instrumentation.count("features", len(filtered_features))
+        with instrumentation.span("serialize"), open(output_file_path, "w", encoding="utf-8") as file:
             json.dump(filtered_geojson_data, file, ensure_ascii=False, indent=4)
 
+        result["features"] = len(filtered_features)
         print(f"Converted XML to GeoJSON, filtered to polygons, and saved to {output_file_path}")
     else:
         print(f"Error: Overpass API request failed with status code {response.status_code} for area {area_id}")
 
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def job_key(area_id, polygon_type):
+    return f"{area_id}:{polygon_type}"
+
+def load_progress(progress_file):
+    # Keys of jobs recorded as finished by an earlier run
+    finished = set()
+    if os.path.exists(progress_file):
+        with open(progress_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if os.path.exists(record["output_file"]):
+                        finished.add(job_key(record["area_id"], record["polygon_type"]))
+    return finished
+
+def process_areas(jobs, max_workers=4, retries=3, progress_file=os.path.join("data", "data_raw", "landuse_progress.jsonl")):
+    """
+    Runs process_area for many (area_id, area_name, polygon_type) jobs concurrently.
+
+    Requests per Overpass endpoint are limited by overpass_cache.MAX_CONCURRENCY and
+    retried with backoff on rate limiting. Finished jobs are appended to progress_file,
+    so an interrupted run can be resumed and completed jobs are skipped.
+
+    Parameters:
+    jobs (list): (area_id, area_name, polygon_type) tuples.
+    max_workers (int): Number of worker threads.
+    retries (int): Retries per job on 429/504 responses.
+    progress_file (str): JSON lines file recording finished jobs.
+
+    Returns:
+    results (list): One dict per job run, with status_code, bytes, features and seconds.
+    """
+    finished = load_progress(progress_file)
+    pending = [job for job in jobs if job_key(job[0], job[2]) not in finished]
+    print(f"{len(jobs) - len(pending)} of {len(jobs)} jobs already finished, running {len(pending)}")
+
+    os.makedirs(os.path.dirname(progress_file), exist_ok=True)
+    results = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(process_area, *job, retries=retries): job for job in pending}
+        for future in as_completed(futures):
+            area_id, area_name, polygon_type = futures[future]
+            try:
+                result = future.result()
+            except Exception as error:
+                print(f"Error: job {area_name} {polygon_type} failed: {error}")
+                result = {"area_id": area_id, "area_name": area_name, "polygon_type": polygon_type,
+                          "status_code": None, "error": str(error)}
+            results.append(result)
+            if result.get("status_code") == 200:
+                with open(progress_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(result) + "\n")
+
+    print_summary(results, time.perf_counter() - start)
+    return results
+
+def print_summary(results, wall_seconds):
+    print(f"{'area':<20} {'type':<25} {'status':>6} {'seconds':>8} {'bytes':>12} {'features':>9}")
+    for result in results:
+        print(f"{result['area_name']:<20} {result['polygon_type']:<25} {str(result['status_code']):>6} "
+              f"{result.get('seconds', 0):>8.1f} {result.get('bytes', 0):>12} {result.get('features', 0):>9}")
+    total_bytes = sum(result.get('bytes', 0) for result in results)
+    failed = sum(1 for result in results if result.get('status_code') != 200)
+    print(f"{len(results)} jobs, {failed} failed, {total_bytes} bytes in {wall_seconds:.1f} s")
+
@@ -1,9 +1,11 @@
-import requests
+from overpass_cache import OVERPASS_URL, fetch_overpass
 import json
-from geojson import Feature, FeatureCollection, LineString
+from geojson import FeatureCollection
+from osm_assembly import assemble_ways, iter_elements, ways_to_features
+import instrumentation
 
 # Define the Overpass API endpoint
-overpass_url = "http://overpass-api.de/api/interpreter"
+overpass_url = OVERPASS_URL
 
 # Define the Overpass QL query to get primary, secondary, and tertiary roads in Denmark
 overpass_query = """
@@ -25,36 +27,26 @@ out body;
 out skel qt;
 """
 
-# Send the request to the Overpass API
-response = requests.get(overpass_url, params={'data': overpass_query})
+# Send the request to the Overpass API (served from the local cache when available)
+response = fetch_overpass(overpass_query, overpass_url, method='get')
 
 # Check if the request was successful
 if response.status_code == 200:
-    # Parse the JSON response
-    data = response.json()
-
-    # Create a dictionary to store nodes
-    nodes = {}
-    for element in data['elements']:
-        if element['type'] == 'node':
-            nodes[element['id']] = (element['lon'], element['lat'])
+    # Parse the elements incrementally and resolve way nodes with array lookups
+    with instrumentation.span("parse"):
+        ways = assemble_ways(iter_elements(response.content), 'highway')
 
     # Create GeoJSON features for ways
-    features = []
-    for element in data['elements']:
-        if element['type'] == 'way':
-            coordinates = [nodes[node_id] for node_id in element['nodes'] if node_id in nodes]
-            if coordinates:
-                geometry = LineString(coordinates)
-                feature = Feature(geometry=geometry, properties={'highway': element.get('tags', {}).get('highway')})
-                features.append(feature)
+    with instrumentation.span("build_features"):
+        features = ways_to_features(ways, 'highway')
+    instrumentation.count("features", len(features))
 
     # Create a FeatureCollection
     feature_collection = FeatureCollection(features)
 
     # Save the GeoJSON to a file
     output_file = 'raw_data/denmark_roads.geojson'
-    with open(output_file, 'w', encoding='utf-8') as f:
+    with instrumentation.span("serialize"), open(output_file, 'w', encoding='utf-8') as f:
         json.dump(feature_collection, f, ensure_ascii=False, indent=4)
 
     print(f"Data downloaded and saved to {output_file}")
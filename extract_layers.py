@@ -0,0 +1,320 @@
+import argparse
+import os
+import re
+from array import array
+import numpy as np
+import shapely
+from feature_store import write_features
+from geometry_arrays import from_shapely
+from osm_assembly import iter_elements, resolve_node_refs
+from overpass_cache import OVERPASS_URL, fetch_overpass
+
+# The layers of download_roads.py, download_rail.py, download_border and
+# download_landuse.process_area, extracted together from one source
+EXCLUDED_RAIL_SERVICES = "^(yard|siding|spur|crossover|stub|industrial|branch|military|private)$"
+DEFAULT_LAYERS = [
+    {
+        "name": "roads",
+        "elements": ["way"],
+        "geometry": "line",
+        "tag": "highway",
+        "values": ["motorway", "motorway_link", "trunk", "trunk_link", "primary", "primary_link",
+                   "secondary", "secondary_link", "tertiary"],
+        "output": os.path.join("data", "data_raw", "denmark_roads.geojson"),
+    },
+    {
+        "name": "rail",
+        "elements": ["way"],
+        "geometry": "line",
+        "tag": "railway",
+        "values": ["rail", "light_rail"],
+        "exclude": {"service": EXCLUDED_RAIL_SERVICES},
+        "output": os.path.join("data", "data_raw", "railways.geojson"),
+    },
+    {
+        "name": "border",
+        "elements": ["relation"],
+        "geometry": "area",
+        "tag": "boundary",
+        "values": ["administrative"],
+        "require": {"admin_level": "4"},
+        "properties": ["name", "admin_level", "ref"],
+        "output": os.path.join("data", "data_raw", "border.geojson"),
+    },
+]
+
+# Overpass area ids of relations are the relation id plus this offset
+RELATION_AREA_OFFSET = 3600000000
+
+def landuse_layer(area_name, polygon_type, area_id=None):
+    """
+    Layer definition like download_landuse.process_area for a "key" or "key=value" polygon_type.
+
+    With an Overpass area_id (of a relation, e.g. 3600050046 for Denmark) the layer keeps
+    only the ways and relations within that area, as process_area does: Overpass filters
+    them itself, and extracting from a .osm.pbf keeps the features that intersect the
+    area relation's polygon, which must be in the file. Without an area_id the layer
+    holds the polygons of the whole input.
+    """
+    if area_id is not None and area_id <= RELATION_AREA_OFFSET:
+        raise ValueError(f"Area {area_id} is not the area of a relation (relation id + {RELATION_AREA_OFFSET})")
+    if "=" in polygon_type:
+        polygon_key, polygon_value = polygon_type.split("=")
+        values = [polygon_value]
+        file_name = f"{area_name}_{polygon_key}_{polygon_value}.geojson"
+    else:
+        polygon_key, values = polygon_type, None
+        file_name = f"{area_name}_{polygon_key}.geojson"
+    layer = {
+        "name": f"{area_name}_{polygon_type}",
+        "elements": ["way", "relation"],
+        "geometry": "area",
+        "tag": polygon_key,
+        "values": values,
+        "output": os.path.join("data", "data_raw", file_name),
+    }
+    if area_id is not None:
+        layer["area"] = area_id
+    return layer
+
+def matches(layer, element):
+    tags = element.get('tags')
+    if not tags or element['type'] not in layer["elements"]:
+        return False
+    value = tags.get(layer["tag"])
+    if value is None or (layer.get("values") is not None and value not in layer["values"]):
+        return False
+    for key, required in layer.get("require", {}).items():
+        if tags.get(key) != required:
+            return False
+    for key, pattern in layer.get("exclude", {}).items():
+        if key in tags and re.search(pattern, tags[key]):
+            return False
+    return True
+
+def build_overpass_query(layers, area_selector='area["ISO3166-1"="DK"][admin_level=2]', timeout=1800):
+    """
+    One Overpass query selecting the elements of all layers, with the nodes and
+    member ways needed to build their geometries. Layers with an "area" are selected
+    within that Overpass area instead of area_selector.
+    """
+    areas = [f"{area_selector}->.a;"]
+    statements = []
+    for layer in layers:
+        selector = f'["{layer["tag"]}"]'
+        if layer.get("values") is not None:
+            selector = f'["{layer["tag"]}"~"^({"|".join(layer["values"])})$"]'
+        selector += "".join(f'["{key}"="{value}"]' for key, value in layer.get("require", {}).items())
+        area = "a"
+        if layer.get("area") is not None:
+            area = f"a{layer['area']}"
+            if f"area({layer['area']})->.{area};" not in areas:
+                areas.append(f"area({layer['area']})->.{area};")
+        statements.extend(f"  {element}{selector}(area.{area});" for element in layer["elements"])
+    body = "\n".join(statements)
+    declarations = "\n".join(areas)
+    return f"[out:json][timeout:{timeout}];\n{declarations}\n(\n{body}\n);\nout body;\n>;\nout skel qt;\n"
+
+class LayerExtractor:
+    """
+    Routes OSM elements into several layers in a single pass.
+
+    Feed every element (in Overpass JSON form) to add(), in any order, then call
+    finish(). Node coordinates and way node references are kept in flat arrays;
+    only tags of ways and relations that belong to a layer are kept.
+
+    With filter_areas, layers with an "area" keep only the features intersecting the
+    polygon of that area's relation, which has to be among the elements; Overpass
+    responses are already filtered by the query.
+    """
+
+    def __init__(self, layers, filter_areas=False):
+        self.layers = layers
+        self.area_relations = {layer["area"] - RELATION_AREA_OFFSET for layer in layers
+                               if filter_areas and layer.get("area") is not None}
+        self.area_members = {}  # Relation id -> [(way id, role)] of the areas to filter on
+        self.node_ids, self.lons, self.lats = array('q'), array('d'), array('d')
+        self.way_ids, self.refs, self.counts = array('q'), array('q'), array('q')
+        self.tagged_ways = []  # (way index, layer indices, tags)
+        self.relations = []  # (layer indices, tags, [(way id, role)])
+
+    def add(self, element):
+        element_type = element['type']
+        if element_type == 'node':
+            self.node_ids.append(element['id'])
+            self.lons.append(element['lon'])
+            self.lats.append(element['lat'])
+            return
+        layer_indices = [i for i, layer in enumerate(self.layers) if matches(layer, element)]
+        if element_type == 'way':
+            if layer_indices:
+                self.tagged_ways.append((len(self.way_ids), layer_indices, element['tags']))
+            self.way_ids.append(element['id'])
+            self.refs.extend(element['nodes'])
+            self.counts.append(len(element['nodes']))
+        elif element_type == 'relation' and (layer_indices or element['id'] in self.area_relations):
+            members = [(member['ref'], member.get('role', '')) for member in element.get('members', [])
+                       if member['type'] == 'way']
+            if layer_indices:
+                self.relations.append((layer_indices, element['tags'], members))
+            if element['id'] in self.area_relations:
+                self.area_members[element['id']] = members
+
+    def way_lines(self):
+        # Coordinates of every way, indexed like way_ids; ways without nodes get None
+        coords, offsets, keep = resolve_node_refs(self.node_ids, self.lons, self.lats, self.refs, self.counts)
+        lines = np.full(len(keep), None, dtype=object)
+        bounds = offsets.tolist()
+        for way_index, start, end in zip(np.flatnonzero(keep).tolist(), bounds[:-1], bounds[1:]):
+            lines[way_index] = coords[start:end]
+        return lines
+
+    def finish(self):
+        """
+        Builds the geometries and returns {layer name: list of GeoJSON features}.
+        """
+        lines = self.way_lines()
+        way_positions = {way_id: i for i, way_id in enumerate(self.way_ids)}
+        geometries = [[] for _ in self.layers]
+        properties = [[] for _ in self.layers]
+        ids = [[] for _ in self.layers]  # Way ids; features built from relations have none
+
+        for way_index, layer_indices, tags in self.tagged_ways:
+            coords = lines[way_index]
+            if coords is None:
+                continue
+            for i in layer_indices:
+                if self.layers[i]["geometry"] == "line":
+                    geometry = shapely.linestrings(coords) if len(coords) > 1 else None
+                else:
+                    closed = len(coords) >= 4 and np.array_equal(coords[0], coords[-1])
+                    geometry = shapely.polygons(coords) if closed else None
+                if geometry is not None:
+                    geometries[i].append(geometry)
+                    properties[i].append(self.layer_properties(self.layers[i], tags))
+                    ids[i].append(self.way_ids[way_index])
+
+        for layer_indices, tags, members in self.relations:
+            geometry = relation_area(members, lines, way_positions)
+            if geometry is None:
+                continue
+            for i in layer_indices:
+                geometries[i].append(geometry)
+                properties[i].append(self.layer_properties(self.layers[i], tags))
+                ids[i].append(None)
+
+        areas = {}
+        for relation_id in self.area_relations:
+            if relation_id not in self.area_members:
+                raise ValueError(f"Area relation {relation_id} is not in the input")
+            areas[relation_id] = relation_area(self.area_members[relation_id], lines, way_positions)
+            if areas[relation_id] is None:
+                raise ValueError(f"Area relation {relation_id} has no closed outer ring in the input")
+            shapely.prepare(areas[relation_id])
+
+        features = {}
+        for layer, layer_geometries, layer_properties, layer_ids in zip(self.layers, geometries, properties, ids):
+            layer_geometries = np.array(layer_geometries, dtype=object)
+            if layer.get("area") is not None and layer["area"] - RELATION_AREA_OFFSET in areas:
+                inside = shapely.intersects(areas[layer["area"] - RELATION_AREA_OFFSET], layer_geometries)
+                layer_geometries = layer_geometries[inside]
+                layer_properties = [props for props, keep in zip(layer_properties, inside.tolist()) if keep]
+                layer_ids = [way_id for way_id, keep in zip(layer_ids, inside.tolist()) if keep]
+            layer_geometries = from_shapely(layer_geometries)
+            features[layer["name"]] = [
+                {'type': 'Feature', 'geometry': geometry, 'properties': props}
+                for geometry, props in zip(layer_geometries, layer_properties)
+            ]
+            for feature, way_id in zip(features[layer["name"]], layer_ids):
+                if way_id is not None:
+                    feature['id'] = way_id
+        return features
+
+    @staticmethod
+    def layer_properties(layer, tags):
+        # Like the download scripts: only the layer's tag (plus any extra configured tags)
+        keys = [layer["tag"]] + [key for key in layer.get("properties", []) if key != layer["tag"]]
+        return {key: tags[key] for key in keys if key in tags}
+
+def relation_area(members, lines, way_positions):
+    # Polygonize the outer member ways and cut out the inner ones
+    outer, inner = [], []
+    for way_id, role in members:
+        position = way_positions.get(way_id)
+        if position is None or lines[position] is None or len(lines[position]) < 2:
+            continue
+        (inner if role == 'inner' else outer).append(shapely.linestrings(lines[position]))
+    if not outer:
+        return None
+    area = shapely.union_all(shapely.get_parts(shapely.polygonize(outer)))
+    if inner:
+        area = shapely.difference(area, shapely.union_all(shapely.get_parts(shapely.polygonize(inner))))
+    if area.is_empty:
+        return None
+    return area if area.geom_type in ('Polygon', 'MultiPolygon') else None
+
+def extract_from_overpass(layers, content):
+    extractor = LayerExtractor(layers)
+    for element in iter_elements(content):
+        extractor.add(element)
+    return extractor.finish()
+
+def extract_from_pbf(layers, pbf_file):
+    """
+    Extracts the layers from a local .osm.pbf file in one pass; requires pyosmium.
+
+    Layers with an "area" keep the features intersecting its relation's polygon.
+    """
+    import osmium
+
+    extractor = LayerExtractor(layers, filter_areas=True)
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, node):
+            if node.location.valid():
+                extractor.add({'type': 'node', 'id': node.id, 'lon': node.location.lon, 'lat': node.location.lat})
+
+        def way(self, way):
+            extractor.add({'type': 'way', 'id': way.id, 'nodes': [node.ref for node in way.nodes],
+                           'tags': {tag.k: tag.v for tag in way.tags}})
+
+        def relation(self, relation):
+            extractor.add({'type': 'relation', 'id': relation.id,
+                           'members': [{'type': {'n': 'node', 'w': 'way', 'r': 'relation'}[member.type],
+                                        'ref': member.ref, 'role': member.role} for member in relation.members],
+                           'tags': {tag.k: tag.v for tag in relation.tags}})
+
+    Handler().apply_file(pbf_file)
+    return extractor.finish()
+
+def save_layers(layers, features_by_layer):
+    for layer in layers:
+        features = features_by_layer[layer["name"]]
+        write_features(features, layer["output"])
+        print(f"Layer {layer['name']}: {len(features)} features saved to {layer['output']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract roads, rail, borders and landuse in one pass.")
+    parser.add_argument("--pbf", help="Read a local .osm.pbf file instead of querying Overpass")
+    parser.add_argument("--landuse", nargs="*", default=[], metavar="POLYGON_TYPE",
+                        help="Landuse layers as 'key' or 'key=value', e.g. landuse=residential")
+    parser.add_argument("--area-name", default="denmark", help="Name prefix of the landuse outputs")
+    parser.add_argument("--area-id", type=int, default=None,
+                        help="Overpass area id the landuse layers are limited to, e.g. 3600050046; "
+                             "by default they cover the whole input")
+    args = parser.parse_args()
+
+    layers = DEFAULT_LAYERS + [landuse_layer(args.area_name, polygon_type, args.area_id)
+                               for polygon_type in args.landuse]
+    if args.pbf:
+        features_by_layer = extract_from_pbf(layers, args.pbf)
+    else:
+        response = fetch_overpass(build_overpass_query(layers), OVERPASS_URL)
+        if response.status_code != 200:
+            print(f"Error: Overpass API request failed with status code {response.status_code}")
+            return
+        features_by_layer = extract_from_overpass(layers, response.content)
+    save_layers(layers, features_by_layer)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import json
+import os
+import geopandas as gpd
+import pandas as pd
+from geojson_stream import write_feature_collection
+from geometry_arrays import from_shapely, to_shapely
+
+# Supported formats by file extension
+FORMATS = {
+    '.geojson': 'geojson',
+    '.json': 'geojson',
+    '.parquet': 'geoparquet',
+    '.geoparquet': 'geoparquet',
+    '.fgb': 'flatgeobuf',
+}
+
+def format_of(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Unsupported feature store format '{extension}' for {path}, expected one of {sorted(FORMATS)}")
+    return FORMATS[extension]
+
+def is_geojson(path):
+    return format_of(path) == 'geojson'
+
+def write_layer(gdf, path):
+    """
+    Writes a GeoDataFrame in the format given by the file extension.
+
+    GeoParquet files get a bbox covering column and FlatGeobuf files a packed Hilbert
+    R-tree, so both support bounding-box filtered reads.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)  # Ensure the directory exists
+    file_format = format_of(path)
+    if file_format == 'geoparquet':
+        gdf.to_parquet(path, write_covering_bbox=True)
+    elif file_format == 'flatgeobuf':
+        gdf.to_file(path, driver='FlatGeobuf', SPATIAL_INDEX='YES')
+    else:
+        gdf.to_file(path, driver='GeoJSON')
+
+def read_layer(path, columns=None, bbox=None, memory_map=False):
+    """
+    Reads a layer into a GeoDataFrame.
+
+    Parameters:
+    path (str): Path to a GeoJSON, GeoParquet or FlatGeobuf file.
+    columns (list, optional): Attribute columns to read; the geometry is always read.
+    bbox (tuple, optional): (minx, miny, maxx, maxy) filter. GeoParquet skips row groups
+        and FlatGeobuf uses its spatial index; GeoJSON has to scan every feature.
+    memory_map (bool): Memory-map GeoParquet files instead of reading them into buffers.
+
+    Returns:
+    gdf (geopandas.GeoDataFrame): The features that were read.
+    """
+    file_format = format_of(path)
+    if file_format == 'geoparquet':
+        if columns is not None:
+            columns = list(columns) + ['geometry']
+        return gpd.read_parquet(path, columns=columns, bbox=bbox, memory_map=memory_map)
+    return gpd.read_file(path, columns=columns, bbox=bbox)
+
+def features_to_gdf(features, crs=None):
+    # Build a GeoDataFrame from GeoJSON feature dicts with one bulk geometry conversion
+    features = [feature for feature in features if feature.get('geometry') is not None]
+    properties = pd.DataFrame([feature.get('properties') or {} for feature in features])
+    geometry = to_shapely([feature['geometry'] for feature in features])
+    return gpd.GeoDataFrame(properties, geometry=geometry, crs=crs)
+
+def gdf_to_features(gdf):
+    # Inverse of features_to_gdf; missing attribute values are dropped like absent tags
+    attributes = gdf.drop(columns=gdf.geometry.name)
+    records = attributes.astype(object).where(attributes.notna(), None).to_dict('records')
+    geometries = from_shapely(gdf.geometry.values.to_numpy())
+    return [
+        {'type': 'Feature', 'geometry': geometry,
+         'properties': {key: value for key, value in record.items() if value is not None}}
+        for geometry, record in zip(geometries, records)
+    ]
+
+def crs_from_member(crs_member):
+    # CRS of a GeoJSON 'crs' member such as {"type": "name", "properties": {"name": "EPSG:25832"}}
+    if not crs_member:
+        return None
+    return crs_member.get('properties', {}).get('name')
+
+def write_features(features, path, crs_member=None):
+    """
+    Writes GeoJSON feature dicts in the format given by the file extension.
+    """
+    if is_geojson(path):
+        return write_feature_collection(path, features, crs=crs_member)
+    gdf = features_to_gdf(features, crs=crs_from_member(crs_member))
+    write_layer(gdf, path)
+    return len(gdf)
+
+def read_features(path, columns=None, bbox=None):
+    """
+    Reads a layer as a GeoJSON-like dict with 'features' (and 'crs' when known).
+    """
+    if is_geojson(path) and columns is None and bbox is None:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    gdf = read_layer(path, columns=columns, bbox=bbox)
+    data = {"type": "FeatureCollection", "features": gdf_to_features(gdf)}
+    if gdf.crs is not None:
+        authority = gdf.crs.to_authority()
+        name = f"urn:ogc:def:crs:{authority[0]}::{authority[1]}" if authority else gdf.crs.to_string()
+        data["crs"] = {"type": "name", "properties": {"name": name}}
+    return data
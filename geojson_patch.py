@@ -0,0 +1,203 @@
+import os
+import numpy as np
+from geojson_stream import FeatureCollectionWriter, iter_features, read_member
+
+WHITESPACE = b' \t\r\n'
+
+# Blanked bytes, as a share of the file, above which a patch rewrites the layer compactly
+COMPACT_RATIO = 0.5
+
+def index_path(path):
+    return f"{path}.ids.npz"
+
+class FeatureIdIndex:
+    """
+    Byte range of every feature of a GeoJSON FeatureCollection, sorted by feature id.
+
+    The index is kept next to the layer as <layer>.ids.npz and is only valid for the
+    file size and modification time it was saved with.
+    """
+
+    def __init__(self, ids, starts, ends, footer, blank=0):
+        self.ids = ids
+        self.starts = starts
+        self.ends = ends
+        self.footer = footer  # Byte offset of the closing brackets
+        self.blank = blank  # Bytes of removed features that were blanked out
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_positions(cls, ids, positions, footer):
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+        order = np.argsort(ids, kind='stable')
+        ids = ids[order]
+        if len(ids) and (ids[1:] == ids[:-1]).any():
+            raise ValueError(f"Duplicate feature ids, e.g. {ids[1:][ids[1:] == ids[:-1]][0]}")
+        return cls(ids, positions[order, 0], positions[order, 1], footer)
+
+    def save(self, path):
+        stat = os.stat(path)
+        np.savez(index_path(path), ids=self.ids, starts=self.starts, ends=self.ends,
+                 layout=np.array([self.footer, self.blank, stat.st_size, stat.st_mtime_ns]))
+
+    @classmethod
+    def load(cls, path):
+        # The index of path, or None when there is none or the layer changed since
+        if not os.path.exists(index_path(path)) or not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        with np.load(index_path(path)) as data:
+            footer, blank, size, mtime_ns = data['layout'].tolist()
+            if [size, mtime_ns] != [stat.st_size, stat.st_mtime_ns]:
+                return None
+            return cls(data['ids'], data['starts'], data['ends'], footer, blank)
+
+def feature_id(feature):
+    # Patching matches features by an integer 'id', e.g. the OSM way id
+    value = feature.get('id')
+    if isinstance(value, bool) or not isinstance(value, (int, np.integer)):
+        raise ValueError(f"Feature without an integer 'id' ({value!r}); layers can only be patched by id")
+    return int(value)
+
+def write_indexed(path, features, crs=None):
+    """
+    Writes features to a GeoJSON layer together with their id index.
+
+    Returns:
+    index (FeatureIdIndex): The index that was saved next to the layer.
+    """
+    ids = []
+
+    def checked(features):
+        for feature in features:
+            ids.append(feature_id(feature))
+            yield feature
+
+    with FeatureCollectionWriter(path, crs, record_positions=True) as writer:
+        writer.write_all(checked(features))
+    index = FeatureIdIndex.from_positions(ids, writer.positions, writer.footer)
+    index.save(path)
+    return index
+
+def reindex(path):
+    """
+    Rewrites a GeoJSON layer one feature per line and indexes it, streaming the features.
+
+    Raises ValueError, leaving the layer untouched, if a feature has no integer id.
+    """
+    return write_indexed(path, iter_features(path), read_member(path, 'crs'))
+
+def read_back(f, position):
+    # (offset, byte) of the last non-whitespace byte before position
+    while position > 0:
+        start = max(position - 4096, 0)
+        f.seek(start)
+        block = f.read(position - start).rstrip(WHITESPACE)
+        if block:
+            return start + len(block) - 1, block[-1:]
+        position = start
+    return None, b''
+
+def read_forward(f, position):
+    # (offset, byte) of the first non-whitespace byte from position on
+    f.seek(position)
+    while True:
+        block = f.read(4096)
+        if not block:
+            return None, b''
+        stripped = block.lstrip(WHITESPACE)
+        if stripped:
+            return position + len(block) - len(stripped), stripped[:1]
+        position += len(block)
+
+def blank_feature(f, start, end):
+    """
+    Overwrites one feature and one adjacent comma of the features array with spaces, so
+    the array stays valid JSON. Returns the number of bytes blanked.
+    """
+    f.seek(start)
+    f.write(b' ' * (end - start))
+    comma, byte = read_back(f, start)
+    if byte == b'[':
+        comma, byte = read_forward(f, end)
+        if byte == b']':
+            return end - start  # It was the only feature
+    if byte != b',':
+        raise ValueError(f"Unexpected {byte!r} next to a feature; the layer is not a plain features array")
+    f.seek(comma)
+    f.write(b' ')
+    return end - start + 1
+
+def patch_layer(path, features, removed_ids, crs=None):
+    """
+    Replaces, removes and appends features of a GeoJSON layer by id, in place.
+
+    Features whose id is in removed_ids or among the new features are blanked out with
+    whitespace and the new features are appended before the closing brackets, so the
+    cost depends on the number of changed features rather than on the size of the
+    layer. The byte range of every feature is kept in <layer>.ids.npz; a layer without a
+    current index is indexed once (a streamed rewrite), and layers with features
+    without an integer id are refused. When more than COMPACT_RATIO of the file is
+    blank it is rewritten compactly.
+
+    The layer is patched in place, not atomically. The new features are appended before
+    the old ones are blanked, so an interrupted patch never loses features, but it can
+    leave invalid JSON, or valid JSON holding the old and the new version of a feature
+    under the same id, which reindex refuses. Either way the layer has to be rebuilt,
+    e.g. with incremental_update.py init.
+
+    Returns:
+    replaced (int): Number of existing features that were removed or replaced.
+    added (int): Number of features written.
+    """
+    features = list(features)
+    if not os.path.exists(path):
+        write_indexed(path, features, crs)
+        return 0, len(features)
+    index = FeatureIdIndex.load(path) or reindex(path)
+
+    new_ids = np.array([feature_id(feature) for feature in features], dtype=np.int64)
+    if len(np.unique(new_ids)) != len(new_ids):
+        raise ValueError(f"Duplicate ids among the features to patch into {path}")
+    replaced = np.unique(np.concatenate([np.array(sorted(removed_ids), dtype=np.int64), new_ids]))
+    positions = np.searchsorted(index.ids, replaced)
+    found = positions < len(index.ids)
+    found[found] = index.ids[positions[found]] == replaced[found]
+    positions = positions[found]
+
+    with open(path, 'r+b') as f:
+        # Append the new features
+        f.seek(index.footer)
+        offset, appended = index.footer, []
+        for i, feature in enumerate(features):
+            if len(index) or i:
+                f.write(b',\n')
+                offset += 2
+            text = FeatureCollectionWriter.serialize(feature).encode('utf-8')
+            f.write(text)
+            appended.append((offset, offset + len(text)))
+            offset += len(text)
+        f.write(b'\n]}\n')
+        f.truncate()
+
+        # Blank the removed and replaced features
+        blank = index.blank
+        for start, end in zip(index.starts[positions].tolist(), index.ends[positions].tolist()):
+            blank += blank_feature(f, start, end)
+
+    keep = np.ones(len(index), dtype=bool)
+    keep[positions] = False
+    appended = np.array(appended, dtype=np.int64).reshape(-1, 2)
+    order = np.argsort(new_ids, kind='stable')
+    ids = index.ids[keep]
+    inserts = np.searchsorted(ids, new_ids[order])
+    index = FeatureIdIndex(np.insert(ids, inserts, new_ids[order]),
+                           np.insert(index.starts[keep], inserts, appended[order, 0]),
+                           np.insert(index.ends[keep], inserts, appended[order, 1]), offset, blank)
+    index.save(path)
+    if blank > COMPACT_RATIO * offset:
+        reindex(path)
+    return len(positions), len(features)
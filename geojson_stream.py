@@ -0,0 +1,132 @@
+import json
+import os
+import ijson
+
+def iter_features(input_file):
+    """
+    Yields the features of a GeoJSON FeatureCollection one at a time.
+
+    The 'features' array is parsed incrementally, so memory use is bounded by the
+    largest single feature rather than by the size of the file.
+
+    Parameters:
+    input_file (str): Path to the input GeoJSON file.
+    """
+    with open(input_file, 'rb') as f:
+        yield from ijson.items(f, 'features.item', use_float=True)
+
+def read_member(input_file, member, default=None):
+    """
+    Returns a top-level member (e.g. 'crs') of a GeoJSON file without loading the features.
+
+    Only the members before 'features' are read, as every writer of this project (and
+    GDAL) puts them there; the features array is never parsed.
+    """
+    with open(input_file, 'rb') as f:
+        events = ijson.parse(f, use_float=True)
+        for prefix, event, value in events:
+            if prefix != '' or event != 'map_key':
+                continue
+            if value == 'features':
+                return default
+            if value == member:
+                builder = ijson.ObjectBuilder()
+                depth = 0
+                for _, event, value in events:
+                    builder.event(event, value)
+                    if event in ('start_map', 'start_array'):
+                        depth += 1
+                    elif event in ('end_map', 'end_array'):
+                        depth -= 1
+                    if depth == 0:
+                        return builder.value
+    return default
+
+class FeatureCollectionWriter:
+    """
+    Writes a GeoJSON FeatureCollection incrementally, one feature per line.
+
+    The features go to a temporary file next to output_file that replaces it only when
+    the writer is closed without an error; abort() (or an exception inside a with block)
+    deletes it, so a failed run never leaves a truncated but valid-looking collection.
+
+    Parameters:
+    output_file (str): Path to the output GeoJSON file.
+    crs (dict, optional): GeoJSON 'crs' member written before the features.
+    record_positions (bool): Record the byte range of every feature in positions.
+    """
+
+    def __init__(self, output_file, crs=None, record_positions=False):
+        self.output_file = output_file
+        self.crs = crs
+        self.count = 0
+        self.temporary_file = f"{output_file}.tmp"
+        self.positions = [] if record_positions else None
+        self.footer = None  # Byte offset of the closing brackets, when recording positions
+        self._offset = 0
+        self._file = None
+
+    def _write(self, text):
+        self._file.write(text)
+        if self.positions is not None:
+            self._offset += len(text.encode('utf-8'))
+
+    def open(self):
+        directory = os.path.dirname(self.output_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)  # Ensure the directory exists
+        self._file = open(self.temporary_file, 'w', encoding='utf-8')
+        self._write('{"type": "FeatureCollection", ')
+        if self.crs is not None:
+            self._write(f'"crs": {json.dumps(self.crs)}, ')
+        self._write('"features": [\n')
+        return self
+
+    @staticmethod
+    def serialize(feature):
+        return json.dumps(feature, ensure_ascii=False)
+
+    def write(self, feature):
+        if self.count:
+            self._write(',\n')
+        start = self._offset
+        self._write(self.serialize(feature))
+        if self.positions is not None:
+            self.positions.append((start, self._offset))
+        self.count += 1
+
+    def write_all(self, features):
+        for feature in features:
+            self.write(feature)
+
+    def close(self):
+        if self._file is not None:
+            self.footer = self._offset
+            self._write('\n]}\n')
+            self._file.close()
+            self._file = None
+            os.replace(self.temporary_file, self.output_file)
+
+    def abort(self):
+        # Discard the partial output; an existing output_file is left as it was
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self.temporary_file)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_feature_collection(output_file, features, crs=None):
+    """
+    Streams an iterable of features to a GeoJSON file and returns the number written.
+    """
+    with FeatureCollectionWriter(output_file, crs) as writer:
+        writer.write_all(features)
+    return writer.count
@@ -0,0 +1,186 @@
+from itertools import chain
+import numpy as np
+import shapely
+from shapely import GeometryType
+
+# Nesting depth of the 'coordinates' member for each GeoJSON geometry type
+GEOMETRY_DEPTH = {
+    'Point': 0,
+    'MultiPoint': 1,
+    'LineString': 1,
+    'Polygon': 2,
+    'MultiLineString': 2,
+    'MultiPolygon': 3,
+}
+
+# GeoJSON type name of each shapely geometry type handled by the ragged-array conversions
+GEOJSON_TYPES = {
+    GeometryType.POINT: 'Point',
+    GeometryType.MULTIPOINT: 'MultiPoint',
+    GeometryType.LINESTRING: 'LineString',
+    GeometryType.POLYGON: 'Polygon',
+    GeometryType.MULTILINESTRING: 'MultiLineString',
+    GeometryType.MULTIPOLYGON: 'MultiPolygon',
+}
+
+def collect_sequences(coordinates, depth, sequences):
+    # Append the coordinate sequences of one geometry to `sequences` and return
+    # the part layout needed to nest them again
+    if depth == 0:
+        sequences.append([coordinates] if len(coordinates) else [])
+        return None
+    if depth == 1:
+        sequences.append(coordinates)
+        return None
+    if depth == 2:
+        sequences.extend(coordinates)
+        return len(coordinates)
+    ring_counts = []
+    for polygon in coordinates:
+        sequences.extend(polygon)
+        ring_counts.append(len(polygon))
+    return ring_counts
+
+def flatten_geometries(geometries):
+    """
+    Flattens the vertices of GeoJSON geometries into one contiguous coordinate array.
+
+    Parameters:
+    geometries (list): GeoJSON geometry dicts of the types in GEOMETRY_DEPTH.
+
+    Returns:
+    coords (numpy.ndarray): (n, 2) array with all vertices, or (n, 3) when any vertex has
+        a Z coordinate; the Z of 2D vertices in a mixed batch is NaN. Positions beyond Z
+        are dropped.
+    offsets (numpy.ndarray): Start/end offsets of each coordinate sequence in coords.
+    layouts (list): (type, part layout) per geometry, used by rebuild_geometries.
+    """
+    sequences = []
+    layouts = []
+    for geometry in geometries:
+        geometry_type = geometry['type']
+        layout = collect_sequences(geometry['coordinates'], GEOMETRY_DEPTH[geometry_type], sequences)
+        layouts.append((geometry_type, layout))
+
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    np.cumsum([len(sequence) for sequence in sequences], out=offsets[1:])
+    return vertex_array(list(chain.from_iterable(sequences))), offsets, layouts
+
+def vertex_array(vertices):
+    # (n, 2) or (n, 3) array of GeoJSON positions, see flatten_geometries
+    dimensions = set(map(len, vertices))
+    if not dimensions or dimensions == {2}:
+        return np.array(vertices, dtype=float).reshape(-1, 2)
+    if min(dimensions) < 2:
+        raise ValueError(f"GeoJSON positions need at least 2 coordinates, got {min(dimensions)}")
+    if dimensions == {3}:
+        return np.array(vertices, dtype=float)
+    return np.array([(v[0], v[1], v[2] if len(v) > 2 else np.nan) for v in vertices], dtype=float)
+
+def has_missing_z(coords):
+    # True for the coordinates of a batch mixing 2D and 3D vertices
+    return coords.shape[1] == 3 and bool(np.isnan(coords[:, 2]).any())
+
+def is_empty(geometry):
+    return len(geometry['coordinates']) == 0
+
+def rebuild_geometries(coords, offsets, layouts):
+    # Inverse of flatten_geometries: slice coords back into nested GeoJSON geometries.
+    # Vertices become (x, y) tuples like the per-vertex path produced, or (x, y, z) for
+    # vertices with a Z; unlike lists, tuples of floats are not tracked by the garbage collector.
+    if coords.shape[1] == 2:
+        points = list(zip(coords[:, 0].tolist(), coords[:, 1].tolist()))
+    else:
+        points = [(x, y) if z != z else (x, y, z)
+                  for x, y, z in zip(coords[:, 0].tolist(), coords[:, 1].tolist(), coords[:, 2].tolist())]
+    bounds = offsets.tolist()
+    sequences = iter([points[start:end] for start, end in zip(bounds[:-1], bounds[1:])])
+
+    geometries = []
+    for geometry_type, layout in layouts:
+        depth = GEOMETRY_DEPTH[geometry_type]
+        if depth == 0:
+            sequence = next(sequences)
+            coordinates = sequence[0] if sequence else []
+        elif depth == 1:
+            coordinates = next(sequences)
+        elif depth == 2:
+            coordinates = [next(sequences) for _ in range(layout)]
+        else:
+            coordinates = [[next(sequences) for _ in range(ring_count)] for ring_count in layout]
+        geometries.append({'type': geometry_type, 'coordinates': coordinates})
+    return geometries
+
+def ragged_offsets(geometry_type, offsets, layouts):
+    # Convert flatten_geometries offsets/layouts into the offsets of shapely.from_ragged_array
+    if GEOMETRY_DEPTH[geometry_type] == 0:
+        return None
+    if GEOMETRY_DEPTH[geometry_type] == 1:
+        return (offsets,)
+    if GEOMETRY_DEPTH[geometry_type] == 2:
+        return (offsets, np.concatenate([[0], np.cumsum([layout for _, layout in layouts])]))
+    ring_counts = [count for _, layout in layouts for count in layout]
+    polygon_counts = [len(layout) for _, layout in layouts]
+    return (offsets, np.concatenate([[0], np.cumsum(ring_counts)]), np.concatenate([[0], np.cumsum(polygon_counts)]))
+
+def flatten_offsets(geometry_type, offsets, count):
+    # Inverse of ragged_offsets: shapely.to_ragged_array offsets to sequence offsets and layouts
+    depth = GEOMETRY_DEPTH[geometry_type]
+    if depth == 0:
+        return np.arange(count + 1), [(geometry_type, None)] * count
+    if depth == 1:
+        return offsets[0], [(geometry_type, None)] * count
+    if depth == 2:
+        return offsets[0], [(geometry_type, layout) for layout in np.diff(offsets[1]).tolist()]
+    ring_counts = np.diff(offsets[1]).tolist()
+    bounds = offsets[2].tolist()
+    return offsets[0], [(geometry_type, ring_counts[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+def to_shapely(geometries):
+    """
+    Converts GeoJSON geometry dicts into a shapely geometry array.
+
+    Geometries are grouped by type and each group is built with one
+    shapely.from_ragged_array call, with Z when its vertices have one. Empty
+    geometries, groups mixing 2D and 3D geometries and geometries of other types
+    (e.g. GeometryCollection) fall back to shapely.geometry.shape.
+    """
+    result = np.empty(len(geometries), dtype=object)
+    indices_by_type = {}
+    for i, geometry in enumerate(geometries):
+        if geometry['type'] not in GEOMETRY_DEPTH or is_empty(geometry):
+            result[i] = shapely.geometry.shape(geometry)
+            continue
+        indices_by_type.setdefault(geometry['type'], []).append(i)
+    for geometry_type, indices in indices_by_type.items():
+        subset = [geometries[i] for i in indices]
+        coords, offsets, layouts = flatten_geometries(subset)
+        if has_missing_z(coords):
+            result[indices] = [shapely.geometry.shape(geometry) for geometry in subset]
+            continue
+        result[indices] = shapely.from_ragged_array(
+            GeometryType[geometry_type.upper()], coords, ragged_offsets(geometry_type, offsets, layouts))
+    return result
+
+def from_shapely(geometries):
+    """
+    Converts a shapely geometry array into GeoJSON geometry dicts, one type at a time.
+
+    Z coordinates are kept. Empty geometries and geometries of other types (e.g.
+    GeometryCollection) fall back to shapely.geometry.mapping.
+    """
+    result = [None] * len(geometries)
+    type_ids = shapely.get_type_id(geometries)
+    type_ids[shapely.is_empty(geometries)] = -2
+    for type_id in np.unique(type_ids):
+        indices = np.flatnonzero(type_ids == type_id)
+        geometry_type = GEOJSON_TYPES.get(type_id)
+        if geometry_type is None:
+            for i in indices:
+                result[i] = shapely.geometry.mapping(geometries[i])
+            continue
+        _, coords, offsets = shapely.to_ragged_array(geometries[indices])
+        sequence_offsets, layouts = flatten_offsets(geometry_type, offsets, len(indices))
+        for i, geometry in zip(indices, rebuild_geometries(coords, np.asarray(sequence_offsets), layouts)):
+            result[i] = geometry
+    return result
@@ -0,0 +1,470 @@
+import argparse
+import io
+import json
+import os
+import xml.etree.ElementTree as ElementTree
+from array import array
+from datetime import datetime, timezone
+import ijson
+import numpy as np
+from extract_layers import DEFAULT_LAYERS, build_overpass_query
+from feature_store import is_geojson
+from geojson_patch import patch_layer, write_indexed
+from geometry_arrays import rebuild_geometries
+from osm_assembly import iter_elements
+from overpass_cache import OVERPASS_URL, fetch_overpass
+from reproject_and_separate import crs_member, initialize_transformer, process_features, reproject_features
+from simplify import OUTPUT_CRS, simplify_features_vectorized
+
+# The national road layer of download_roads.py
+ROAD_LAYER = next(layer for layer in DEFAULT_LAYERS if layer["name"] == "roads")
+ROAD_TAG = ROAD_LAYER["tag"]
+ROAD_VALUES = ROAD_LAYER["values"]
+AREA_SELECTOR = 'area["ISO3166-1"="DK"][admin_level=2]'
+# (min lon, min lat, max lon, max lat) of Denmark including Bornholm; changes from an
+# .osc file, e.g. a planet diff, are limited to ways with nodes in it
+AREA_BOUNDS = (7.9, 54.5, 15.3, 57.8)
+STORE_FILE = os.path.join("data", "data_raw", "denmark_roads.store.npz")
+STATE_FILE = os.path.join("data", "data_raw", "denmark_roads.state.json")
+
+class Changes:
+    """
+    Node and way changes parsed from an osmChange file or an Overpass augmented diff.
+    """
+
+    def __init__(self):
+        self.nodes = {}  # id -> (lon, lat) for created or modified nodes
+        self.deleted_nodes = set()
+        self.ways = {}  # id -> (node refs, tags) for created or modified ways
+        self.deleted_ways = set()
+        self.timestamp = None
+
+    def __len__(self):
+        return len(self.nodes) + len(self.deleted_nodes) + len(self.ways) + len(self.deleted_ways)
+
+def parse_changes(source):
+    """
+    Parses an osmChange (.osc) file or an Overpass augmented diff (adiff) response.
+
+    Parameters:
+    source (str or bytes): Path to a .osc file, or the XML content itself.
+
+    Returns:
+    changes (Changes): The created, modified and deleted nodes and ways.
+    """
+    stream = io.BytesIO(source) if isinstance(source, bytes) else source
+    changes = Changes()
+    action = None
+    in_old = False
+    for event, element in ElementTree.iterparse(stream, events=("start", "end")):
+        tag = element.tag
+        if event == "start":
+            if tag in ("create", "modify", "delete"):
+                action = tag  # osmChange
+            elif tag == "action":
+                action = element.get("type")  # Augmented diff
+            elif tag == "old":
+                in_old = True
+            elif tag == "meta" and element.get("osm_base"):
+                changes.timestamp = element.get("osm_base")
+            continue
+
+        if tag == "old":
+            in_old = False
+        elif tag in ("node", "way") and not in_old and action is not None:
+            element_id = int(element.get("id"))
+            deleted = action == "delete" or element.get("visible") == "false"
+            if tag == "node":
+                if deleted:
+                    changes.deleted_nodes.add(element_id)
+                elif element.get("lon") is not None:
+                    changes.nodes[element_id] = (float(element.get("lon")), float(element.get("lat")))
+            elif deleted:
+                changes.deleted_ways.add(element_id)
+            else:
+                refs = [int(nd.get("ref")) for nd in element.findall("nd")]
+                tags = {t.get("k"): t.get("v") for t in element.findall("tag")}
+                changes.ways[element_id] = (refs, tags)
+            element.clear()
+        elif tag in ("create", "modify", "delete", "action"):
+            action = None
+    return changes
+
+class WayStore:
+    """
+    Node coordinates and way node references of a layer, kept next to the layer so that
+    changed ways can be rebuilt without re-downloading the whole network.
+
+    Nodes and ways are kept in arrays sorted by id and changes are applied with
+    searchsorted, insert and delete, without rebuilding the store in Python.
+    """
+
+    def __init__(self, node_ids, coords, way_ids, refs, offsets, tag_codes, tag_values):
+        self.node_ids = node_ids  # Sorted
+        self.coords = coords
+        self.way_ids = way_ids  # Sorted
+        self.refs = refs
+        self.offsets = offsets
+        self.tag_codes = tag_codes  # Index into tag_values of the ROAD_TAG value per way, -1 if none
+        self.tag_values = tag_values
+
+    @classmethod
+    def from_elements(cls, elements, tag_key=ROAD_TAG):
+        # Elements are consumed one at a time, e.g. from iter_elements
+        node_ids, lons, lats = array('q'), array('d'), array('d')
+        way_ids, refs, counts, tags = array('q'), array('q'), array('q'), []
+        for element in elements:
+            if element['type'] == 'node':
+                node_ids.append(element['id'])
+                lons.append(element['lon'])
+                lats.append(element['lat'])
+            elif element['type'] == 'way':
+                way_ids.append(element['id'])
+                refs.extend(element['nodes'])
+                counts.append(len(element['nodes']))
+                tags.append(element.get('tags', {}).get(tag_key))
+        return cls.build(node_ids, np.column_stack((np.frombuffer(lons), np.frombuffer(lats))).reshape(-1, 2),
+                         way_ids, refs, counts, tags)
+
+    @classmethod
+    def build(cls, node_ids, coords, way_ids, refs, counts, tags):
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        node_order = np.argsort(node_ids, kind='stable')
+        way_ids = np.asarray(way_ids, dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.int64)
+        starts = np.cumsum(counts) - counts
+
+        # Sort the ways by id and gather their node references in that order
+        order = np.argsort(way_ids, kind='stable')
+        offsets = np.zeros(len(way_ids) + 1, dtype=np.int64)
+        np.cumsum(counts[order], out=offsets[1:])
+        gather = np.repeat(starts[order] - offsets[:-1], counts[order]) + np.arange(offsets[-1])
+        tag_values = sorted({tag for tag in tags if tag is not None})
+        codes = {value: code for code, value in enumerate(tag_values)}
+        tag_codes = np.array([codes.get(tag, -1) for tag in tags], dtype=np.int16).reshape(-1)[order]
+        return cls(node_ids[node_order], np.asarray(coords, dtype=np.float64).reshape(-1, 2)[node_order],
+                   way_ids[order], np.asarray(refs, dtype=np.int64)[gather], offsets, tag_codes, tag_values)
+
+    def save(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Replace the store only once it is completely written
+        temporary = f"{os.path.splitext(path)[0]}.tmp.npz"
+        np.savez(temporary, node_ids=self.node_ids, coords=self.coords, way_ids=self.way_ids, refs=self.refs,
+                 offsets=self.offsets, tag_codes=self.tag_codes, tag_values=np.array(json.dumps(self.tag_values)))
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['node_ids'], data['coords'], data['way_ids'], data['refs'], data['offsets'],
+                       data['tag_codes'], json.loads(str(data['tag_values'])))
+
+    def find(self, sorted_ids, ids):
+        # Positions of ids in sorted_ids and whether they are present
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.searchsorted(sorted_ids, ids)
+        found = positions < len(sorted_ids)
+        found[found] = sorted_ids[positions[found]] == ids[found]
+        return positions, found
+
+    def has_ways(self, way_ids):
+        return self.find(self.way_ids, way_ids)[1]
+
+    def tag_code(self, value):
+        if value is None:
+            return -1
+        if value not in self.tag_values:
+            self.tag_values.append(value)
+        return self.tag_values.index(value)
+
+    def ways_referencing(self, node_ids):
+        # Ids of the ways that reference any of node_ids
+        node_ids = np.unique(np.asarray(list(node_ids), dtype=np.int64))
+        hits = np.flatnonzero(self.find(node_ids, self.refs)[1]) if len(node_ids) else np.zeros(0, dtype=np.int64)
+        return set(self.way_ids[np.unique(np.searchsorted(self.offsets, hits, side='right') - 1)].tolist())
+
+    def layer_ways(self, changes, tag_key=ROAD_TAG, values=ROAD_VALUES):
+        # The changed ways that belong to the layer: id -> (node refs, tag value)
+        return {way_id: (refs, tags.get(tag_key)) for way_id, (refs, tags) in changes.ways.items()
+                if tags.get(tag_key) in values}
+
+    def unresolved(self, changes, tag_key=ROAD_TAG, values=ROAD_VALUES):
+        """
+        Ways that would be in the layer after the changes but reference nodes that are
+        neither in the store nor in the changes (or were deleted).
+
+        Returns:
+        unresolved (dict): way id -> missing node ids.
+        """
+        deleted = np.array(sorted(changes.deleted_nodes - set(changes.nodes)), dtype=np.int64)
+        changed = np.array(sorted(changes.nodes), dtype=np.int64)
+
+        def missing(refs):
+            refs = np.asarray(refs, dtype=np.int64)
+            resolved = (self.find(self.node_ids, refs)[1] & ~np.isin(refs, deleted)) | np.isin(refs, changed)
+            return refs[~resolved].tolist()
+
+        unresolved = {}
+        for way_id, (refs, _) in self.layer_ways(changes, tag_key, values).items():
+            missing_refs = missing(refs)
+            if missing_refs:
+                unresolved[way_id] = missing_refs
+        # Unchanged ways of the store that lose a node
+        for way_id in self.ways_referencing(deleted) - set(changes.ways) - changes.deleted_ways:
+            position = np.searchsorted(self.way_ids, way_id)
+            unresolved[way_id] = missing(self.refs[self.offsets[position]:self.offsets[position + 1]])
+        return unresolved
+
+    def apply(self, changes, tag_key=ROAD_TAG, values=ROAD_VALUES):
+        """
+        Applies changes and returns the ids of the ways whose geometry or tags changed
+        and of the ways that left the layer.
+
+        Raises ValueError, leaving the store unchanged, when a way of the layer would
+        reference a node whose coordinates are unknown, rather than shortening it.
+        """
+        unresolved = self.unresolved(changes, tag_key, values)
+        if unresolved:
+            examples = ", ".join(f"way {way_id} (nodes {refs[:5]})" for way_id, refs in list(unresolved.items())[:10])
+            raise ValueError(f"{len(unresolved)} ways reference nodes that are neither in the store nor in the "
+                             f"changes: {examples}")
+        layer_ways = self.layer_ways(changes, tag_key, values)
+        changed_ids = np.array(sorted(changes.ways), dtype=np.int64)
+        in_store = set(changed_ids[self.has_ways(changed_ids)].tolist())
+        deleted_ids = np.array(sorted(changes.deleted_ways), dtype=np.int64)
+        removed = set(deleted_ids[self.has_ways(deleted_ids)].tolist()) | (in_store - set(layer_ways))
+        moved = self.ways_referencing(set(changes.nodes) | changes.deleted_nodes) - removed
+
+        # Drop removed and replaced ways
+        drop_positions = self.find(self.way_ids, sorted(removed | (in_store & set(layer_ways))))[0]
+        keep = np.ones(len(self.way_ids), dtype=bool)
+        keep[drop_positions] = False
+        counts = np.diff(self.offsets)
+        self.refs = self.refs[np.repeat(keep, counts)]
+        counts, self.way_ids, self.tag_codes = counts[keep], self.way_ids[keep], self.tag_codes[keep]
+
+        # Update moved nodes, drop deleted ones and add the new nodes of the layer's ways
+        node_ids = np.array(sorted(changes.nodes), dtype=np.int64)
+        node_coords = np.array([changes.nodes[node_id] for node_id in node_ids.tolist()]).reshape(-1, 2)
+        positions, found = self.find(self.node_ids, node_ids)
+        self.coords[positions[found]] = node_coords[found]
+        needed = np.isin(node_ids, [ref for refs, _ in layer_ways.values() for ref in refs]) & ~found
+        self.node_ids = np.insert(self.node_ids, positions[needed], node_ids[needed])
+        self.coords = np.insert(self.coords, positions[needed], node_coords[needed], axis=0)
+        deleted = self.find(self.node_ids, sorted(changes.deleted_nodes - set(changes.nodes)))
+        self.node_ids = np.delete(self.node_ids, deleted[0][deleted[1]])
+        self.coords = np.delete(self.coords, deleted[0][deleted[1]], axis=0)
+
+        # Insert the new and modified ways of the layer
+        new_ids = np.array(sorted(layer_ways), dtype=np.int64)
+        new_counts = np.array([len(layer_ways[way_id][0]) for way_id in new_ids.tolist()], dtype=np.int64)
+        new_refs = np.array([ref for way_id in new_ids.tolist() for ref in layer_ways[way_id][0]], dtype=np.int64)
+        new_codes = np.array([self.tag_code(layer_ways[way_id][1]) for way_id in new_ids.tolist()], dtype=np.int16)
+        inserts = np.searchsorted(self.way_ids, new_ids)
+        kept_offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.refs = np.insert(self.refs, np.repeat(kept_offsets[inserts], new_counts), new_refs)
+        self.way_ids = np.insert(self.way_ids, inserts, new_ids)
+        self.tag_codes = np.insert(self.tag_codes, inserts, new_codes)
+        counts = np.insert(counts, inserts, new_counts)
+        self.offsets = np.zeros(len(self.way_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+
+        affected = set(layer_ways) | moved
+        return affected, removed
+
+    def features(self, way_ids, tag_key=ROAD_TAG):
+        # LineString features with the way id as feature id, for the given ways
+        positions = np.searchsorted(self.way_ids, np.array(sorted(way_ids), dtype=np.int64))
+        starts, ends = self.offsets[positions], self.offsets[positions + 1]
+        counts = ends - starts
+        refs = np.concatenate([self.refs[start:end] for start, end in zip(starts, ends)]) if len(positions) else []
+        node_positions, found = self.find(self.node_ids, refs)
+        if not found.all():
+            raise ValueError(f"Ways reference nodes missing from the store: {np.asarray(refs)[~found][:10].tolist()}")
+        offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        geometries = rebuild_geometries(self.coords[node_positions], offsets, [('LineString', None)] * len(positions))
+        return [{'type': 'Feature', 'id': int(self.way_ids[position]), 'geometry': geometry,
+                 'properties': {tag_key: self.tag_values[code] if code >= 0 else None}}
+                for position, code, geometry in zip(positions.tolist(), self.tag_codes[positions].tolist(), geometries)]
+
+    def node_coords(self, refs, nodes):
+        # Known coordinates of refs, from nodes (id -> (lon, lat)) or else the store
+        coords = [nodes[ref] for ref in refs if ref in nodes]
+        positions, found = self.find(self.node_ids, [ref for ref in refs if ref not in nodes])
+        return np.concatenate([np.array(coords).reshape(-1, 2), self.coords[positions[found]]])
+
+def read_state(state_file=STATE_FILE):
+    with open(state_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_state(timestamp, state_file=STATE_FILE):
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump({"timestamp": timestamp}, f, indent=4)
+
+def utc_now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def initialize(content, raw_layer, store_file=STORE_FILE, state_file=STATE_FILE):
+    """
+    Records the baseline of a full Overpass JSON download of the road layer.
+    """
+    # The elements are streamed into the store's arrays
+    store = WayStore.from_elements(iter_elements(content))
+    store.save(store_file)
+    features = store.features(store.way_ids.tolist())
+    # Feature ids are the way ids, and their byte ranges are indexed for patching
+    write_indexed(raw_layer, features)
+    # Overpass puts the database timestamp in the header, before the elements
+    timestamp = next(ijson.items(io.BytesIO(content), 'osm3s.timestamp_osm_base'), None)
+    write_state(timestamp or utc_now(), state_file)
+    print(f"Baseline of {len(features)} ways stored in {store_file}")
+
+def fetch_changes(since):
+    """
+    Fetches the road changes since a timestamp as an Overpass augmented diff.
+    """
+    values = "|".join(ROAD_VALUES)
+    query = (f'[out:xml][timeout:1800][adiff:"{since}"];\n{AREA_SELECTOR}->.a;\n'
+             f'(\n  way["{ROAD_TAG}"~"^({values})$"](area.a);\n);\nout body;\n>;\nout skel qt;\n')
+    # Never from the cache: a cached diff would replay changes older than the current data
+    response = fetch_overpass(query, OVERPASS_URL, use_cache=False)
+    if response.status_code != 200:
+        raise RuntimeError(f"Overpass API request failed with status code {response.status_code}")
+    return parse_changes(response.content)
+
+def fetch_nodes(node_ids, batch_size=10000):
+    """
+    Fetches the current coordinates of nodes by id from the Overpass API.
+
+    Returns:
+    nodes (dict): id -> (lon, lat) of the nodes that exist.
+    """
+    node_ids = sorted(node_ids)
+    nodes = {}
+    for start in range(0, len(node_ids), batch_size):
+        ids = ",".join(str(node_id) for node_id in node_ids[start:start + batch_size])
+        response = fetch_overpass(f"[out:json][timeout:900];\nnode(id:{ids});\nout skel qt;\n", OVERPASS_URL,
+                                  use_cache=False)
+        if response.status_code != 200:
+            raise RuntimeError(f"Overpass API request failed with status code {response.status_code}")
+        for element in iter_elements(response.content):
+            if element['type'] == 'node':
+                nodes[element['id']] = (element['lon'], element['lat'])
+    return nodes
+
+def restrict_to_area(changes, store, bounds=AREA_BOUNDS):
+    """
+    Drops the changed ways that are not in the store and whose known nodes all lie
+    outside bounds, so that a diff covering more than the area adds nothing outside it.
+
+    Returns:
+    dropped (int): Number of ways dropped.
+    """
+    way_ids = np.array(sorted(changes.ways), dtype=np.int64)
+    dropped = 0
+    for way_id in way_ids[~store.has_ways(way_ids)].tolist():
+        coords = store.node_coords(changes.ways[way_id][0], changes.nodes)
+        inside = ((coords[:, 0] >= bounds[0]) & (coords[:, 1] >= bounds[1]) &
+                  (coords[:, 0] <= bounds[2]) & (coords[:, 1] <= bounds[3]))
+        if len(coords) and not inside.any():
+            del changes.ways[way_id]
+            dropped += 1
+    return dropped
+
+def patch_layers(path, features, removed_ids, crs=None):
+    # Only GeoJSON layers can be patched in place by feature id
+    if not is_geojson(path):
+        raise ValueError(f"Only GeoJSON layers can be updated incrementally: {path}")
+    dropped, added = patch_layer(path, features, removed_ids, crs)
+    print(f"{path}: {dropped} features replaced or removed, {added} written")
+
+def update(changes, raw_layer, processed, simplified=None, tolerance=0.01, target_epsg=25832,
+           store_file=STORE_FILE, state_file=STATE_FILE, bounds=AREA_BOUNDS, fetch_missing=True):
+    """
+    Patches the raw, processed and simplified road layers with the given changes.
+
+    Only changed ways are reprojected (reproject_and_separate) and simplified (simplify),
+    and the layers are patched in place by feature id (geojson_patch.patch_layer).
+
+    A changed way may reference unchanged nodes that are not in the store, e.g. a path
+    retagged as a road. Their coordinates are fetched from the Overpass API, or with
+    fetch_missing False the update is refused; a way is never written with its unknown
+    nodes left out.
+
+    Parameters:
+    changes (Changes): From parse_changes or fetch_changes.
+    raw_layer (str): The raw road layer written by initialize.
+    processed (dict): property_key, feature_mapping, link_mapping and output_directory
+        as passed to reproject_and_separate.
+    simplified (dict, optional): Processed output file -> simplified output file.
+    bounds (tuple, optional): Area of the layer, see restrict_to_area.
+    fetch_missing (bool, optional): Whether to fetch nodes missing from the store and the changes.
+    """
+    store = WayStore.load(store_file)
+    dropped = restrict_to_area(changes, store, bounds)
+    missing = sorted({ref for refs in store.unresolved(changes).values() for ref in refs} - changes.deleted_nodes)
+    if missing and fetch_missing:
+        print(f"Fetching {len(missing)} nodes missing from the store")
+        changes.nodes.update(fetch_nodes(missing))
+        dropped += restrict_to_area(changes, store, bounds)
+    if dropped:
+        print(f"{dropped} changed ways outside the area ignored")
+    affected, removed = store.apply(changes)
+    features = store.features(affected)
+    patch_layers(raw_layer, features, removed)
+
+    feature_mapping = processed.get("feature_mapping") or {}
+    features_by_type = process_features({'features': features}, processed.get("property_key"),
+                                        feature_mapping, processed.get("link_mapping"))
+    reprojected = reproject_features(features_by_type, initialize_transformer(target_epsg))
+    stale = removed | affected
+    for feature_type, file_name in feature_mapping.items():
+        output_file = os.path.join(processed.get("output_directory", "data/data_processed"), file_name)
+        type_features = reprojected.get(feature_type, [])
+        patch_layers(output_file, type_features, stale, crs_member(target_epsg))
+        if simplified and output_file in simplified:
+            patch_layers(simplified[output_file], simplify_features_vectorized(type_features, tolerance),
+                         stale, OUTPUT_CRS)
+
+    # The store only moves on once every layer is patched
+    store.save(store_file)
+    write_state(changes.timestamp or utc_now(), state_file)
+    return affected, removed
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally update the road layers.")
+    parser.add_argument("command", choices=["init", "update"],
+                        help="init: record a baseline from a full download; update: apply the changes since then")
+    parser.add_argument("--osc", help="Apply a local osmChange file instead of an Overpass augmented diff")
+    parser.add_argument("--raw", default=ROAD_LAYER["output"])
+    parser.add_argument("--no-fetch", action="store_true",
+                        help="Refuse changes that reference nodes missing from the store instead of fetching them")
+    args = parser.parse_args()
+
+    if args.command == "init":
+        response = fetch_overpass(build_overpass_query([ROAD_LAYER]), OVERPASS_URL)
+        if response.status_code != 200:
+            print(f"Error: Overpass API request failed with status code {response.status_code}")
+            return
+        initialize(response.content, args.raw)
+        return
+
+    if args.osc:
+        changes = parse_changes(args.osc)
+    else:
+        changes = fetch_changes(read_state()["timestamp"])
+    print(f"{len(changes)} changed elements")
+    processed = {
+        "property_key": ROAD_TAG,
+        "feature_mapping": {"motorway": "motorways.geojson", "trunk": "trunk.geojson", "primary": "primary.geojson",
+                            "secondary": "secondary.geojson", "tertiary": "tertiary.geojson"},
+        "link_mapping": {"motorway_link": "motorway", "trunk_link": "trunk", "primary_link": "primary",
+                         "secondary_link": "secondary"},
+    }
+    update(changes, args.raw, processed, fetch_missing=not args.no_fetch)
+
+if __name__ == "__main__":
+    main()
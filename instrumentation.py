@@ -0,0 +1,240 @@
+import atexit
+import functools
+import glob
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import threading
+import time
+import warnings
+from contextlib import nullcontext
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows; peak RSS is then not reported
+
+# PIPELINE_PROFILE: unset or 0 disables instrumentation; 1 records spans and counters;
+# cprofile additionally profiles each process with cProfile (.prof files for pstats/snakeviz);
+# pyinstrument does the same with pyinstrument (.html and .txt reports) when it is installed.
+MODE = os.environ.get("PIPELINE_PROFILE", "0").lower()
+ENABLED = MODE not in ("", "0", "false", "off")
+OUTPUT_DIR = os.environ.get("PIPELINE_PROFILE_DIR", os.path.join("data", "profile"))
+
+_DISABLED_SPAN = nullcontext()
+_local = threading.local()
+_lock = threading.Lock()
+_counters = {}
+_output = None
+_profiler = None
+_process = {"pid": None, "finalizer": None, "finished": False}
+_page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def memory_mb():
+    """
+    Returns (current RSS, peak RSS) of the process in MB, None where the platform does not report it.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None  # Kilobytes on Linux
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            current = int(f.read().split()[1]) * _page_size / 1024 ** 2
+    except OSError:
+        current = None
+    return current, peak
+
+def _register_finish():
+    # Worker processes of multiprocessing pools exit without running atexit handlers,
+    # so they finish through a multiprocessing finalizer (which process start-up may clear)
+    if multiprocessing.parent_process() is None:
+        if _process["pid"] != os.getpid():
+            atexit.register(_finish)
+    elif _process["finalizer"] is None or not _process["finalizer"].still_active():
+        _process["finalizer"] = multiprocessing.util.Finalize(None, _finish, exitpriority=0)
+    _process["pid"] = os.getpid()
+
+def _write(record):
+    global _output
+    with _lock:
+        if _output is None:
+            os.makedirs(OUTPUT_DIR, exist_ok=True)  # Ensure the directory exists
+            # Line buffered, so nothing is lost or written twice when a process forks or is killed
+            _output = open(os.path.join(OUTPUT_DIR, f"spans-{os.getpid()}.jsonl"), "a", encoding="utf-8",
+                           buffering=1)
+        _output.write(json.dumps(record, default=str) + "\n")
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+class Span:
+    """
+    A timed section. Records wall and CPU time, the counters incremented while it was
+    open and the memory at its end, as one JSON line in PIPELINE_PROFILE_DIR. The CPU
+    time is that of the thread running the span, so spans in thread pool workers do
+    not include each other's work, and a span waiting on other threads or processes
+    reports little CPU time.
+    """
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.counters = {}
+
+    def __enter__(self):
+        stack = _stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.start = time.perf_counter()
+        self.start_cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.start_cpu
+        _stack().pop()
+        _register_finish()
+        current, peak = memory_mb()
+        _write({
+            "type": "span", "name": self.name, "parent": self.parent, "pid": os.getpid(),
+            "thread": threading.get_ident(), "start": time.time() - wall, "wall_seconds": wall,
+            "cpu_seconds": cpu, "rss_mb": current, "peak_rss_mb": peak, "error": repr(exc_value) if exc_type else None,
+            "counters": self.counters, "attributes": self.attributes,
+        })
+        return False
+
+def span(name, **attributes):
+    """
+    Context manager timing a section; a shared no-op when instrumentation is disabled.
+    """
+    if not ENABLED:
+        return _DISABLED_SPAN
+    return Span(name, attributes)
+
+def count(name, value=1):
+    """
+    Adds value to a counter (e.g. features or vertices), globally and on the open spans of this thread.
+    """
+    if not ENABLED:
+        return
+    _register_finish()
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    for open_span in _stack():
+        open_span.counters[name] = open_span.counters.get(name, 0) + value
+
+def instrumented(name=None):
+    """
+    Decorator running a function in a span named after it. Returns the function itself
+    when instrumentation is disabled, so there is no overhead at all.
+    """
+    def decorator(function):
+        if not ENABLED:
+            return function
+        span_name = name or f"{function.__module__}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Span(span_name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _start_profiler():
+    global _profiler, MODE
+    if MODE == "cprofile":
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    elif MODE == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            warnings.warn("PIPELINE_PROFILE=pyinstrument but pyinstrument is not installed; "
+                          "recording spans and counters only")
+            MODE = "1"
+            return
+        _profiler = Profiler()
+        _profiler.start()
+
+def _finish():
+    # Write the counter totals and the profile of this process
+    global _output
+    if _process["finished"]:
+        return
+    _process["finished"] = True
+    current, peak = memory_mb()
+    _write({"type": "counters", "pid": os.getpid(), "counters": _counters, "rss_mb": current, "peak_rss_mb": peak})
+    if _profiler is not None:
+        prefix = os.path.join(OUTPUT_DIR, f"profile-{os.getpid()}")
+        if MODE == "cprofile":
+            _profiler.disable()
+            _profiler.dump_stats(f"{prefix}.prof")
+        else:
+            _profiler.stop()
+            with open(f"{prefix}.html", "w", encoding="utf-8") as f:
+                f.write(_profiler.output_html())
+            with open(f"{prefix}.txt", "w", encoding="utf-8") as f:
+                f.write(_profiler.output_text())
+    if _output is not None:
+        _output.close()
+        _output = None
+
+def _after_fork():
+    # A forked child starts with empty counters, its own output file and its own profile
+    global _output, _counters, _local, _lock
+    _output = None
+    _counters = {}
+    _local = threading.local()
+    _lock = threading.Lock()
+    _process.update(pid=None, finalizer=None, finished=False)
+    if _profiler is not None:
+        # Stop the profile copied from the parent before starting this process's own
+        if MODE == "cprofile":
+            _profiler.disable()
+        else:
+            _profiler.stop()
+        _start_profiler()
+
+def summarize(output_dir=OUTPUT_DIR):
+    """
+    Totals of the recorded spans per name (count, wall and CPU seconds, peak RSS) and of
+    the counters, over all processes that wrote to output_dir.
+    """
+    spans, counters = {}, {}
+    for path in sorted(glob.glob(os.path.join(output_dir, "spans-*.jsonl"))):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record["type"] == "counters":
+                    for name, value in record["counters"].items():
+                        counters[name] = counters.get(name, 0) + value
+                    continue
+                total = spans.setdefault(record["name"], {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                          "peak_rss_mb": 0.0})
+                total["count"] += 1
+                total["wall_seconds"] += record["wall_seconds"]
+                total["cpu_seconds"] += record["cpu_seconds"]
+                total["peak_rss_mb"] = max(total["peak_rss_mb"], record["peak_rss_mb"] or 0.0)
+    return spans, counters
+
+def print_summary(output_dir=OUTPUT_DIR):
+    spans, counters = summarize(output_dir)
+    print(f"{'span':<52} {'count':>6} {'wall [s]':>9} {'cpu [s]':>9} {'peak [MB]':>10}")
+    for name, total in sorted(spans.items(), key=lambda item: -item[1]["wall_seconds"]):
+        print(f"{name:<52} {total['count']:>6} {total['wall_seconds']:>9.2f} {total['cpu_seconds']:>9.2f} "
+              f"{total['peak_rss_mb']:>10.0f}")
+    for name, value in sorted(counters.items()):
+        print(f"{name:<52} {value:>12}")
+
+if ENABLED:
+    _start_profiler()
+    _register_finish()
+    if hasattr(os, "register_at_fork"):  # Not on Windows, where workers are spawned
+        os.register_at_fork(after_in_child=_after_fork)
+
+if __name__ == "__main__":
+    import sys
+    print_summary(*sys.argv[1:2])
@@ -0,0 +1,377 @@
+import json
+import math
+import os
+import tempfile
+from contextlib import contextmanager
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+import shapely
+from feature_store import format_of, gdf_to_features, write_layer
+from geojson_stream import FeatureCollectionWriter
+
+# Features per chunk; bounds peak memory independently of the layer size
+DEFAULT_CHUNK_SIZE = 100000
+
+# Feature ids of the source layer in the copies made by indexed_layer
+FID_COLUMN = "source_fid"
+
+# Fields of a GeoParquet bbox covering column
+BBOX_FIELDS = ("xmin", "ymin", "xmax", "ymax")
+
+def parquet_geodataframe(table, geo_metadata):
+    """
+    GeoDataFrame of a GeoParquet table, built with GeoDataFrame.from_arrow.
+
+    The geometry columns are marked as GeoArrow columns with the encoding and CRS of the
+    'geo' metadata (a missing CRS is OGC:CRS84, a null CRS is unknown), and the bbox
+    covering columns, which are only used for filtering, are dropped.
+    """
+    covering = {path[0] for column in geo_metadata['columns'].values()
+                for path in column.get('covering', {}).get('bbox', {}).values()}
+    fields, arrays = [], []
+    for field, array in zip(table.schema, table.columns):
+        if field.name in covering:
+            continue
+        column = geo_metadata['columns'].get(field.name)
+        if column is not None:
+            crs = column.get('crs', 'OGC:CRS84')
+            field = field.with_metadata({
+                b'ARROW:extension:name': f"geoarrow.{column['encoding'].lower()}".encode(),
+                b'ARROW:extension:metadata': json.dumps({} if crs is None else {'crs': crs}).encode(),
+            })
+        fields.append(field)
+        arrays.append(array)
+    return gpd.GeoDataFrame.from_arrow(pa.Table.from_arrays(arrays, schema=pa.schema(fields)),
+                                       geometry=geo_metadata['primary_column'])
+
+def geoparquet_table(gdf):
+    """
+    GeoParquet table of a GeoDataFrame, built with GeoDataFrame.to_arrow: WKB geometry,
+    a bbox covering column and the 'geo' metadata. The geometry types are left unknown,
+    as they may differ between the chunks of a layer.
+    """
+    table = pa.table(gdf.to_arrow(index=False, geometry_encoding='WKB'))
+    bounds = shapely.bounds(gdf.geometry.values.to_numpy())
+    bbox = pa.StructArray.from_arrays([pa.array(bounds[:, i]) for i in range(4)], names=list(BBOX_FIELDS))
+    geometry_name = gdf.geometry.name
+    geo_metadata = {
+        "version": "1.1.0",
+        "primary_column": geometry_name,
+        "columns": {geometry_name: {
+            "encoding": "WKB",
+            "geometry_types": [],
+            "crs": gdf.crs.to_json_dict() if gdf.crs is not None else None,
+            "covering": {"bbox": {name: ["bbox", name] for name in BBOX_FIELDS}},
+        }},
+    }
+    table = table.append_column("bbox", bbox)
+    return table.replace_schema_metadata({**(table.schema.metadata or {}), b'geo': json.dumps(geo_metadata)})
+
+def iter_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields a layer as GeoDataFrames of at most chunk_size features, reading one chunk at a time.
+
+    GeoParquet is read in record batches of its row groups, GeoJSON and FlatGeobuf in
+    Arrow batches streamed by GDAL, so memory use is bounded by the chunk size rather
+    than by the size of the layer.
+    """
+    if format_of(path) == 'geoparquet':
+        parquet_file = pq.ParquetFile(path)
+        geo_metadata = json.loads(parquet_file.schema_arrow.metadata[b'geo'])
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield parquet_geodataframe(pa.Table.from_batches([batch]), geo_metadata)
+    else:
+        with pyogrio.open_arrow(path, batch_size=chunk_size, use_pyarrow=True) as (meta, reader):
+            geometry_name = meta['geometry_name'] or 'wkb_geometry'
+            for batch in reader:
+                frame = batch.to_pandas()
+                geometry = shapely.from_wkb(frame.pop(geometry_name).to_numpy())
+                yield gpd.GeoDataFrame(frame, geometry=geometry, crs=meta['crs'])
+
+def scan_layer(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Reads a layer chunk by chunk to find its extent.
+
+    Returns:
+    bounds (tuple): (minx, miny, maxx, maxy) of all features.
+    max_extent (float): Largest width or height of a single feature.
+    crs (pyproj.CRS): CRS of the layer.
+    count (int): Number of features.
+    """
+    bounds, max_extent, crs, count = [np.inf, np.inf, -np.inf, -np.inf], 0.0, None, 0
+    for chunk in iter_chunks(path, chunk_size):
+        crs, count = chunk.crs, count + len(chunk)
+        feature_bounds = shapely.bounds(chunk.geometry.values.to_numpy())
+        feature_bounds = feature_bounds[~np.isnan(feature_bounds).any(axis=1)]
+        if len(feature_bounds) == 0:
+            continue
+        bounds = [min(bounds[0], feature_bounds[:, 0].min()), min(bounds[1], feature_bounds[:, 1].min()),
+                  max(bounds[2], feature_bounds[:, 2].max()), max(bounds[3], feature_bounds[:, 3].max())]
+        max_extent = max(max_extent, (feature_bounds[:, 2:] - feature_bounds[:, :2]).max())
+    return tuple(bounds), max_extent, crs, count
+
+def grid_shape(bounds, window_size):
+    # (columns, rows) of the window grid covering bounds
+    return (max(math.ceil((bounds[2] - bounds[0]) / window_size), 1),
+            max(math.ceil((bounds[3] - bounds[1]) / window_size), 1))
+
+def grid_windows(bounds, window_size):
+    """
+    Square windows of window_size covering bounds, as (window number, window bounds) tuples in row-major order.
+    """
+    columns, rows = grid_shape(bounds, window_size)
+    return [(row * columns + column, (bounds[0] + column * window_size, bounds[1] + row * window_size,
+                                      bounds[0] + (column + 1) * window_size, bounds[1] + (row + 1) * window_size))
+            for row in range(rows) for column in range(columns)]
+
+def window_numbers(geometries, bounds, window_size):
+    """
+    Number of the grid_windows window containing the centre of each geometry's bounding box.
+
+    Every geometry belongs to exactly one window, so features read by several
+    overlapping windows can be attributed to one of them.
+    """
+    columns, rows = grid_shape(bounds, window_size)
+    feature_bounds = shapely.bounds(geometries)
+    center_x = (feature_bounds[:, 0] + feature_bounds[:, 2]) / 2
+    center_y = (feature_bounds[:, 1] + feature_bounds[:, 3]) / 2
+    column = np.clip(((center_x - bounds[0]) // window_size).astype(np.int64), 0, columns - 1)
+    row = np.clip(((center_y - bounds[1]) // window_size).astype(np.int64), 0, rows - 1)
+    return row * columns + column
+
+def bbox_covering(geo_metadata):
+    # Column paths of the bbox covering of the primary geometry column, or None
+    return geo_metadata['columns'][geo_metadata['primary_column']].get('covering', {}).get('bbox')
+
+def parquet_bbox_filter(path):
+    # Whether GeoParquet can skip row groups for a bbox: with a bbox covering column
+    return bbox_covering(json.loads(pq.read_schema(path).metadata[b'geo'])) is not None
+
+def candidate_row_groups(parquet_file, covering, bbox):
+    """
+    Row groups of a GeoParquet file that may hold features intersecting bbox, from the
+    statistics of its bbox covering column; all row groups without one.
+    """
+    metadata = parquet_file.metadata
+    if covering is None:
+        return list(range(metadata.num_row_groups))
+    paths = [metadata.schema.column(i).path for i in range(metadata.num_columns)]
+    positions = [paths.index(".".join(covering[name])) for name in BBOX_FIELDS]
+    groups = []
+    for group in range(metadata.num_row_groups):
+        statistics = [metadata.row_group(group).column(i).statistics for i in positions]
+        if any(statistic is None or not statistic.has_min_max for statistic in statistics):
+            groups.append(group)
+            continue
+        xmin, ymin, xmax, ymax = statistics
+        if xmin.min <= bbox[2] and xmax.max >= bbox[0] and ymin.min <= bbox[3] and ymax.max >= bbox[1]:
+            groups.append(group)
+    return groups
+
+def has_spatial_index(path):
+    """
+    Whether read_window reads a window of the layer without scanning all of it: GeoParquet
+    with a bbox covering column and FlatGeobuf with a spatial index, not GeoJSON.
+    """
+    if format_of(path) == 'geoparquet':
+        return parquet_bbox_filter(path)
+    return bool(pyogrio.read_info(path)['capabilities']['fast_spatial_filter'])
+
+def read_window(path, window, margin=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Reads the features intersecting a window grown by margin, indexed by their feature id
+    in the layer (the row number for GeoParquet).
+
+    GeoParquet skips row groups using the statistics of its bbox covering column and
+    filters the rows on it, or without one scans the row groups and filters on the
+    geometry bounds; FlatGeobuf uses its spatial index. GeoJSON has to scan every
+    feature but only keeps the ones in the window; see indexed_layer for reading many
+    windows.
+    """
+    bbox = (window[0] - margin, window[1] - margin, window[2] + margin, window[3] + margin)
+    if format_of(path) == 'geoparquet':
+        return read_parquet_window(path, bbox, chunk_size)
+    gdf = gpd.read_file(path, bbox=bbox, fid_as_index=True)
+    if FID_COLUMN in gdf.columns:
+        gdf = gdf.set_index(FID_COLUMN).rename_axis(None)
+    return gdf
+
+def read_parquet_window(path, bbox, chunk_size=DEFAULT_CHUNK_SIZE):
+    # GeoParquet part of read_window
+    parquet_file = pq.ParquetFile(path)
+    geo_metadata = json.loads(parquet_file.schema_arrow.metadata[b'geo'])
+    covering = bbox_covering(geo_metadata)
+    group_starts = np.cumsum([0] + [parquet_file.metadata.row_group(i).num_rows
+                                    for i in range(parquet_file.num_row_groups)])
+    parts = []
+    for group in candidate_row_groups(parquet_file, covering, bbox):
+        offset = int(group_starts[group])
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, row_groups=[group]):
+            table = pa.Table.from_batches([batch])
+            if covering is not None:
+                column = table.column(covering["xmin"][0]).combine_chunks()
+                bounds = np.column_stack([column.field(covering[name][1]).to_numpy(zero_copy_only=False)
+                                          for name in BBOX_FIELDS])
+            else:
+                bounds = shapely.bounds(parquet_geodataframe(table, geo_metadata).geometry.values.to_numpy())
+            hits = np.flatnonzero((bounds[:, 0] <= bbox[2]) & (bounds[:, 2] >= bbox[0]) &
+                                  (bounds[:, 1] <= bbox[3]) & (bounds[:, 3] >= bbox[1]))
+            if len(hits):
+                gdf = parquet_geodataframe(table.take(hits), geo_metadata)
+                gdf.index = offset + hits  # Row numbers in the layer
+                parts.append(gdf)
+            offset += batch.num_rows
+    if not parts:
+        return parquet_geodataframe(parquet_file.schema_arrow.empty_table(), geo_metadata)
+    return pd.concat(parts)
+
+@contextmanager
+def indexed_layer(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields a path to read many windows of a layer from with read_window.
+
+    Layers without a spatial index (GeoJSON, GeoParquet without a bbox covering column)
+    would be scanned once per window. They are copied once, streaming, to a temporary
+    FlatGeobuf with a spatial index, which keeps the feature ids of the layer (row
+    numbers for GeoParquet) and is deleted on exit. Other layers are used as they are.
+    """
+    if has_spatial_index(path):
+        yield path
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        copy = os.path.join(directory, "layer.fgb")
+        if format_of(path) == 'geoparquet':
+            parquet_file = pq.ParquetFile(path)
+            geo_metadata = json.loads(parquet_file.schema_arrow.metadata[b'geo'])
+            geometry_name = geo_metadata['primary_column']
+            columns = [name for name in parquet_file.schema_arrow.names if name != 'bbox']
+            schema = parquet_file.schema_arrow.remove_metadata()
+            schema = pa.schema([pa.field(FID_COLUMN, pa.int64())] + [schema.field(name) for name in columns])
+
+            def batches():
+                offset = 0
+                for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+                    fids = pa.array(np.arange(offset, offset + batch.num_rows))
+                    offset += batch.num_rows
+                    yield pa.RecordBatch.from_arrays([fids] + batch.columns, schema=schema)
+
+            crs = geo_metadata['columns'][geometry_name].get('crs', 'OGC:CRS84')  # PROJJSON
+            pyogrio.write_arrow(pa.RecordBatchReader.from_batches(schema, batches()), copy, driver="FlatGeobuf",
+                                geometry_name=geometry_name, geometry_type="Unknown",
+                                crs=json.dumps(crs) if isinstance(crs, dict) else crs)
+        else:
+            with pyogrio.open_arrow(path, batch_size=chunk_size, use_pyarrow=True, return_fids=True) as (meta, reader):
+                schema = reader.schema
+                names = [FID_COLUMN if name == meta['fid_column'] else name for name in schema.names]
+                stream = pa.RecordBatchReader.from_batches(
+                    pa.schema([field.with_name(name) for field, name in zip(schema, names)]),
+                    (batch.rename_columns(names) for batch in reader))
+                pyogrio.write_arrow(stream, copy, driver="FlatGeobuf",
+                                    geometry_name=meta['geometry_name'] or 'wkb_geometry',
+                                    geometry_type=meta['geometry_type'], crs=meta['crs'])
+        yield copy
+
+def layer_schema(path):
+    """
+    Arrow schema of the attribute columns of a layer, read from its metadata.
+    """
+    if format_of(path) == 'geoparquet':
+        schema = pq.read_schema(path)
+        geometry_name = json.loads(schema.metadata[b'geo'])['primary_column']
+        return pa.schema([field for field in schema if field.name not in (geometry_name, 'bbox')])
+    with pyogrio.open_arrow(path, use_pyarrow=True, batch_size=1) as (meta, reader):
+        geometry_name = meta['geometry_name'] or 'wkb_geometry'
+        return pa.schema([field for field in reader.schema if field.name != geometry_name])
+
+class LayerWriter:
+    """
+    Writes GeoDataFrames to one layer incrementally, chunk by chunk.
+
+    GeoJSON is written one feature per line and GeoParquet one row group per chunk;
+    FlatGeobuf needs all features for its spatial index and cannot be appended to. The
+    layer is written to a temporary file that replaces output_file on close and is
+    deleted if an exception escapes the with block.
+
+    The GeoParquet columns are those of the first chunk. Columns missing from a later
+    chunk are written as nulls, and columns that are all null in the first chunk take
+    their type from schema, or are written as strings.
+
+    Parameters:
+    output_file (str): Path to the output file; the extension selects the format.
+    schema (pyarrow.Schema, optional): Attribute types of the source, see layer_schema.
+    """
+
+    def __init__(self, output_file, schema=None):
+        self.output_file = output_file
+        self.format = format_of(output_file)
+        if self.format == 'flatgeobuf':
+            raise ValueError(f"FlatGeobuf cannot be written in chunks: {output_file}")
+        self.source_schema = schema
+        self.temporary_file = f"{output_file}.tmp"
+        self.count = 0
+        self._writer = None
+        self._schema = None
+
+    def __enter__(self):
+        return self
+
+    def promoted(self, field):
+        # A concrete type for a column that is all null in the first chunk
+        if not pa.types.is_null(field.type):
+            return field
+        if self.source_schema is not None and field.name in self.source_schema.names:
+            return field.with_type(self.source_schema.field(field.name).type)
+        return field.with_type(pa.large_string())
+
+    def write(self, gdf):
+        if self.format == 'geojson':
+            if self._writer is None:
+                authority = gdf.crs.to_authority() if gdf.crs is not None else None
+                crs = {"type": "name", "properties": {"name": f"urn:ogc:def:crs:{authority[0]}::{authority[1]}"}} \
+                    if authority else None
+                self._writer = FeatureCollectionWriter(self.output_file, crs).open()
+            self._writer.write_all(gdf_to_features(gdf))
+        else:
+            table = geoparquet_table(gdf)
+            if self._writer is None:
+                directory = os.path.dirname(self.output_file)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)  # Ensure the directory exists
+                self._schema = pa.schema([self.promoted(field) for field in table.schema],
+                                         metadata=table.schema.metadata)
+                self._writer = pq.ParquetWriter(self.temporary_file, self._schema)
+            # Later chunks take the column types of the first
+            columns = [table[field.name].cast(field.type) if field.name in table.column_names
+                       else pa.nulls(len(table), field.type) for field in self._schema]
+            self._writer.write_table(pa.Table.from_arrays(columns, schema=self._schema))
+        self.count += len(gdf)
+
+    def close(self):
+        if self._writer is None and self.count == 0:
+            write_layer(gpd.GeoDataFrame(geometry=[]), self.output_file)  # No chunks were written
+        elif self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            if self.format != 'geojson':
+                os.replace(self.temporary_file, self.output_file)
+
+    def abort(self):
+        # Discard the chunks written so far, leaving any previous output_file in place
+        if self._writer is not None:
+            if self.format == 'geojson':
+                self._writer.abort()
+            else:
+                self._writer.close()
+                os.remove(self.temporary_file)
+            self._writer = None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
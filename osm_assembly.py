@@ -0,0 +1,109 @@
+import io
+from array import array
+import ijson
+import numpy as np
+from geometry_arrays import rebuild_geometries
+
+class WayBuffers:
+    """
+    Ways of an Overpass response as offset-indexed coordinate buffers.
+
+    coords (numpy.ndarray): (n, 2) lon/lat of all way vertices, way after way.
+    offsets (numpy.ndarray): Start/end offsets of each way in coords.
+    ids (numpy.ndarray): OSM id per way.
+    tags (list): Value of the requested tag per way (None when absent).
+    """
+
+    def __init__(self, coords, offsets, ids, tags):
+        self.coords = coords
+        self.offsets = offsets
+        self.ids = ids
+        self.tags = tags
+
+    def __len__(self):
+        return len(self.ids)
+
+def iter_elements(content):
+    """
+    Yields the 'elements' of an Overpass JSON response one at a time with an incremental parser.
+    """
+    yield from ijson.items(io.BytesIO(content), 'elements.item', use_float=True)
+
+def assemble_ways(elements, tag_key):
+    """
+    Resolves the node references of Overpass ways into coordinate buffers.
+
+    Node ids and coordinates are kept in NumPy arrays sorted by id, and the node
+    references of all ways are resolved in one vectorized searchsorted. References to
+    nodes missing from the response are skipped and ways without any resolved node
+    are dropped, as in the dict-based assembly.
+
+    Parameters:
+    elements (iterable): Overpass elements, e.g. response.json()['elements'] or iter_elements().
+    tag_key (str): Tag whose value is kept per way.
+
+    Returns:
+    ways (WayBuffers): The assembled ways.
+    """
+    node_ids, lons, lats = array('q'), array('d'), array('d')
+    way_ids, refs, counts, tags = array('q'), array('q'), array('q'), []
+    for element in elements:
+        if element['type'] == 'node':
+            node_ids.append(element['id'])
+            lons.append(element['lon'])
+            lats.append(element['lat'])
+        elif element['type'] == 'way':
+            way_ids.append(element['id'])
+            refs.extend(element['nodes'])
+            counts.append(len(element['nodes']))
+            tags.append(element.get('tags', {}).get(tag_key))
+
+    coords, offsets, keep = resolve_node_refs(node_ids, lons, lats, refs, counts)
+    return WayBuffers(
+        coords=coords,
+        offsets=offsets,
+        ids=np.frombuffer(way_ids, dtype=np.int64)[keep],
+        tags=[tag for tag, kept in zip(tags, keep) if kept],
+    )
+
+def resolve_node_refs(node_ids, lons, lats, refs, counts):
+    """
+    Resolves concatenated way node references against node id and coordinate buffers.
+
+    Parameters:
+    node_ids, lons, lats: Node ids and coordinates (arrays or buffers, in any order).
+    refs: Node references of all ways, way after way.
+    counts: Number of references per way.
+
+    Returns:
+    coords (numpy.ndarray): (n, 2) coordinates of the resolved references.
+    offsets (numpy.ndarray): Start/end offsets in coords of each kept way.
+    keep (numpy.ndarray): Boolean flag per way, False when none of its nodes resolved.
+    """
+    node_ids = np.asarray(node_ids, dtype=np.int64)
+    order = np.argsort(node_ids, kind='stable')
+    sorted_ids = node_ids[order]
+    node_coords = np.column_stack((np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64)))[order]
+
+    refs = np.asarray(refs, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    positions = np.searchsorted(sorted_ids, refs)
+    found = positions < len(sorted_ids)
+    found[found] = sorted_ids[positions[found]] == refs[found]
+
+    # Number of resolved vertices per way, and the ways that keep at least one
+    way_index = np.repeat(np.arange(len(counts)), counts)
+    resolved = np.bincount(way_index[found], minlength=len(counts))
+    keep = resolved > 0
+    offsets = np.zeros(keep.sum() + 1, dtype=np.int64)
+    np.cumsum(resolved[keep], out=offsets[1:])
+    return node_coords[positions[found]], offsets, keep
+
+def ways_to_features(ways, tag_key):
+    # GeoJSON LineString features with the way id as id and the way's tag_key value as their only property
+    layouts = [('LineString', None)] * len(ways)
+    geometries = rebuild_geometries(ways.coords, ways.offsets, layouts)
+    return [
+        {'type': 'Feature', 'id': way_id, 'geometry': geometry, 'properties': {tag_key: tag}}
+        for way_id, geometry, tag in zip(ways.ids.tolist(), geometries, ways.tags)
+    ]
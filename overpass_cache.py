@@ -0,0 +1,201 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import requests
+import instrumentation
+
+# Defaults can be overridden from the environment, e.g. to point the download
+# scripts at a local stand-in server or to run them without network access
+OVERPASS_URL = os.environ.get("OVERPASS_URL", "http://overpass-api.de/api/interpreter")
+CACHE_DIR = os.environ.get("OVERPASS_CACHE_DIR", os.path.join("data", "cache", "overpass"))
+CACHE_TTL = float(os.environ.get("OVERPASS_CACHE_TTL", 7 * 24 * 3600))  # Seconds
+CACHE_MAX_BYTES = int(os.environ.get("OVERPASS_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+OFFLINE = os.environ.get("OVERPASS_OFFLINE", "").lower() in ("1", "true", "yes")
+MAX_CONCURRENCY = int(os.environ.get("OVERPASS_MAX_CONCURRENCY", 2))  # Simultaneous requests per endpoint
+
+# Status codes Overpass uses for rate limiting and server overload
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+_endpoint_slots = {}
+_endpoint_slots_lock = threading.Lock()
+
+class CacheMiss(LookupError):
+    """Raised in offline mode when a query has no cached response."""
+
+def normalize_query(query):
+    # Strip indentation and collapse whitespace so formatting changes do not invalidate the cache
+    lines = (re.sub(r"\s+", " ", line.strip()) for line in query.strip().splitlines())
+    return "\n".join(line for line in lines if line)
+
+def cache_key(query, endpoint):
+    text = f"{endpoint}\n{normalize_query(query)}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def endpoint_slot(endpoint, limit=None):
+    # Semaphore shared by all threads that talk to the same endpoint
+    with _endpoint_slots_lock:
+        if endpoint not in _endpoint_slots:
+            _endpoint_slots[endpoint] = threading.BoundedSemaphore(limit or MAX_CONCURRENCY)
+        return _endpoint_slots[endpoint]
+
+class OverpassResponse:
+    """
+    Minimal stand-in for requests.Response so the download scripts can treat
+    cached and live responses the same way.
+    """
+
+    def __init__(self, status_code, content, from_cache=False):
+        self.status_code = status_code
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+class OverpassCache:
+    """
+    Content-addressed, gzip-compressed on-disk cache of Overpass responses.
+
+    Parameters:
+    cache_dir (str): Directory holding the cached responses.
+    ttl (float): Seconds after which an entry is considered stale (None for no expiry).
+    max_bytes (int): Total size above which least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.gz")
+
+    def get(self, key, allow_stale=False):
+        path = self.path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except FileNotFoundError:
+            return None
+        if self.ttl is not None and age > self.ttl and not allow_stale:
+            return None
+        with gzip.open(path, "rb") as f:
+            content = f.read()
+        # Record the access time explicitly; LRU eviction must not depend on the filesystem's atime setting
+        os.utime(path, (time.time(), os.path.getmtime(path)))
+        return content
+
+    def put(self, key, content):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(temp_path, "wb") as f:
+            f.write(content)
+        os.replace(temp_path, path)  # Atomic, so concurrent readers never see a partial entry
+        self.evict()
+
+    def evict(self):
+        # Delete least recently used entries until the cache fits in max_bytes
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".gz"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue  # Evicted concurrently
+                entries.append((stat.st_atime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".gz"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+def fetch_overpass(query, endpoint=OVERPASS_URL, method="post", cache=None, offline=OFFLINE, timeout=None, retries=0, backoff=5.0,
+                   use_cache=True):
+    """
+    Sends an Overpass query, serving the response from the on-disk cache when possible.
+
+    Only successful (200) responses are cached. In offline mode the network is never
+    used; stale entries are served and a missing entry raises CacheMiss. Queries whose
+    response must be current, e.g. diffs and node lookups of incremental updates, pass
+    use_cache=False to bypass the cache. At most
+    MAX_CONCURRENCY requests per endpoint are in flight across threads, and rate
+    limited or overloaded responses, connection errors and timeouts are retried with
+    exponential backoff.
+
+    Parameters:
+    query (str): Overpass QL query.
+    endpoint (str): Overpass API interpreter URL.
+    method (str): "post" sends the query as the request body, "get" as the 'data' parameter.
+    cache (OverpassCache, optional): Cache to use, defaults to one in CACHE_DIR.
+    offline (bool): Only serve responses from the cache.
+    timeout (float, optional): Request timeout in seconds.
+    retries (int): Number of retries on the status codes in RETRY_STATUS_CODES and on
+        connection errors and timeouts.
+    backoff (float): Delay in seconds before the first retry, doubled on each further retry.
+    use_cache (bool): Serve and store the response in the cache.
+
+    Returns:
+    response (OverpassResponse): Response with status_code, content, text and json().
+    """
+    if cache is None:
+        cache = OverpassCache()
+    key = cache_key(query, endpoint)
+
+    if not use_cache:
+        content = None
+        if offline:
+            raise CacheMiss(f"Overpass query {key[:12]} bypasses the cache and cannot run in offline mode")
+    else:
+        with instrumentation.span("overpass.cache_get"):
+            content = cache.get(key, allow_stale=offline)
+    if content is not None:
+        instrumentation.count("overpass_cache_hits")
+        instrumentation.count("overpass_bytes", len(content))
+        print(f"Using cached Overpass response {key[:12]}")
+        return OverpassResponse(200, content, from_cache=True)
+    if offline:
+        raise CacheMiss(f"No cached Overpass response for query {key[:12]} (offline mode)")
+
+    for attempt in range(retries + 1):
+        try:
+            with endpoint_slot(endpoint), instrumentation.span("overpass.request", endpoint=endpoint, attempt=attempt):
+                instrumentation.count("overpass_requests")
+                if method == "get":
+                    response = requests.get(endpoint, params={'data': query}, timeout=timeout)
+                else:
+                    response = requests.post(endpoint, data=query, timeout=timeout)
+                instrumentation.count("overpass_bytes", len(response.content))
+        except requests.RequestException as error:
+            # Connection failures and timeouts are retried like overload responses
+            if attempt == retries:
+                raise
+            problem = f"Overpass request failed ({type(error).__name__})"
+        else:
+            if response.status_code not in RETRY_STATUS_CODES or attempt == retries:
+                break
+            problem = f"Overpass returned {response.status_code}"
+        delay = backoff * 2 ** attempt
+        print(f"{problem}, retrying in {delay:.0f} s ({attempt + 1}/{retries})")
+        time.sleep(delay)
+
+    if response.status_code == 200 and use_cache:
+        cache.put(key, response.content)
+    return OverpassResponse(response.status_code, response.content)
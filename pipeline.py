@@ -0,0 +1,299 @@
+import argparse
+import ast
+import fnmatch
+import glob
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import resource
+import runpy
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+
+STATE_FILE = os.path.join("data", "pipeline_state.json")
+REPORT_FILE = os.path.join("data", "pipeline_report.json")
+
+def load_config(config_file):
+    """
+    Loads a pipeline config.
+
+    The config is a JSON object with a "stages" list. Each stage has a unique "name", and either
+    "function" ("module:function", called with "args" and "kwargs") or "script" (a script
+    run as __main__ with the command line arguments in "argv"). "inputs" and "outputs" list the files it reads and writes (glob patterns
+    are allowed in inputs), "after" lists stages it must wait for besides the producers of its
+    inputs, and "always": true runs the stage even when nothing changed. A stage is rerun when
+    its module or script, or a local module it imports, changes (see code_files); "code" lists
+    further files whose changes should rerun it, e.g. modules loaded dynamically.
+    """
+    with open(config_file, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    names = [stage["name"] for stage in config["stages"]]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate stage names in {config_file}: {sorted(duplicates)}")
+    for stage in config["stages"]:
+        if ("function" in stage) == ("script" in stage):
+            raise ValueError(f"Stage {stage['name']} needs either a function or a script")
+    return config
+
+def build_graph(stages):
+    """
+    Returns {stage name: set of stage names it depends on}.
+
+    A stage depends on the stages that write one of its inputs and on the stages in its "after" list.
+    """
+    producers = {}
+    for stage in stages:
+        for output in stage.get("outputs", []):
+            if output in producers:
+                raise ValueError(f"{output} is written by both {producers[output]} and {stage['name']}")
+            producers[output] = stage["name"]
+    names = {stage["name"] for stage in stages}
+    graph = {}
+    for stage in stages:
+        dependencies = set(stage.get("after", []))
+        unknown = dependencies - names
+        if unknown:
+            raise ValueError(f"Stage {stage['name']} runs after unknown stages {sorted(unknown)}")
+        for pattern in stage.get("inputs", []):
+            dependencies.update(name for output, name in producers.items()
+                                if output == pattern or fnmatch.fnmatch(output, pattern))
+        dependencies.discard(stage["name"])
+        graph[stage["name"]] = dependencies
+    topological_order(graph)  # Reject cycles before running anything
+    return graph
+
+def topological_order(graph):
+    order, done, visiting = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"The pipeline has a dependency cycle through stage {name}")
+        visiting.add(name)
+        for dependency in sorted(graph[name]):
+            visit(dependency)
+        visiting.discard(name)
+        done.add(name)
+        order.append(name)
+
+    for name in sorted(graph):
+        visit(name)
+    return order
+
+def file_digest(path, file_hashes):
+    # SHA-256 of a file, reused from file_hashes while its size and mtime are unchanged
+    stat = os.stat(path)
+    cached = file_hashes.get(path)
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    file_hashes[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    return file_hashes[path][2]
+
+def code_file(stage):
+    if "script" in stage:
+        return stage["script"]
+    spec = importlib.util.find_spec(stage["function"].split(":")[0])
+    return spec.origin if spec is not None else None
+
+def local_imports(path, directory):
+    # Module files in directory imported anywhere in the Python file at path
+    with open(path, 'rb') as f:
+        tree = ast.parse(f.read(), filename=path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split(".")[0])
+    paths = (os.path.join(directory, f"{name}.py") for name in names)
+    return [path for path in paths if os.path.isfile(path)]
+
+def code_files(stage):
+    """
+    The stage's module or script, the modules next to it that it imports, transitively,
+    and the files in its "code" list.
+
+    Imports are found by parsing the import statements, so modules loaded dynamically
+    (importlib, runpy) and changes to installed packages are not seen.
+    """
+    files = set(stage.get("code", []))
+    root = code_file(stage)
+    if root is None or not os.path.exists(root):
+        return sorted(files)
+    directory = os.path.dirname(os.path.abspath(root))
+    seen, pending = set(), [os.path.abspath(root)]
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        try:
+            pending.extend(local_imports(path, directory))
+        except (SyntaxError, UnicodeDecodeError):
+            continue  # Not a Python file; its contents are still hashed
+    return sorted(files | seen)
+
+def stage_key(stage, file_hashes):
+    """
+    Hash of a stage's code (see code_files), parameters and input contents; None when an input is missing.
+    """
+    inputs = {}
+    for pattern in stage.get("inputs", []):
+        paths = sorted(glob.glob(pattern))
+        if not paths:
+            return None
+        for path in paths:
+            inputs[path] = file_digest(path, file_hashes)
+    definition = {key: stage.get(key) for key in ("function", "script", "argv", "args", "kwargs", "outputs")}
+    definition["code"] = {path: file_digest(path, file_hashes) if os.path.exists(path) else None
+                          for path in code_files(stage)}
+    definition["inputs"] = inputs
+    return hashlib.sha256(json.dumps(definition, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def run_stage(stage):
+    """
+    Runs one stage and measures it; called in a fresh worker process so the peak memory is the stage's own.
+    """
+    start_wall = time.perf_counter()
+    start_self = resource.getrusage(resource.RUSAGE_SELF)
+    start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if "script" in stage:
+        sys.argv = [stage["script"]] + [str(arg) for arg in stage.get("argv", [])]
+        runpy.run_path(stage["script"], run_name="__main__")
+    else:
+        module_name, function_name = stage["function"].split(":")
+        function = getattr(importlib.import_module(module_name), function_name)
+        function(*stage.get("args", []), **stage.get("kwargs", {}))
+    end_self = resource.getrusage(resource.RUSAGE_SELF)
+    end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = sum(end.ru_utime - start.ru_utime + end.ru_stime - start.ru_stime
+              for start, end in ((start_self, end_self), (start_children, end_children)))
+    return {
+        "wall_seconds": time.perf_counter() - start_wall,
+        "cpu_seconds": cpu,
+        # ru_maxrss is in kilobytes on Linux; children covers stages with their own process pools
+        "peak_memory_mb": max(end_self.ru_maxrss, end_children.ru_maxrss) / 1024,
+    }
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {"stages": {}, "files": {}}
+    with open(state_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_json(data, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)  # Ensure the directory exists
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=4)
+
+def run_pipeline(config, max_workers=None, force=False, state_file=STATE_FILE, report_file=REPORT_FILE):
+    """
+    Runs the stages of a pipeline config in dependency order.
+
+    Independent stages run concurrently in a process pool. A stage is skipped when its
+    outputs exist and its code, parameters and input contents hash to the same key as in
+    the previous successful run. Stages downstream of a failed stage are not run.
+
+    Parameters:
+    config (dict): Pipeline config, see load_config.
+    max_workers (int, optional): Number of stages run at the same time.
+    force (bool): Run every stage regardless of the previous run.
+    state_file (str): Stage keys and file hashes of the previous runs.
+    report_file (str): Where the run report is written.
+
+    Returns:
+    report (dict): Status, wall time, CPU time and peak memory per stage.
+    """
+    stages = {stage["name"]: stage for stage in config["stages"]}
+    graph = build_graph(config["stages"])
+    state = load_state(state_file)
+    report = {"started": datetime.now(timezone.utc).isoformat(), "stages": {}}
+    statuses = {}
+    running = {}
+    start = time.perf_counter()
+
+    def finish(name, status, **details):
+        statuses[name] = status
+        report["stages"][name] = dict({"status": status}, **details)
+        print(f"{name}: {status}" + (f" ({details['error']})" if "error" in details else ""))
+
+    # Each stage gets a fresh worker process so that its peak memory is measured on its own
+    with ProcessPoolExecutor(max_workers=max_workers, max_tasks_per_child=1) as executor:
+        while len(statuses) < len(stages):
+            for name in topological_order(graph):
+                if name in statuses or name in running:
+                    continue
+                dependencies = graph[name]
+                if any(statuses.get(dependency) in ("failed", "blocked") for dependency in dependencies):
+                    finish(name, "blocked")
+                    continue
+                if not all(statuses.get(dependency) in ("done", "skipped") for dependency in dependencies):
+                    continue
+                stage = stages[name]
+                key = stage_key(stage, state["files"])
+                outputs_exist = all(os.path.exists(output) for output in stage.get("outputs", []))
+                if (key is not None and not force and not stage.get("always") and outputs_exist
+                        and state["stages"].get(name) == key):
+                    finish(name, "skipped", key=key)
+                    continue
+                running[name] = (executor.submit(run_stage, stage), key)
+
+            if not running:
+                continue
+            completed, _ = wait([future for future, _ in running.values()], return_when=FIRST_COMPLETED)
+            for name in [name for name, (future, _) in running.items() if future in completed]:
+                future, key = running.pop(name)
+                try:
+                    metrics = future.result()
+                except Exception as e:
+                    finish(name, "failed", error=repr(e))
+                    state["stages"].pop(name, None)
+                    continue
+                # Key the stage on the inputs it actually read, e.g. files created by an upstream script
+                key = stage_key(stages[name], state["files"])
+                state["stages"][name] = key
+                finish(name, "done", key=key, **metrics)
+
+    report["wall_seconds"] = time.perf_counter() - start
+    save_json(state, state_file)
+    save_json(report, report_file)
+    print_report(report)
+    return report
+
+def print_report(report):
+    print(f"{'stage':<28} {'status':<8} {'wall [s]':>9} {'cpu [s]':>9} {'peak [MB]':>10}")
+    for name, entry in report["stages"].items():
+        if entry["status"] == "done":
+            print(f"{name:<28} {entry['status']:<8} {entry['wall_seconds']:>9.2f} {entry['cpu_seconds']:>9.2f} "
+                  f"{entry['peak_memory_mb']:>10.0f}")
+        else:
+            print(f"{name:<28} {entry['status']:<8}")
+    print(f"Pipeline finished in {report['wall_seconds']:.2f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the processing pipeline described by a config file.")
+    parser.add_argument("config", nargs="?", default="pipeline.json")
+    parser.add_argument("--workers", type=int, default=None, help="Number of stages run at the same time")
+    parser.add_argument("--force", action="store_true", help="Run every stage, even when nothing changed")
+    parser.add_argument("--state", default=STATE_FILE)
+    parser.add_argument("--report", default=REPORT_FILE)
+    args = parser.parse_args()
+
+    report = run_pipeline(load_config(args.config), args.workers, args.force, args.state, args.report)
+    if any(entry["status"] in ("failed", "blocked") for entry in report["stages"].values()):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
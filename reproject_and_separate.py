@@ -1,12 +1,22 @@
+import argparse
 import json
 import os
+import time
 from collections import defaultdict
-from geojson import Feature, FeatureCollection, LineString, MultiPolygon, dump
-from pyproj import Transformer
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from geojson import FeatureCollection, dump
+from crs_cache import get_transformer
+from geojson_stream import FeatureCollectionWriter, iter_features
+from feature_store import is_geojson, write_features
+from geometry_arrays import GEOMETRY_DEPTH, flatten_geometries, rebuild_geometries
+import instrumentation
 
-def initialize_transformer(target_epsg):
-    return Transformer.from_crs("EPSG:4326", f"EPSG:{target_epsg}", always_xy=True)
+def initialize_transformer(target_epsg, source_crs="EPSG:4326"):
+    # Cached per process, so batch jobs build each transformer only once
+    return get_transformer(source_crs, f"EPSG:{target_epsg}", always_xy=True)
 
+@instrumentation.instrumented()
 def load_geojson(input_file):
     with open(input_file, 'r', encoding='utf-8') as f:
         return json.load(f)
@@ -14,6 +24,16 @@ def load_geojson(input_file):
 def reproject_coords(coords, transformer):
     return [transformer.transform(lon, lat) for lon, lat in coords]
 
+def classify_feature(feature, property_key, feature_mapping, link_mapping):
+    # Return the output type of a feature, or None if it is not mapped
+    feature_type = feature['properties'].get(property_key)
+    if feature_type in link_mapping:
+        return link_mapping[feature_type]
+    if feature_type in feature_mapping:
+        return feature_type
+    return None
+
+@instrumentation.instrumented()
 def process_features(data, property_key=None, feature_mapping=None, link_mapping=None):
     if link_mapping is None:
         link_mapping = {}
@@ -26,53 +46,80 @@ def process_features(data, property_key=None, feature_mapping=None, link_mapping
         features_by_type['all'] = data['features']
     else:
         for feature in data['features']:
-            feature_type = feature['properties'].get(property_key)
-            if feature_type in link_mapping:
-                parent_type = link_mapping[feature_type]
-                features_by_type[parent_type].append(feature)
-            elif feature_type in feature_mapping:
+            feature_type = classify_feature(feature, property_key, feature_mapping, link_mapping)
+            if feature_type is not None:
                 features_by_type[feature_type].append(feature)
+    instrumentation.count("features_classified", len(data['features']))
     
     return features_by_type
 
+def reproject_geometries(geometries, transformer):
+    # Reproject all vertices of the geometries with a single batched transform call.
+    # Z coordinates are transformed along; 2D vertices of a batch mixing 2D and 3D
+    # geometries are transformed at height 0 and stay 2D.
+    with instrumentation.span("reproject.flatten"):
+        coords, offsets, layouts = flatten_geometries(geometries)
+    instrumentation.count("vertices_reprojected", len(coords))
+    if len(coords) and coords.shape[1] == 2:
+        with instrumentation.span("reproject.transform"):
+            x, y = transformer.transform(coords[:, 0], coords[:, 1])
+            coords = np.column_stack((x, y))
+    elif len(coords):
+        with instrumentation.span("reproject.transform"):
+            missing_z = np.isnan(coords[:, 2])
+            x, y, z = transformer.transform(coords[:, 0], coords[:, 1], np.where(missing_z, 0.0, coords[:, 2]))
+            coords = np.column_stack((x, y, np.where(missing_z, np.nan, z)))
+    with instrumentation.span("reproject.rebuild"):
+        return rebuild_geometries(coords, offsets, layouts)
+
+def reproject_feature_list(features, transformer):
+    # Skip features without geometry or with unsupported types (e.g. GeometryCollection)
+    features = [feature for feature in features
+                if feature.get('geometry') and feature['geometry']['type'] in GEOMETRY_DEPTH]
+    geometries = reproject_geometries([feature['geometry'] for feature in features], transformer)
+
+    reprojected_features = [
+        {'type': 'Feature', 'geometry': geometry, 'properties': feature['properties']}
+        for feature, geometry in zip(features, geometries)
+    ]
+    # Keep feature ids; incremental updates match features on them
+    for feature, reprojected_feature in zip(features, reprojected_features):
+        if 'id' in feature:
+            reprojected_feature['id'] = feature['id']
+    return reprojected_features
+
+@instrumentation.instrumented()
 def reproject_features(features_by_type, transformer):
     reprojected_data = {}
     for feature_type, features in features_by_type.items():
-        reprojected_features = []
-        for feature in features:
-            geometry = feature['geometry']
-            if geometry['type'] == 'LineString':
-                reprojected_coords = reproject_coords(geometry['coordinates'], transformer)
-                new_geometry = LineString(reprojected_coords)
-            elif geometry['type'] == 'MultiPolygon':
-                reprojected_polygons = []
-                for polygon in geometry['coordinates']:
-                    reprojected_polygon = [reproject_coords(ring, transformer) for ring in polygon]
-                    reprojected_polygons.append(reprojected_polygon)
-                new_geometry = MultiPolygon(reprojected_polygons)
-            else:
-                continue  # Skip geometries that are not LineString or MultiPolygon
-
-            reprojected_feature = Feature(geometry=new_geometry, properties=feature['properties'])
-            reprojected_features.append(reprojected_feature)
+        reprojected_features = reproject_feature_list(features, transformer)
         reprojected_data[feature_type] = reprojected_features
+        instrumentation.count("features_reprojected", len(reprojected_features))
         print(f"Reprojected {len(reprojected_features)} features for type {feature_type}")  # Debug: Print reprojected features count
     return reprojected_data
 
+def crs_member(target_epsg):
+    return {
+        "type": "name",
+        "properties": {
+            "name": f"urn:ogc:def:crs:EPSG::{target_epsg}"
+        }
+    }
+
+@instrumentation.instrumented()
 def save_features(reprojected_data, output_path, target_epsg):
     for feature_type, features in reprojected_data.items():
         feature_collection = FeatureCollection(features)
 
         # Add CRS information to the GeoJSON
-        feature_collection['crs'] = {
-            "type": "name",
-            "properties": {
-                "name": f"urn:ogc:def:crs:EPSG::{target_epsg}"
-            }
-        }
+        feature_collection['crs'] = crs_member(target_epsg)
 
         output_file = output_path.get(feature_type, output_path.get('default'))
-        if output_file:
+        if output_file and not is_geojson(output_file):
+            # GeoParquet or FlatGeobuf output, chosen by the file extension
+            write_features(features, output_file, crs_member(target_epsg))
+            print(f"Data for {feature_type} saved to {output_file} with {len(features)} features")
+        elif output_file:
             os.makedirs(os.path.dirname(output_file), exist_ok=True)  # Ensure the directory exists
             with open(output_file, 'w', encoding='utf-8') as f:
                 dump(feature_collection, f, ensure_ascii=False, indent=4)
@@ -80,17 +127,18 @@ def save_features(reprojected_data, output_path, target_epsg):
         else:
             print(f"No output file specified for feature type: {feature_type}")
 
+def build_output_paths(feature_mapping, output_directory, default_output_file):
+    if not feature_mapping:
+        return {'default': os.path.join(output_directory, default_output_file)}
+    return {key: os.path.join(output_directory, value) for key, value in feature_mapping.items()}
+
 def reproject_and_separate(input_file, target_epsg, property_key=None, feature_mapping=None, link_mapping=None, output_directory="data/data_processed", default_output_file=None):
     if link_mapping is None:
         link_mapping = {}
     if feature_mapping is None:
         feature_mapping = {}
     
-    if not feature_mapping:
-        output_path = {'default': os.path.join(output_directory, default_output_file)}
-    else:
-        output_path = {key: os.path.join(output_directory, value) for key, value in feature_mapping.items()}
-    
+    output_path = build_output_paths(feature_mapping, output_directory, default_output_file)
     print("Output paths:", output_path)  # Debug: Print output paths
     
     transformer = initialize_transformer(target_epsg)
@@ -103,3 +151,140 @@ def reproject_and_separate(input_file, target_epsg, property_key=None, feature_m
     
     reprojected_data = reproject_features(features_by_type, transformer)
     return reprojected_data, output_path
+
+def reproject_and_separate_streaming(input_file, target_epsg, property_key=None, feature_mapping=None, link_mapping=None, output_directory="data/data_processed", default_output_file=None, chunk_size=10000):
+    """
+    Streaming variant of reproject_and_separate that writes each feature type straight to its output file.
+
+    Features are read incrementally and reprojected in chunks of chunk_size per type, so
+    memory use is bounded by the chunk size instead of the input size.
+
+    Returns:
+    feature_counts (dict): Number of features written per feature type.
+    output_path (dict): Output file per feature type.
+    """
+    if link_mapping is None:
+        link_mapping = {}
+    if feature_mapping is None:
+        feature_mapping = {}
+
+    output_path = build_output_paths(feature_mapping, output_directory, default_output_file)
+    print("Output paths:", output_path)  # Debug: Print output paths
+
+    transformer = initialize_transformer(target_epsg)
+    writers = {}
+    pending = defaultdict(list)
+    skipped = set()
+
+    def flush(feature_type):
+        features = pending.pop(feature_type)
+        writer = writers.get(feature_type)
+        if writer is None:
+            output_file = output_path.get(feature_type, output_path.get('default'))
+            if not output_file:
+                # Like save_features: types without an output file are dropped
+                if feature_type not in skipped:
+                    skipped.add(feature_type)
+                    print(f"No output file specified for feature type: {feature_type}")
+                return
+            writer = writers[feature_type] = FeatureCollectionWriter(output_file, crs_member(target_epsg)).open()
+        reprojected_features = reproject_feature_list(features, transformer)
+        instrumentation.count("features_reprojected", len(reprojected_features))
+        with instrumentation.span("serialize", feature_type=feature_type):
+            writer.write_all(reprojected_features)
+
+    try:
+        for feature in iter_features(input_file):
+            if feature_mapping:
+                feature_type = classify_feature(feature, property_key, feature_mapping, link_mapping)
+                if feature_type is None:
+                    continue
+            else:
+                feature_type = 'all'
+            pending[feature_type].append(feature)
+            if len(pending[feature_type]) >= chunk_size:
+                flush(feature_type)
+        for feature_type in list(pending):
+            flush(feature_type)
+    except BaseException:
+        # Leave no truncated outputs behind
+        for writer in writers.values():
+            writer.abort()
+        raise
+    for writer in writers.values():
+        writer.close()
+
+    feature_counts = {feature_type: writer.count for feature_type, writer in writers.items()}
+    for feature_type, feature_count in feature_counts.items():
+        print(f"Data for {feature_type} saved to {writers[feature_type].output_file} with {feature_count} features")
+    return feature_counts, output_path
+
+# The job of the former hard-coded reproject_railways script
+RAILWAY_JOB = {
+    "input_file": "raw_data/denmark_railways.geojson",
+    "target_epsg": 25832,
+    "property_key": "railway",
+    "feature_mapping": {
+        "rail": "denmark_railways.geojson",
+        "light_rail": "denmark_light_railways.geojson"
+    },
+    "output_directory": ""
+}
+
+def load_manifest(manifest_file):
+    """
+    Loads a JSON manifest: a list of jobs, or an object with a "jobs" list.
+
+    Each job holds the keyword arguments of reproject_and_separate_streaming, e.g.
+    {"input_file": ..., "target_epsg": 25832, "property_key": "highway",
+     "feature_mapping": {...}, "link_mapping": {...}, "output_directory": ...}.
+    """
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return manifest["jobs"] if isinstance(manifest, dict) else manifest
+
+def run_job(job):
+    start = time.perf_counter()
+    feature_counts, output_path = reproject_and_separate_streaming(**job)
+    return {"input_file": job["input_file"], "feature_counts": feature_counts,
+            "seconds": time.perf_counter() - start}
+
+def run_manifest(jobs, max_workers=None):
+    """
+    Runs reproject_and_separate_streaming for every job of a manifest on a process pool.
+
+    Each worker streams its features straight to the per-type output files. The largest
+    inputs are submitted first so they do not end up alone at the tail of the run.
+
+    Parameters:
+    jobs (list): Job dicts, see load_manifest.
+    max_workers (int, optional): Number of worker processes, by default the number of CPUs.
+
+    Returns:
+    results (list): Per job dicts with input_file, feature_counts and seconds, in manifest order.
+    """
+    sizes = [os.path.getsize(job["input_file"]) if os.path.exists(job["input_file"]) else 0 for job in jobs]
+    order = sorted(range(len(jobs)), key=lambda i: -sizes[i])
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_job, jobs[i]): i for i in order}
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            counts = results[i]["feature_counts"]
+            print(f"{jobs[i]['input_file']}: {sum(counts.values())} features in {len(counts)} outputs, "
+                  f"{results[i]['seconds']:.2f} s")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproject and separate the layers of a manifest in parallel.")
+    parser.add_argument("manifest", help="JSON manifest of jobs, see load_manifest")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    run_manifest(load_manifest(args.manifest), args.workers)
+    print(f"All jobs done in {time.perf_counter() - start:.2f} s")
+
+if __name__ == "__main__":
+    main()
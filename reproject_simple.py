@@ -1,26 +1,110 @@
+import time
 import geopandas as gpd
-from pyproj import CRS
+from crs_cache import cache_info, reproject_gdf
+from feature_store import write_layer
+from layer_chunks import DEFAULT_CHUNK_SIZE, LayerWriter, iter_chunks, layer_schema
+
+# CRS assumed for input without one
+WGS84 = "EPSG:4326"
 
 def reproject_geojson(input_geojson, target_crs):
     """
     Reprojects a GeoJSON file to a target CRS and returns the reprojected GeoDataFrame.
-    
+
     Parameters:
     input_geojson (str): Path to the input GeoJSON file.
     target_crs (str or dict or pyproj.CRS): Target CRS specification.
-    
+
     Returns:
     gdf_reprojected (geopandas.GeoDataFrame): Reprojected GeoDataFrame.
     """
     # Load the GeoJSON file into a GeoDataFrame
     gdf = gpd.read_file(input_geojson)
 
-    # Check current CRS and reproject if necessary
-    if gdf.crs is None:
-        gdf.crs = CRS.from_epsg(4326)  # Assuming input is WGS 84 if CRS is not defined
-    if gdf.crs != target_crs:
-        gdf_reprojected = gdf.to_crs(target_crs)
-    else:
-        gdf_reprojected = gdf
+    # Reproject if necessary; the CRS are compared by authority code and the
+    # transformer is cached, and input without CRS is assumed to be WGS 84
+    gdf_reprojected = reproject_gdf(gdf, target_crs, assume_crs=WGS84)
 
     return gdf_reprojected
+
+def reproject_geojson_chunks(input_geojson, target_crs, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Reprojects a layer chunk by chunk, for layers larger than memory.
+
+    Parameters:
+    input_geojson (str): Path to the input file (GeoJSON, GeoParquet or FlatGeobuf).
+    target_crs (str or dict or pyproj.CRS): Target CRS specification.
+    chunk_size (int): Features per chunk.
+
+    Returns:
+    chunks (iterator): Reprojected GeoDataFrames of at most chunk_size features.
+    """
+    for gdf in iter_chunks(input_geojson, chunk_size):
+        yield reproject_gdf(gdf, target_crs, assume_crs=WGS84)
+
+def reproject_file_chunked(input_file, output_file, target_crs, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Reprojects a file chunk by chunk, writing each chunk before the next is read, so
+    peak memory is bounded by chunk_size. The output must be GeoJSON or GeoParquet.
+
+    Returns:
+    timing (dict): input_file, output_file, features, read, reproject and write seconds.
+    """
+    timing = {"input_file": input_file, "output_file": output_file, "features": 0, "read": 0.0, "reproject": 0.0,
+              "write": 0.0}
+    chunks = iter_chunks(input_file, chunk_size)
+    with LayerWriter(output_file, layer_schema(input_file)) as writer:
+        while True:
+            start = time.perf_counter()
+            gdf = next(chunks, None)
+            read_done = time.perf_counter()
+            timing["read"] += read_done - start
+            if gdf is None:
+                break
+            gdf_reprojected = reproject_gdf(gdf, target_crs, assume_crs=WGS84)
+            reproject_done = time.perf_counter()
+            writer.write(gdf_reprojected)
+            timing["reproject"] += reproject_done - read_done
+            timing["write"] += time.perf_counter() - reproject_done
+            timing["features"] += len(gdf)
+    return timing
+
+def reproject_files(file_pairs, target_crs, chunk_size=None):
+    """
+    Reprojects many files to a target CRS, reusing the cached transformers across files.
+
+    Parameters:
+    file_pairs (list): (input_file, output_file) tuples; the output extension selects the format.
+    target_crs (str or int or pyproj.CRS): Target CRS specification.
+    chunk_size (int, optional): Reproject the files out of core in chunks of this many features.
+
+    Returns:
+    timings (list): Per file dicts with input_file, output_file, features, read, reproject and write seconds.
+    """
+    timings = []
+    for input_file, output_file in file_pairs:
+        if chunk_size:
+            timing = reproject_file_chunked(input_file, output_file, target_crs, chunk_size)
+            timings.append(timing)
+            print(f"{input_file} -> {output_file}: {timing['features']} features in chunks of {chunk_size}, "
+                  f"read {timing['read']:.2f} s, reproject {timing['reproject']:.2f} s, write {timing['write']:.2f} s")
+            continue
+        start = time.perf_counter()
+        gdf = gpd.read_file(input_file)
+        read_done = time.perf_counter()
+        gdf_reprojected = reproject_gdf(gdf, target_crs, assume_crs=WGS84)
+        reproject_done = time.perf_counter()
+        write_layer(gdf_reprojected, output_file)
+        write_done = time.perf_counter()
+        timings.append({
+            "input_file": input_file,
+            "output_file": output_file,
+            "features": len(gdf),
+            "read": read_done - start,
+            "reproject": reproject_done - read_done,
+            "write": write_done - reproject_done,
+        })
+        print(f"{input_file} -> {output_file}: {len(gdf)} features, read {read_done - start:.2f} s, "
+              f"reproject {reproject_done - read_done:.2f} s, write {write_done - reproject_done:.2f} s")
+    print(f"Transformer cache: {cache_info()['transformer']}")
+    return timings
@@ -0,0 +1,209 @@
+import heapq
+import json
+import os
+import numpy as np
+from geometry_arrays import GEOMETRY_DEPTH, flatten_geometries, rebuild_geometries
+
+def sequence_kinds(layouts):
+    # Per coordinate sequence: 'point' (all vertices kept), 'line' or 'ring'
+    kinds = []
+    for geometry_type, layout in layouts:
+        depth = GEOMETRY_DEPTH[geometry_type]
+        if geometry_type in ('Point', 'MultiPoint'):
+            kinds.append('point')
+        elif depth == 1:
+            kinds.append('line')
+        elif geometry_type == 'MultiLineString':
+            kinds.extend(['line'] * layout)
+        elif geometry_type == 'Polygon':
+            kinds.extend(['ring'] * layout)
+        else:
+            kinds.extend(['ring'] * sum(layout))
+    return kinds
+
+def effective_areas(coords, offsets, kinds):
+    """
+    Visvalingam-Whyatt effective area of every vertex.
+
+    Vertices are eliminated smallest triangle first; the area of a vertex is the area of
+    the triangle it formed with its neighbours when it was eliminated, raised to the area
+    of the previously eliminated neighbour so that the areas are monotonic. Line end
+    points, points and the four vertices every ring keeps get an infinite area.
+    """
+    count = len(coords)
+    areas = np.full(count, np.inf)
+    if count == 0:
+        return areas
+    x, y = coords[:, 0], coords[:, 1]
+    starts, ends = offsets[:-1], offsets[1:]
+
+    # Interior vertices of lines and rings take part in the elimination
+    interior = np.zeros(count, dtype=bool)
+    for start, end, kind in zip(starts.tolist(), ends.tolist(), kinds):
+        if kind != 'point' and end - start > 2:
+            interior[start + 1:end - 1] = True
+    candidates = np.flatnonzero(interior)
+    triangle = 0.5 * np.abs((x[candidates - 1] - x[candidates + 1]) * (y[candidates] - y[candidates - 1])
+                            - (x[candidates - 1] - x[candidates]) * (y[candidates + 1] - y[candidates - 1]))
+
+    xs, ys = x.tolist(), y.tolist()
+    previous = list(range(-1, count - 1))
+    following = list(range(1, count + 1))
+    current = dict(zip(candidates.tolist(), triangle.tolist()))
+    heap = [(area, i) for i, area in current.items()]
+    heapq.heapify(heap)
+    is_interior = interior.tolist()
+
+    def area_of(i):
+        a, b = previous[i], following[i]
+        return 0.5 * abs((xs[a] - xs[b]) * (ys[i] - ys[a]) - (xs[a] - xs[i]) * (ys[b] - ys[a]))
+
+    while heap:
+        area, i = heapq.heappop(heap)
+        if current.get(i) != area:
+            continue  # Stale entry
+        del current[i]
+        areas[i] = area
+        a, b = previous[i], following[i]
+        following[a], previous[b] = b, a
+        for neighbour in (a, b):
+            if is_interior[neighbour] and neighbour in current:
+                neighbour_area = max(area_of(neighbour), area)
+                current[neighbour] = neighbour_area
+                heapq.heappush(heap, (neighbour_area, neighbour))
+
+    # Rings keep their last two interior vertices, i.e. at least a triangle
+    for start, end, kind in zip(starts.tolist(), ends.tolist(), kinds):
+        if kind == 'ring' and end - start > 2:
+            last = start + 1 + np.argsort(areas[start + 1:end - 1])[-2:]
+            areas[last] = np.inf
+    return areas
+
+class SignificanceRanking:
+    """
+    Per-vertex significance of a set of GeoJSON geometries, for simplifying them to any
+    vertex budget without running the simplifier again.
+
+    Build it once from the geometries (or load the cached areas for a file) and call
+    select(vertex_budget) for each budget; a budget keeps the vertices with the largest
+    effective areas.
+    """
+
+    def __init__(self, geometries, areas=None):
+        self.coords, self.offsets, self.layouts = flatten_geometries(geometries)
+        if areas is None:
+            areas = effective_areas(self.coords, self.offsets, sequence_kinds(self.layouts))
+        self.areas = areas
+        self.mandatory = int(np.isinf(areas).sum())
+
+        # Geometry of each vertex, from the number of sequences per geometry
+        sequence_counts = [1 if GEOMETRY_DEPTH[t] < 2 else (layout if GEOMETRY_DEPTH[t] == 2 else sum(layout))
+                           for t, layout in self.layouts]
+        sequence_geometry = np.repeat(np.arange(len(self.layouts)), sequence_counts)
+        self.vertex_sequence = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        self.vertex_geometry = sequence_geometry[self.vertex_sequence]
+        self.vertex_counts = np.bincount(self.vertex_geometry, minlength=len(self.layouts))
+        self.mandatory_counts = np.bincount(self.vertex_geometry[np.isinf(areas)], minlength=len(self.layouts))
+
+        # Rank of each vertex by significance, over all geometries and within its geometry
+        order = np.lexsort((np.arange(len(areas)), -areas))
+        self.rank = np.empty(len(areas), dtype=np.int64)
+        self.rank[order] = np.arange(len(areas))
+        order = np.lexsort((np.arange(len(areas)), -areas, self.vertex_geometry))
+        first = np.cumsum(self.vertex_counts) - self.vertex_counts
+        self.local_rank = np.empty(len(areas), dtype=np.int64)
+        self.local_rank[order] = np.arange(len(areas)) - np.repeat(first, self.vertex_counts)
+
+    def __len__(self):
+        return len(self.areas)
+
+    def keep_mask(self, vertex_budget, per_feature=False):
+        """
+        Vertices kept for a budget. Globally the most significant vertices are kept; per
+        feature the budget is shared in proportion to each feature's vertex count.
+        Vertices every geometry needs are always kept, even above the budget.
+        """
+        vertex_budget = max(int(vertex_budget), self.mandatory)
+        if not per_feature:
+            return self.rank < vertex_budget
+        shares = np.floor(vertex_budget * self.vertex_counts / max(len(self), 1)).astype(np.int64)
+        budgets = np.maximum(shares, self.mandatory_counts)
+        return self.local_rank < budgets[self.vertex_geometry]
+
+    def threshold(self, vertex_budget):
+        # Smallest effective area kept globally, i.e. the equivalent area tolerance
+        kept = self.areas[self.keep_mask(vertex_budget)]
+        finite = kept[np.isfinite(kept)]
+        return float(finite.min()) if len(finite) else float('inf')
+
+    def select(self, vertex_budget, per_feature=False):
+        """
+        Returns the geometries simplified to the vertex budget.
+        """
+        keep = self.keep_mask(vertex_budget, per_feature)
+        offsets = np.zeros(len(self.offsets), dtype=np.int64)
+        np.cumsum(np.bincount(self.vertex_sequence[keep], minlength=len(self.offsets) - 1), out=offsets[1:])
+        return rebuild_geometries(self.coords[keep], offsets, self.layouts)
+
+    def save(self, path, source_file):
+        stat = os.stat(source_file)
+        np.savez(path, areas=self.areas, source=np.array([stat.st_size, stat.st_mtime_ns]))
+
+    @classmethod
+    def for_file(cls, geometries, source_file):
+        """
+        Ranking of the geometries read from source_file, using the areas cached next to it when they are current.
+        """
+        path = f"{source_file}.significance.npz"
+        stat = os.stat(source_file)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                if data['source'].tolist() == [stat.st_size, stat.st_mtime_ns]:
+                    return cls(geometries, data['areas'])
+        ranking = cls(geometries)
+        ranking.save(path, source_file)
+        return ranking
+
+def serialized_size(features, crs=None):
+    """
+    Size in bytes of the features written by geojson_stream.write_feature_collection.
+    """
+    header = '{"type": "FeatureCollection", ' + (f'"crs": {json.dumps(crs)}, ' if crs is not None else '') + '"features": [\n'
+    sizes = [len(json.dumps(feature, ensure_ascii=False).encode('utf-8')) for feature in features]
+    return len(header) + sum(sizes) + 2 * max(len(sizes) - 1, 0) + len('\n]}\n')
+
+def budget_features(features, indices, ranking, vertex_budget, per_feature=False):
+    # The features with the geometries at indices simplified to the vertex budget
+    simplified_features = list(features)
+    for i, geometry in zip(indices, ranking.select(vertex_budget, per_feature)):
+        simplified_features[i] = dict(features[i], geometry=geometry)
+    return simplified_features
+
+def vertex_budget_for_bytes(features, indices, ranking, byte_budget, per_feature=False, crs=None, iterations=8):
+    """
+    Largest vertex budget whose output fits in byte_budget bytes.
+
+    The size grows almost linearly with the vertex count, so a few secant steps on the
+    actually serialized size bracket the budget; the lower end of the bracket always
+    fits. If even the minimal geometries exceed byte_budget, their budget is returned.
+    """
+    def size(vertex_budget):
+        return serialized_size(budget_features(features, indices, ranking, vertex_budget, per_feature), crs)
+
+    low, high = ranking.mandatory, len(ranking)
+    low_size, high_size = size(low), size(high)
+    if high_size <= byte_budget:
+        return high
+    if low_size >= byte_budget:
+        return low
+    for _ in range(iterations):
+        if high - low <= 1:
+            break
+        guess = low + int((byte_budget - low_size) * (high - low) / (high_size - low_size))
+        guess = min(max(guess, low + 1), high - 1)
+        guess_size = size(guess)
+        if guess_size <= byte_budget:
+            low, low_size = guess, guess_size
+        else:
+            high, high_size = guess, guess_size
+    return low
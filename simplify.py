@@ -1,6 +1,21 @@
 import json
+import math
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import numpy as np
+import shapely
 from shapely.geometry import shape, mapping, Polygon, MultiPolygon, LineString, MultiLineString
+from geojson_stream import iter_features, read_member, write_feature_collection
+from feature_store import is_geojson, read_features, write_features
+from geometry_arrays import from_shapely, to_shapely
+from significance import SignificanceRanking, budget_features, vertex_budget_for_bytes
+from topology import Topology
+import instrumentation
+
+# shapely type ids of the geometries simplify_geometry simplifies
+# (LineString, LinearRing, Polygon, MultiLineString, MultiPolygon)
+SIMPLIFIED_TYPE_IDS = [1, 2, 3, 5, 6]
 
 def simplify_geometry(geometry, tolerance):
     """
@@ -10,39 +25,195 @@ def simplify_geometry(geometry, tolerance):
         return geometry.simplify(tolerance, preserve_topology=True)
     return geometry
 
+def simplify_feature(feature, tolerance):
+    """
+    Simplify the geometry of a single feature with the given tolerance.
+    """
+    geom = shape(feature['geometry'])
+    simplified_geom = simplify_geometry(geom, tolerance)
+    feature['geometry'] = mapping(simplified_geom)
+    return feature
+
+@instrumentation.instrumented()
 def simplify_features(features, tolerance):
     """
     Simplify the features with the given tolerance.
     """
-    simplified_features = []
-    for feature in features:
-        geom = shape(feature['geometry'])
-        simplified_geom = simplify_geometry(geom, tolerance)
-        feature['geometry'] = mapping(simplified_geom)
-        simplified_features.append(feature)
+    simplified_features = [simplify_feature(feature, tolerance) for feature in features]
+    instrumentation.count("features_simplified", len(simplified_features))
     return simplified_features
 
-def process_file(input_file, output_file, tolerance):
-    # Read the input GeoJSON file
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    # Ensure the CRS is EPSG:25832
-    crs = {
-        "type": "name",
-        "properties": {
-            "name": "EPSG:25832"
-        }
+def simplify_array(geometries, tolerance):
+    """
+    Simplify a shapely geometry array in one call, leaving points and collections unchanged.
+    """
+    geometries = geometries.copy()
+    mask = np.isin(shapely.get_type_id(geometries), SIMPLIFIED_TYPE_IDS)
+    geometries[mask] = shapely.simplify(geometries[mask], tolerance, preserve_topology=True)
+    return geometries
+
+@instrumentation.instrumented()
+def simplify_features_vectorized(features, tolerance, max_workers=None, chunk_size=50000):
+    """
+    Simplify the features with the given tolerance using shapely's array functions.
+
+    Geometries are parsed, simplified and serialized in bulk, and the input features
+    are not modified. With max_workers > 1 the geometry array is split into chunks of
+    chunk_size that are simplified in a process pool.
+    """
+    features = list(features)
+    indices = [i for i, feature in enumerate(features) if feature.get('geometry') is not None]
+    with instrumentation.span("simplify.parse"):
+        geometries = to_shapely([features[i]['geometry'] for i in indices])
+    if instrumentation.ENABLED:
+        instrumentation.count("features_simplified", len(geometries))
+        instrumentation.count("vertices_in", int(shapely.get_num_coordinates(geometries).sum()))
+
+    if max_workers and max_workers > 1 and len(geometries) > chunk_size:
+        chunks = [geometries[start:start + chunk_size] for start in range(0, len(geometries), chunk_size)]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            geometries = np.concatenate(list(executor.map(simplify_array, chunks, [tolerance] * len(chunks))))
+    else:
+        with instrumentation.span("simplify.array"):
+            geometries = simplify_array(geometries, tolerance)
+    if instrumentation.ENABLED:
+        instrumentation.count("vertices_out", int(shapely.get_num_coordinates(geometries).sum()))
+
+    simplified_features = list(features)
+    with instrumentation.span("simplify.serialize"):
+        for i, geometry in zip(indices, from_shapely(geometries)):
+            simplified_features[i] = dict(features[i], geometry=geometry)
+    return simplified_features
+
+# Ensure the CRS is EPSG:25832
+OUTPUT_CRS = {
+    "type": "name",
+    "properties": {
+        "name": "EPSG:25832"
     }
+}
 
-    if 'crs' in data:
-        print(f"Input CRS for {input_file}: {data['crs']}")
+def report_input_crs(input_file, input_crs):
+    if input_crs is not None:
+        print(f"Input CRS for {input_file}: {input_crs}")
     else:
         print(f"No CRS found in input {input_file}, assuming EPSG:25832.")
 
+@instrumentation.instrumented()
+def simplify_features_topology(features, tolerance):
+    """
+    Simplify the features with the given tolerance, preserving topology across features.
+
+    Boundaries shared by adjacent polygons are simplified once, so neighbouring
+    regions stay gap- and overlap-free. Polygons are rebuilt from 2D arcs, so their Z
+    values are dropped; other geometries keep theirs. The input features are not modified.
+    """
+    features = list(features)
+    indices = [i for i, feature in enumerate(features) if feature.get('geometry') is not None]
+    topology = Topology.from_geometries(to_shapely([features[i]['geometry'] for i in indices]))
+    print(f"Built topology with {len(topology.arcs)} arcs and {topology.vertex_count} vertices")
+
+    simplified_features = list(features)
+    for i, geometry in zip(indices, from_shapely(topology.to_geometries(tolerance))):
+        simplified_features[i] = dict(features[i], geometry=geometry)
+    return simplified_features
+
+@instrumentation.instrumented()
+def simplify_features_budget(features, vertex_budget=None, byte_budget=None, per_feature=False, source_file=None,
+                             crs=OUTPUT_CRS):
+    """
+    Simplify the features to a vertex count or output size instead of a tolerance.
+
+    Vertices are ranked once by Visvalingam-Whyatt effective area (cached next to
+    source_file when it is given), and the budget keeps the most significant ones, over
+    the whole layer or, with per_feature, shared between features in proportion to their
+    vertex counts. A byte_budget is the size of the GeoJSON written with crs. End points
+    and the smallest valid rings are always kept, so tiny budgets are not met exactly.
+    Unlike the tolerance modes this does not preserve topology. The input features are
+    not modified.
+    """
+    if (vertex_budget is None) == (byte_budget is None):
+        raise ValueError("Give either a vertex budget or a byte budget")
+    features = list(features)
+    indices = [i for i, feature in enumerate(features) if feature.get('geometry') is not None]
+    geometries = [features[i]['geometry'] for i in indices]
+    with instrumentation.span("simplify.significance"):
+        if source_file is not None:
+            ranking = SignificanceRanking.for_file(geometries, source_file)
+        else:
+            ranking = SignificanceRanking(geometries)
+
+    if byte_budget is not None:
+        vertex_budget = vertex_budget_for_bytes(features, indices, ranking, byte_budget, per_feature, crs)
+    simplified_features = budget_features(features, indices, ranking, vertex_budget, per_feature)
+    kept = int(ranking.keep_mask(vertex_budget, per_feature).sum())
+    if instrumentation.ENABLED:
+        instrumentation.count("vertices_in", len(ranking))
+        instrumentation.count("vertices_out", kept)
+    print(f"Kept {kept} of {len(ranking)} vertices (equivalent area tolerance {ranking.threshold(vertex_budget):g})")
+    return simplified_features
+
+def simplify_in_chunks(features, tolerance, chunk_size):
+    # Simplify a feature stream in vectorized batches of chunk_size features
+    features = iter(features)
+    while True:
+        chunk = list(islice(features, chunk_size))
+        if not chunk:
+            return
+        yield from simplify_features_vectorized(chunk, tolerance)
+
+def process_file_streaming(input_file, output_file, tolerance, chunk_size=10000):
+    """
+    Simplify a GeoJSON file in chunks of features, keeping memory use roughly constant.
+    """
+    report_input_crs(input_file, read_member(input_file, 'crs'))
+
+    simplified_features = simplify_in_chunks(iter_features(input_file), tolerance, chunk_size)
+    count = write_feature_collection(output_file, simplified_features, crs=OUTPUT_CRS)
+
+    print(f"Simplified GeoJSON saved to {output_file} ({count} features, streaming)")
+
+@instrumentation.instrumented()
+def process_file(input_file, output_file, tolerance, streaming=False, vectorized=True, max_workers=None, topology=False,
+                 vertex_budget=None, byte_budget=None, per_feature=False):
+    budget = vertex_budget is not None or byte_budget is not None
+    if streaming and (topology or budget):
+        raise ValueError("Topology-preserving and budget simplification need all features and cannot stream")
+    if budget and topology:
+        raise ValueError("Budget simplification does not preserve topology")
+    if byte_budget is not None and not is_geojson(output_file):
+        raise ValueError(f"A byte budget needs GeoJSON output, not {output_file}")
+    if streaming:
+        return process_file_streaming(input_file, output_file, tolerance)
+
+    # Read the input file (GeoJSON, GeoParquet or FlatGeobuf)
+    with instrumentation.span("read", input_file=input_file):
+        data = read_features(input_file)
+
+    crs = OUTPUT_CRS
+    report_input_crs(input_file, data.get('crs'))
+
     # Simplify the features
-    simplified_features = simplify_features(data['features'], tolerance)
+    if budget:
+        simplified_features = simplify_features_budget(data['features'], vertex_budget, byte_budget, per_feature,
+                                                       source_file=input_file, crs=crs)
+        if is_geojson(output_file):
+            # Written exactly as the byte budget was measured
+            count = write_feature_collection(output_file, simplified_features, crs=crs)
+            print(f"Simplified GeoJSON saved to {output_file} ({count} features, {os.path.getsize(output_file)} bytes)")
+            return
+    elif topology:
+        simplified_features = simplify_features_topology(data['features'], tolerance)
+    elif vectorized:
+        simplified_features = simplify_features_vectorized(data['features'], tolerance, max_workers)
+    else:
+        simplified_features = simplify_features(data['features'], tolerance)
     
+    if not is_geojson(output_file):
+        count = write_features(simplified_features, output_file, crs)
+        print(f"Simplified {count} features saved to {output_file}")
+        return
+
     # Prepare the simplified GeoJSON data
     simplified_geojson = {
         "type": "FeatureCollection",
@@ -54,14 +225,138 @@ def process_file(input_file, output_file, tolerance):
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     
     # Save the simplified GeoJSON to the output file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(simplified_geojson, f)
+    with instrumentation.span("write", output_file=output_file):
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(simplified_geojson, f)
     
     print(f"Simplified GeoJSON saved to {output_file}")
 
-def main(file_pairs, tolerance):
-    for input_file, output_file in file_pairs:
-        process_file(input_file, output_file, tolerance)
+def tolerance_ladder(base_tolerance, factor=2, levels=6):
+    """
+    Geometric tolerance ladder base_tolerance * factor ** level for level = 0 .. levels - 1.
+    """
+    return [base_tolerance * factor ** level for level in range(levels)]
+
+def build_pyramid(input_file, output_directory, base_tolerance, factor=2, levels=6, topology=False):
+    """
+    Simplify a layer at every tolerance of a geometric ladder in one pass.
+
+    Each level is derived from the previous, finer level rather than from the raw data,
+    so the distance of a level to the raw geometry is bounded by the sum of the
+    tolerances up to it (less than factor / (factor - 1) times its own tolerance).
+    The levels are written next to each other as <layer>_<level>.geojson together with
+    an index <layer>_pyramid.json that select_level reads.
+
+    Returns:
+    index (dict): The pyramid index that was written.
+    """
+    with open(input_file, 'r', encoding='utf-8') as f:
+        features = json.load(f)['features']
+    layer_name = os.path.splitext(os.path.basename(input_file))[0]
+    tolerances = tolerance_ladder(base_tolerance, factor, levels)
+
+    indices = [i for i, feature in enumerate(features) if feature.get('geometry') is not None]
+    geometries = to_shapely([features[i]['geometry'] for i in indices])
+    if topology:
+        level_geometries = Topology.from_geometries(geometries).pyramid(tolerances)
+    else:
+        def chained_levels(geometries):
+            for tolerance in tolerances:
+                geometries = simplify_array(geometries, tolerance)
+                yield tolerance, geometries
+        level_geometries = chained_levels(geometries)
+
+    index = {
+        "layer": layer_name,
+        "base_tolerance": base_tolerance,
+        "factor": factor,
+        "crs": OUTPUT_CRS,
+        "levels": []
+    }
+    for level, (tolerance, simplified) in enumerate(level_geometries):
+        level_features = list(features)
+        for i, geometry in zip(indices, from_shapely(simplified)):
+            level_features[i] = dict(features[i], geometry=geometry)
+        file_name = f"{layer_name}_{level}.geojson"
+        write_feature_collection(os.path.join(output_directory, file_name), level_features, crs=OUTPUT_CRS)
+        index["levels"].append({
+            "level": level,
+            "tolerance": tolerance,
+            "file": file_name,
+            "vertices": int(shapely.get_num_coordinates(simplified).sum())
+        })
+        print(f"Level {level} of {layer_name}: tolerance {tolerance}, {index['levels'][-1]['vertices']} vertices")
+
+    with open(os.path.join(output_directory, f"{layer_name}_pyramid.json"), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=4)
+    return index
+
+def load_pyramid_index(index_file):
+    with open(index_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def select_level(index, tolerance):
+    """
+    Return the index entry of the coarsest level whose tolerance does not exceed the
+    requested one, computed directly from the ladder in O(1).
+    """
+    levels = index["levels"]
+    if tolerance < index["base_tolerance"]:
+        return levels[0]
+    level = int(math.floor(math.log(tolerance / index["base_tolerance"], index["factor"]) + 1e-9))
+    return levels[min(level, len(levels) - 1)]
+
+def layer_tolerance(tolerance, input_file):
+    """
+    Look up the tolerance for a layer.
+
+    tolerance is either a number used for every layer or a dict keyed by input file
+    path or layer name (file name without extension), with an optional 'default'.
+    """
+    if not isinstance(tolerance, dict):
+        return tolerance
+    layer_name = os.path.splitext(os.path.basename(input_file))[0]
+    for key in (input_file, layer_name, 'default'):
+        if key in tolerance:
+            return tolerance[key]
+    raise KeyError(f"No tolerance given for layer {layer_name}")
+
+def layer_budget(budget, input_file):
+    # Like layer_tolerance, but layers without an entry get no budget
+    if isinstance(budget, dict):
+        layer_name = os.path.splitext(os.path.basename(input_file))[0]
+        budget = next((budget[key] for key in (input_file, layer_name, 'default') if key in budget), None)
+    return budget
+
+def main(file_pairs, tolerance, streaming=False, max_workers=None, topology=False, vertex_budget=None, byte_budget=None,
+         per_feature=False):
+    """
+    Simplify all file pairs, concurrently in a process pool unless max_workers is 1.
+
+    vertex_budget and byte_budget are optional, like tolerance either a number or a dict
+    per layer; layers with a budget are simplified to it and ignore the tolerance, streaming
+    and topology.
+    """
+    def file_options(input_file):
+        options = {"vertex_budget": layer_budget(vertex_budget, input_file),
+                   "byte_budget": layer_budget(byte_budget, input_file), "per_feature": per_feature}
+        budget = options["vertex_budget"] is not None or options["byte_budget"] is not None
+        file_tolerance = None if budget else layer_tolerance(tolerance, input_file)
+        return file_tolerance, dict(options, streaming=streaming and not budget, topology=topology and not budget)
+
+    if max_workers == 1 or len(file_pairs) < 2:
+        for input_file, output_file in file_pairs:
+            file_tolerance, options = file_options(input_file)
+            process_file(input_file, output_file, file_tolerance, **options)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for input_file, output_file in file_pairs:
+            file_tolerance, options = file_options(input_file)
+            futures.append(executor.submit(process_file, input_file, output_file, file_tolerance, **options))
+        for future in futures:
+            future.result()  # Re-raise errors from the workers
 
 if __name__ == "__main__":
     # Define the input and output file paths and the simplification tolerance
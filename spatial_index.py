@@ -0,0 +1,333 @@
+import argparse
+import glob
+import heapq
+import json
+import mmap
+import os
+import re
+import sys
+import time
+import geopandas as gpd
+import numpy as np
+import pyarrow.parquet as pq
+import shapely
+from feature_store import FORMATS, format_of, gdf_to_features, is_geojson, read_layer
+from geometry_arrays import to_shapely
+from layer_chunks import parquet_geodataframe
+
+NODE_SIZE = 16
+HILBERT_BITS = 16
+CHUNK_SIZE = 10000
+
+# Strings, which may contain braces, and braces of a GeoJSON document
+JSON_TOKENS = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}]')
+
+def index_path(layer_path):
+    # The tree sidecar written next to a layer
+    return f"{layer_path}.sidx.npz"
+
+def hilbert_distance(x, y, bits=HILBERT_BITS):
+    """
+    Position of integer grid cells (0 <= x, y < 2**bits) along the Hilbert curve, vectorized.
+    """
+    x = x.astype(np.int64)
+    y = y.astype(np.int64)
+    distance = np.zeros(len(x), dtype=np.int64)
+    s = 1 << (bits - 1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        distance += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve continues in the right orientation
+        flip = ~ry
+        mirror = flip & rx
+        x = np.where(mirror, s - 1 - x, x)
+        y = np.where(mirror, s - 1 - y, y)
+        x, y = np.where(flip, y, x), np.where(flip, x, y)
+        s >>= 1
+    return distance
+
+def pack_tree(boxes, node_size=NODE_SIZE):
+    """
+    Builds a packed Hilbert R-tree over feature bounding boxes.
+
+    Parameters:
+    boxes (numpy.ndarray): (n, 4) minx, miny, maxx, maxy per feature.
+    node_size (int): Number of children per tree node.
+
+    Returns:
+    order (numpy.ndarray): Feature indices in Hilbert order, i.e. the leaves of the tree.
+    levels (list): Node boxes per level, from the leaves up to the root.
+    """
+    extent = np.array([boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max()])
+    size = np.maximum(extent[2:] - extent[:2], 1e-12)
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+    cells = np.floor((centers - extent[:2]) / size * ((1 << HILBERT_BITS) - 1))
+    order = np.argsort(hilbert_distance(cells[:, 0], cells[:, 1]), kind='stable')
+
+    levels = [boxes[order]]
+    while len(levels[-1]) > 1:
+        children = levels[-1]
+        starts = np.arange(0, len(children), node_size)
+        levels.append(np.column_stack((
+            np.minimum.reduceat(children[:, 0], starts), np.minimum.reduceat(children[:, 1], starts),
+            np.maximum.reduceat(children[:, 2], starts), np.maximum.reduceat(children[:, 3], starts),
+        )))
+    return order, levels
+
+def box_distance(boxes, x, y):
+    # Distance from a point to each box; 0 inside
+    dx = np.maximum(np.maximum(boxes[:, 0] - x, x - boxes[:, 2]), 0)
+    dy = np.maximum(np.maximum(boxes[:, 1] - y, y - boxes[:, 3]), 0)
+    return np.hypot(dx, dy)
+
+def feature_ranges(layer_path):
+    """
+    Byte range of every feature of a GeoJSON FeatureCollection.
+
+    Only strings and braces are scanned, so the coordinates are not parsed: features
+    are the objects directly inside the member whose key was the last string seen at
+    the top level, when that key is "features".
+    """
+    ranges = []
+    if os.path.getsize(layer_path) == 0:
+        return ranges
+    with open(layer_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        depth, key, start = 0, None, None
+        for match in JSON_TOKENS.finditer(data):
+            token = match.group()
+            if token == b'{':
+                depth += 1
+                if depth == 2 and key == b'"features"':
+                    start = match.start()
+            elif token == b'}':
+                if depth == 2 and start is not None:
+                    ranges.append((start, match.end()))
+                    start = None
+                depth -= 1
+            elif depth == 1:
+                key = token
+    return ranges
+
+def geojson_locations(layer_path):
+    # (start, end) byte range and bounding box of every GeoJSON feature with a geometry
+    locations, boxes, chunk = [], [], []
+    with open(layer_path, 'rb') as f:
+        for start, end in feature_ranges(layer_path):
+            f.seek(start)
+            geometry = json.loads(f.read(end - start)).get('geometry')
+            if not geometry:
+                continue
+            locations.append((start, end))
+            chunk.append(geometry)
+            if len(chunk) == CHUNK_SIZE:
+                boxes.append(shapely.bounds(to_shapely(chunk)))
+                chunk = []
+    if chunk:
+        boxes.append(shapely.bounds(to_shapely(chunk)))
+    return np.asarray(locations, dtype=np.int64).reshape(-1, 2), np.concatenate(boxes) if boxes else np.empty((0, 4))
+
+def table_locations(layer_path):
+    # (row, row + 1) and bounding box of every GeoParquet or FlatGeobuf row with a geometry
+    geometries = read_layer(layer_path, columns=[]).geometry.values.to_numpy()
+    rows = np.flatnonzero(~shapely.is_missing(geometries) & ~shapely.is_empty(geometries))
+    return np.column_stack((rows, rows + 1)), shapely.bounds(geometries[rows]).reshape(-1, 4)
+
+def build_index(layer_path, node_size=NODE_SIZE):
+    """
+    Writes a packed Hilbert R-tree sidecar for a layer.
+
+    The sidecar holds the tree and the location of every feature in the layer itself:
+    its byte range for GeoJSON, its row for GeoParquet and FlatGeobuf. Queries seek to
+    and parse only the matching features, and the features are not copied.
+
+    Parameters:
+    layer_path (str): Path to a GeoJSON, GeoParquet or FlatGeobuf layer.
+    node_size (int): Number of children per tree node.
+
+    Returns:
+    count (int): Number of indexed features.
+    """
+    locations, boxes = geojson_locations(layer_path) if is_geojson(layer_path) else table_locations(layer_path)
+    order, levels = pack_tree(boxes, node_size) if len(boxes) else (np.empty(0, dtype=np.int64), [boxes])
+    stat = os.stat(layer_path)
+    if os.path.exists(f"{layer_path}.sidx.jsonl"):
+        os.remove(f"{layer_path}.sidx.jsonl")  # Feature copy written by earlier versions
+    np.savez(index_path(layer_path), order=order, locations=locations, node_size=node_size,
+             level_sizes=np.array([len(level) for level in levels]), boxes=np.concatenate(levels),
+             source=np.array([stat.st_size, stat.st_mtime_ns]))
+    return len(order)
+
+class SpatialIndex:
+    """
+    Bounding box, intersects and k-nearest queries over a layer indexed with build_index.
+
+    Parameters:
+    layer_path (str): Path to the indexed layer.
+    """
+
+    def __init__(self, layer_path):
+        self.layer_path = layer_path
+        tree_path = index_path(layer_path)
+        if not os.path.exists(tree_path):
+            raise FileNotFoundError(f"No spatial index for {layer_path}, run build_index first")
+        with np.load(tree_path) as data:
+            stat = os.stat(layer_path)
+            if data['source'].tolist() != [stat.st_size, stat.st_mtime_ns]:
+                raise ValueError(f"The spatial index of {layer_path} is out of date, run build_index again")
+            self.order = data['order']
+            self.locations = data['locations']
+            self.node_size = int(data['node_size'])
+            bounds = np.concatenate([[0], np.cumsum(data['level_sizes'])])
+            boxes = data['boxes']
+            self.levels = [boxes[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def __len__(self):
+        return len(self.order)
+
+    def children(self, level, nodes):
+        # Indices in level - 1 of the children of the given nodes
+        starts = nodes * self.node_size
+        ends = np.minimum(starts + self.node_size, len(self.levels[level - 1]))
+        counts = ends - starts
+        return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    def query_bbox_ids(self, bbox):
+        """
+        Returns the (source order) indices of the features whose bounding box intersects bbox.
+        """
+        if not len(self):
+            return np.empty(0, dtype=np.int64)
+        minx, miny, maxx, maxy = bbox
+        nodes = np.arange(len(self.levels[-1]))
+        for level in range(len(self.levels) - 1, -1, -1):
+            boxes = self.levels[level][nodes]
+            hits = (boxes[:, 0] <= maxx) & (boxes[:, 2] >= minx) & (boxes[:, 1] <= maxy) & (boxes[:, 3] >= miny)
+            nodes = nodes[hits]
+            if level > 0:
+                nodes = self.children(level, nodes)
+        return self.order[nodes]
+
+    def read(self, ids):
+        # Read the given features from the layer, in file order
+        ids = np.sort(np.asarray(ids, dtype=np.int64))
+        if not is_geojson(self.layer_path):
+            return self.read_rows(self.locations[ids, 0])
+        features = []
+        with open(self.layer_path, 'rb') as f:
+            for start, end in self.locations[ids].tolist():
+                f.seek(start)
+                features.append(json.loads(f.read(end - start)))
+        return features
+
+    def read_rows(self, rows):
+        # GeoParquet reads only the row groups holding the rows, FlatGeobuf the rows by feature id
+        if len(rows) == 0:
+            return []
+        if format_of(self.layer_path) == 'flatgeobuf':
+            return gdf_to_features(gpd.read_file(self.layer_path, fids=rows))
+        parquet_file = pq.ParquetFile(self.layer_path)
+        group_starts = np.cumsum([0] + [parquet_file.metadata.row_group(i).num_rows
+                                        for i in range(parquet_file.num_row_groups)])
+        row_groups = np.searchsorted(group_starts, rows, side='right') - 1
+        groups = np.unique(row_groups)
+        table = parquet_file.read_row_groups(groups.tolist())
+        # Position of each row in the table of the selected row groups
+        table_starts = np.cumsum(np.concatenate([[0], np.diff(group_starts)[groups]]))
+        selected = np.searchsorted(groups, row_groups)
+        local = rows - group_starts[row_groups] + table_starts[selected]
+        return gdf_to_features(parquet_geodataframe(table.take(local),
+                                                    json.loads(parquet_file.schema_arrow.metadata[b'geo'])))
+
+    def query_bbox(self, bbox):
+        """
+        Returns the features whose bounding box intersects bbox (minx, miny, maxx, maxy).
+        """
+        return self.read(self.query_bbox_ids(bbox))
+
+    def intersects(self, geometry):
+        """
+        Returns the features that intersect a shapely or GeoJSON geometry.
+        """
+        if isinstance(geometry, dict):
+            geometry = shapely.geometry.shape(geometry)
+        features = self.query_bbox(geometry.bounds)
+        if not features:
+            return []
+        shapely.prepare(geometry)
+        hits = shapely.intersects(geometry, to_shapely([feature['geometry'] for feature in features]))
+        return [feature for feature, hit in zip(features, hits) if hit]
+
+    def nearest(self, x, y, k=1):
+        """
+        Returns the k features nearest to the point (x, y) as (distance, feature) pairs.
+
+        Best-first search: nodes are visited by the distance to their box, and leaf
+        features are read from disk only when their box is the nearest candidate left.
+        """
+        if not len(self):
+            return []
+        point = shapely.Point(x, y)
+        top = len(self.levels) - 1
+        nodes = np.arange(len(self.levels[top]))
+        queue = [(distance, top, node) for node, distance in
+                 zip(nodes.tolist(), box_distance(self.levels[top], x, y).tolist())]
+        heapq.heapify(queue)
+        result = []
+        while queue and len(result) < k:
+            distance, level, node = heapq.heappop(queue)
+            if level < 0:
+                # Exact distance; no remaining box is nearer
+                result.append((distance, self.read([node])[0]))
+            elif level == 0:
+                feature = self.read([self.order[node]])[0]
+                geometry = shapely.geometry.shape(feature['geometry'])
+                heapq.heappush(queue, (shapely.distance(point, geometry), -1, int(self.order[node])))
+            else:
+                children = self.children(level, np.array([node]))
+                distances = box_distance(self.levels[level - 1][children], x, y)
+                for child, child_distance in zip(children.tolist(), distances.tolist()):
+                    heapq.heappush(queue, (child_distance, level - 1, child))
+        return result
+
+def build_indexes(directory="data/data_processed", node_size=NODE_SIZE):
+    """
+    Indexes every layer in a directory, e.g. the outputs of reproject_and_separate.
+    """
+    for layer_path in sorted(glob.glob(os.path.join(directory, "*"))):
+        if os.path.splitext(layer_path)[1].lower() not in FORMATS:
+            continue
+        start = time.perf_counter()
+        count = build_index(layer_path, node_size)
+        print(f"Indexed {count} features of {layer_path} in {time.perf_counter() - start:.2f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query spatial indexes of processed layers.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Index the layers of a directory")
+    build_parser.add_argument("directory", nargs="?", default="data/data_processed")
+    bbox_parser = subparsers.add_parser("bbox", help="Features within a bounding box")
+    bbox_parser.add_argument("layer")
+    bbox_parser.add_argument("bbox", nargs=4, type=float, metavar=("MINX", "MINY", "MAXX", "MAXY"))
+    nearest_parser = subparsers.add_parser("nearest", help="Features nearest to a point")
+    nearest_parser.add_argument("layer")
+    nearest_parser.add_argument("x", type=float)
+    nearest_parser.add_argument("y", type=float)
+    nearest_parser.add_argument("-k", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_indexes(args.directory)
+        return
+    start = time.perf_counter()
+    index = SpatialIndex(args.layer)
+    if args.command == "bbox":
+        features = index.query_bbox(args.bbox)
+    else:
+        features = [dict(feature, properties=dict(feature.get('properties') or {}, distance=distance))
+                    for distance, feature in index.nearest(args.x, args.y, args.k)]
+    print(json.dumps({"type": "FeatureCollection", "features": features}))
+    print(f"{len(features)} features in {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import geopandas as gpd
+import numpy as np
+import shapely
+from feature_store import write_features, write_layer
+from geometry_arrays import rebuild_geometries
+
+# Dataset sizes used by the benchmark suite
+SCALES = {"10k": 10000, "100k": 100000, "1M": 1000000}
+
+# Extent of Denmark in WGS84 and in EPSG:25832
+WGS84_EXTENT = (8.0, 54.5, 12.5, 57.7)
+UTM_EXTENT = (450000, 6050000, 720000, 6400000)
+
+# Share of each class in the synthetic networks, roughly as in the OSM extracts
+HIGHWAY_CLASSES = {"motorway": 0.05, "motorway_link": 0.03, "trunk": 0.05, "trunk_link": 0.02, "primary": 0.15,
+                   "primary_link": 0.02, "secondary": 0.25, "secondary_link": 0.01, "tertiary": 0.42}
+RAILWAY_CLASSES = {"rail": 0.8, "light_rail": 0.2}
+
+def random_walks(rng, count, vertices, extent, step):
+    # (count, vertices, 2) array of random walks starting uniformly inside extent
+    starts = rng.uniform(extent[:2], extent[2:], size=(count, 1, 2))
+    steps = rng.normal(0, step, size=(count, vertices - 1, 2))
+    return np.concatenate([starts, starts + np.cumsum(steps, axis=1)], axis=1)
+
+def line_features(coords, tag_key, classes, rng):
+    # GeoJSON LineString features with a tag_key class drawn from classes
+    count, vertices = coords.shape[:2]
+    values = rng.choice(list(classes), size=count, p=list(classes.values()))
+    offsets = np.arange(count + 1) * vertices
+    geometries = rebuild_geometries(coords.reshape(-1, 2), offsets, [('LineString', None)] * count)
+    return [{'type': 'Feature', 'id': i, 'geometry': geometry, 'properties': {tag_key: value}}
+            for i, (geometry, value) in enumerate(zip(geometries, values.tolist()))]
+
+def road_network(feature_count, vertices_per_feature=12, seed=0):
+    """
+    Synthetic road ways in WGS84 as GeoJSON features with a 'highway' class, like download_roads.py output.
+    """
+    rng = np.random.default_rng(seed)
+    coords = random_walks(rng, feature_count, vertices_per_feature, WGS84_EXTENT, 0.0005)
+    return line_features(coords, 'highway', HIGHWAY_CLASSES, rng)
+
+def rail_network(feature_count, vertices_per_feature=20, seed=1):
+    """
+    Synthetic railway ways in WGS84 as GeoJSON features with a 'railway' class, like download_rail.py output.
+    """
+    rng = np.random.default_rng(seed)
+    coords = random_walks(rng, feature_count, vertices_per_feature, WGS84_EXTENT, 0.001)
+    return line_features(coords, 'railway', RAILWAY_CLASSES, rng)
+
+def carriageway_pairs(pair_count, length=2000, spacing=50, separation=25, seed=2):
+    """
+    Synthetic divided motorways in EPSG:25832: pairs of gently curving, anti-parallel
+    carriageways separation meters apart, as a GeoDataFrame with 2 * pair_count lines.
+    """
+    rng = np.random.default_rng(seed)
+    vertices = int(length / spacing) + 1
+    headings = rng.uniform(0, 2 * np.pi, size=(pair_count, 1)) + np.cumsum(
+        rng.normal(0, 0.02, size=(pair_count, vertices)), axis=1)
+    starts = rng.uniform(UTM_EXTENT[:2], UTM_EXTENT[2:], size=(pair_count, 1, 2))
+    steps = spacing * np.stack([np.cos(headings), np.sin(headings)], axis=2)
+    center = starts + np.cumsum(steps, axis=1) - steps[:, :1]
+    normals = np.stack([-np.sin(headings), np.cos(headings)], axis=2) * separation / 2
+    left = center + normals
+    right = (center - normals)[:, ::-1]  # The opposite carriageway runs the other way
+    lines = shapely.linestrings(np.concatenate([left, right]))
+    return gpd.GeoDataFrame({'highway': ['motorway'] * len(lines)}, geometry=lines, crs="EPSG:25832")
+
+def polygon_layer(feature_count, seed=3):
+    """
+    Synthetic dense polygon layer in EPSG:25832: small building-like squares clustered into towns.
+    """
+    rng = np.random.default_rng(seed)
+    town_count = max(feature_count // 500, 1)
+    towns = rng.uniform(UTM_EXTENT[:2], UTM_EXTENT[2:], size=(town_count, 2))
+    centers = towns[rng.integers(town_count, size=feature_count)] + rng.normal(0, 1500, size=(feature_count, 2))
+    sizes = rng.uniform(5, 30, size=feature_count)
+    geometries = shapely.box(centers[:, 0], centers[:, 1], centers[:, 0] + sizes, centers[:, 1] + sizes)
+    return gpd.GeoDataFrame({'landuse': ['residential'] * feature_count}, geometry=geometries, crs="EPSG:25832")
+
+def write_dataset(output_directory=os.path.join("data", "synthetic"), scale="10k", extension=".geojson"):
+    """
+    Writes the synthetic layers of one scale as files, e.g. as offline input for the pipeline.
+
+    Returns:
+    paths (dict): Output file per layer.
+    """
+    feature_count = SCALES[scale]
+    paths = {name: os.path.join(output_directory, f"{name}_{scale}{extension}")
+             for name in ("roads", "rail", "carriageways", "polygons")}
+    write_features(road_network(feature_count), paths["roads"])
+    write_features(rail_network(feature_count), paths["rail"])
+    write_layer(carriageway_pairs(feature_count // 2), paths["carriageways"])
+    write_layer(polygon_layer(feature_count), paths["polygons"])
+    return paths
+
+if __name__ == "__main__":
+    import sys
+    for layer, path in write_dataset(*sys.argv[1:3]).items():
+        print(f"{layer}: {path}")
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import mapping, shape
+from geometry_arrays import flatten_geometries, from_shapely, rebuild_geometries, to_shapely
+
+SQUARE = [[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]]
+HOLE = [[1, 1], [2, 1], [2, 2], [1, 1]]
+
+GEOMETRIES = [
+    {'type': 'Point', 'coordinates': [1, 2]},
+    {'type': 'Point', 'coordinates': [1, 2, 3]},
+    {'type': 'Point', 'coordinates': []},
+    {'type': 'MultiPoint', 'coordinates': [[1, 2, 3], [4, 5, 6]]},
+    {'type': 'LineString', 'coordinates': [[0, 0], [1, 1]]},
+    {'type': 'LineString', 'coordinates': [[0, 0, 1], [1, 1, 2], [2, 0, 3]]},
+    {'type': 'LineString', 'coordinates': []},
+    {'type': 'MultiLineString', 'coordinates': [[[0, 0, 1], [1, 1, 2]], [[2, 2, 3], [3, 3, 4]]]},
+    {'type': 'Polygon', 'coordinates': [SQUARE, HOLE]},
+    {'type': 'Polygon', 'coordinates': [[[x, y, 7] for x, y in SQUARE]]},
+    {'type': 'Polygon', 'coordinates': []},
+    {'type': 'MultiPolygon', 'coordinates': [[SQUARE], [[[x + 10, y] for x, y in SQUARE], HOLE]]},
+    {'type': 'MultiPolygon', 'coordinates': []},
+]
+
+def assert_same(geometry, expected):
+    assert geometry.geom_type == expected.geom_type
+    assert shapely.has_z(geometry) == shapely.has_z(expected)
+    if expected.is_empty:
+        assert geometry.is_empty
+    else:
+        assert shapely.equals_exact(geometry, expected, tolerance=0)
+        if shapely.has_z(expected):
+            np.testing.assert_array_equal(shapely.get_coordinates(geometry, include_z=True),
+                                          shapely.get_coordinates(expected, include_z=True))
+
+@pytest.mark.parametrize("geometry", GEOMETRIES, ids=lambda g: f"{g['type']}-{len(g['coordinates'])}")
+def test_to_shapely_matches_shape(geometry):
+    assert_same(to_shapely([geometry])[0], shape(geometry))
+
+def test_to_shapely_batch_matches_shape():
+    # One batch mixing 2D, 3D and empty geometries of the same types
+    for geometry, expected in zip(to_shapely(GEOMETRIES), GEOMETRIES):
+        assert_same(geometry, shape(expected))
+
+def test_from_shapely_matches_mapping():
+    geometries = np.array([shape(geometry) for geometry in GEOMETRIES], dtype=object)
+    for geometry, expected in zip(from_shapely(geometries), geometries):
+        assert_same(shape(geometry), expected)
+        if expected.is_empty:
+            assert geometry == mapping(expected)
+
+def test_flatten_keeps_z():
+    coords, offsets, layouts = flatten_geometries(GEOMETRIES)
+    assert coords.shape[1] == 3
+    # 2D vertices of a mixed batch have no Z and come back as (x, y)
+    rebuilt = rebuild_geometries(coords, offsets, layouts)
+    assert rebuilt[0]['coordinates'] == (1, 2)
+    assert rebuilt[1]['coordinates'] == (1, 2, 3)
+    assert rebuilt[2]['coordinates'] == []
+    assert rebuilt[5]['coordinates'] == [(0, 0, 1), (1, 1, 2), (2, 0, 3)]
+    assert rebuilt[6]['coordinates'] == []
+
+def test_flatten_2d_only():
+    coords, offsets, layouts = flatten_geometries([GEOMETRIES[4], GEOMETRIES[6], GEOMETRIES[8]])
+    assert coords.shape == (11, 2)
+    assert offsets.tolist() == [0, 2, 2, 7, 11]
+
+def test_flatten_rejects_short_positions():
+    with pytest.raises(ValueError):
+        flatten_geometries([{'type': 'LineString', 'coordinates': [[0], [1]]}])
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from overpass_cache import CacheMiss, OverpassCache, fetch_overpass
+
+QUERY = '[out:json];\nnode(1);\nout;\n'
+
+class StandIn(BaseHTTPRequestHandler):
+    # Local stand-in for an Overpass interpreter, answering with the scripted responses in order
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests += 1
+        status = self.server.script.pop(0) if self.server.script else 200
+        if status is None:
+            self.close_connection = True  # Drop the connection without a response
+            return
+        body = b'{"elements": []}' if status == 200 else b'busy'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    server.script, server.requests = [], 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/api/interpreter"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def cache(tmp_path):
+    return OverpassCache(str(tmp_path), ttl=3600)
+
+def test_retries_rate_limited_response_and_caches(server, cache):
+    server.script = [429, 200]
+    response = fetch_overpass(QUERY, server.url, cache=cache, retries=2, backoff=0)
+    assert response.status_code == 200 and not response.from_cache
+    assert server.requests == 2
+
+    # Served from the cache, also when the query is formatted differently
+    response = fetch_overpass('  [out:json];\n    node(1);\n\n  out;  ', server.url, cache=cache)
+    assert response.from_cache and response.json() == {"elements": []}
+    assert server.requests == 2
+
+def test_retries_dropped_connection(server, cache):
+    server.script = [None, 200]
+    response = fetch_overpass(QUERY, server.url, cache=cache, retries=1, backoff=0)
+    assert response.status_code == 200
+    assert server.requests == 2
+
+def test_raises_connection_error_after_retries(server, cache):
+    server.script = [None, None]
+    with pytest.raises(requests.ConnectionError):
+        fetch_overpass(QUERY, server.url, cache=cache, retries=1, backoff=0)
+    assert server.requests == 2
+
+def test_returns_error_status_after_retries_without_caching(server, cache):
+    server.script = [503, 503]
+    response = fetch_overpass(QUERY, server.url, cache=cache, retries=1, backoff=0)
+    assert response.status_code == 503
+    assert not os.listdir(cache.cache_dir)
+
+def test_expired_entry_is_fetched_again(server, cache):
+    fetch_overpass(QUERY, server.url, cache=cache)
+    for name in os.listdir(cache.cache_dir):
+        old = time.time() - 2 * cache.ttl
+        os.utime(os.path.join(cache.cache_dir, name), (old, old))
+    response = fetch_overpass(QUERY, server.url, cache=cache)
+    assert not response.from_cache
+    assert server.requests == 2
+
+def test_offline_serves_stale_entries_and_raises_on_misses(server, cache):
+    fetch_overpass(QUERY, server.url, cache=cache)
+    for name in os.listdir(cache.cache_dir):
+        old = time.time() - 2 * cache.ttl
+        os.utime(os.path.join(cache.cache_dir, name), (old, old))
+    assert fetch_overpass(QUERY, server.url, cache=cache, offline=True).from_cache
+    with pytest.raises(CacheMiss):
+        fetch_overpass('[out:json];\nnode(2);\nout;\n', server.url, cache=cache, offline=True)
+    assert server.requests == 1
+
+def test_bypassing_the_cache(server, cache):
+    fetch_overpass(QUERY, server.url, cache=cache)
+    response = fetch_overpass(QUERY, server.url, cache=cache, use_cache=False)
+    assert not response.from_cache
+    assert server.requests == 2
+    with pytest.raises(CacheMiss):
+        fetch_overpass(QUERY, server.url, cache=cache, offline=True, use_cache=False)
@@ -0,0 +1,28 @@
+import pytest
+from reproject_and_separate import initialize_transformer, reproject_geometries
+
+GEOMETRIES = [
+    {'type': 'LineString', 'coordinates': [[10.0, 56.0], [10.1, 56.1]]},
+    {'type': 'LineString', 'coordinates': [[10.0, 56.0, 5.0], [10.1, 56.1, 6.0]]},
+    {'type': 'Point', 'coordinates': [11.0, 55.5, 12.0]},
+    {'type': 'Polygon', 'coordinates': [[[9, 55], [9.1, 55], [9.1, 55.1], [9, 55]]]},
+    {'type': 'LineString', 'coordinates': []},
+]
+
+def positions(coordinates):
+    # The positions of a GeoJSON coordinates member, in order
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return [tuple(coordinates)]
+    return [position for part in coordinates for position in positions(part)]
+
+@pytest.mark.parametrize("geometries", [GEOMETRIES, GEOMETRIES[:1] + GEOMETRIES[3:], GEOMETRIES[1:3]])
+def test_reproject_matches_per_vertex(geometries):
+    transformer = initialize_transformer(25832)
+    for geometry, expected in zip(reproject_geometries(geometries, transformer), geometries):
+        assert geometry['type'] == expected['type']
+        reprojected = positions(geometry['coordinates'])
+        # Reference: one transform call per position, keeping its dimension
+        reference = [transformer.transform(*position) for position in positions(expected['coordinates'])]
+        assert [len(position) for position in reprojected] == [len(position) for position in reference]
+        for position, reference_position in zip(reprojected, reference):
+            assert position == pytest.approx(reference_position)
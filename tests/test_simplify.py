@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import shape
+from simplify import (simplify_features, simplify_features_budget, simplify_features_topology,
+                      simplify_features_vectorized)
+
+# Rings with small zigzags that a tolerance of 0.5 removes; no three vertices are collinear
+OUTER = [[0, 0], [2, 0.1], [4, 0], [4.1, 2], [4, 4], [2, 3.9], [0, 4], [-0.1, 2], [0, 0]]
+HOLE = [[1, 1], [1.5, 1.05], [2, 1], [2, 2], [1.05, 1.5], [1, 1]]
+LINE = [[0, 0], [1, 0.1], [2, -0.1], [3, 0.1], [4, 0]]
+
+GEOMETRIES = [
+    {'type': 'Polygon', 'coordinates': [OUTER, HOLE]},
+    {'type': 'MultiPolygon', 'coordinates': [[[[x + 10, y] for x, y in OUTER]], [[[x + 20, y] for x, y in OUTER], [[x + 20, y] for x, y in HOLE]]]},
+    {'type': 'LineString', 'coordinates': LINE},
+    {'type': 'LineString', 'coordinates': [[x, y, i] for i, (x, y) in enumerate(LINE)]},
+    {'type': 'Polygon', 'coordinates': [[[x + 30, y, 5] for x, y in OUTER]]},
+    {'type': 'Point', 'coordinates': [1, 2, 3]},
+    {'type': 'Point', 'coordinates': []},
+    {'type': 'LineString', 'coordinates': []},
+    {'type': 'Polygon', 'coordinates': []},
+    {'type': 'MultiPolygon', 'coordinates': []},
+]
+
+FEATURES = [{'type': 'Feature', 'id': i, 'geometry': geometry, 'properties': {'n': i}}
+            for i, geometry in enumerate(GEOMETRIES)]
+
+def assert_same_features(features, expected, include_z=True):
+    assert len(features) == len(expected)
+    for feature, expected_feature in zip(features, expected):
+        assert feature['id'] == expected_feature['id']
+        assert feature['properties'] == expected_feature['properties']
+        geometry, expected_geometry = shape(feature['geometry']), shape(expected_feature['geometry'])
+        assert geometry.geom_type == expected_geometry.geom_type
+        if expected_geometry.is_empty:
+            assert geometry.is_empty
+            continue
+        if include_z:
+            assert shapely.has_z(geometry) == shapely.has_z(expected_geometry)
+        np.testing.assert_array_equal(shapely.get_coordinates(geometry, include_z=include_z),
+                                      shapely.get_coordinates(expected_geometry, include_z=include_z))
+
+@pytest.mark.parametrize("tolerance", [0, 0.5])
+def test_vectorized_matches_baseline(tolerance):
+    assert_same_features(simplify_features_vectorized(FEATURES, tolerance), simplify_features(FEATURES, tolerance))
+
+@pytest.mark.parametrize("tolerance", [0, 0.5])
+def test_topology_matches_baseline(tolerance):
+    simplified = simplify_features_topology(FEATURES, tolerance)
+    expected = simplify_features(FEATURES, tolerance)
+    assert_same_features(simplified, expected, include_z=False)
+    # Polygons are rebuilt from 2D arcs; other geometries keep their Z values
+    for feature, expected_feature in zip(simplified, expected):
+        if feature['geometry']['type'] not in ('Polygon', 'MultiPolygon'):
+            assert_same_features([feature], [expected_feature])
+
+def test_budget_keeps_everything_at_full_budget():
+    vertices = sum(int(shapely.get_num_coordinates(shape(feature['geometry']))) for feature in FEATURES)
+    assert_same_features(simplify_features_budget(FEATURES, vertex_budget=vertices), simplify_features(FEATURES, 0))
+
+@pytest.mark.parametrize("per_feature", [False, True])
+def test_budget_keeps_geometries_well_formed(per_feature):
+    # The budget mode does not preserve topology, so only ring and line minimums are guaranteed
+    vertices = sum(int(shapely.get_num_coordinates(shape(feature['geometry']))) for feature in FEATURES)
+    simplified = simplify_features_budget(FEATURES, vertex_budget=vertices // 2, per_feature=per_feature)
+    geometries = np.array([shape(feature['geometry']) for feature in simplified], dtype=object)
+    assert [geometry.geom_type for geometry in geometries] == [shape(g).geom_type for g in GEOMETRIES]
+    assert shapely.has_z(geometries).tolist() == [shapely.has_z(shape(g)) for g in GEOMETRIES]
+    assert shapely.get_num_coordinates(geometries).sum() < vertices
+    rings = shapely.get_rings(shapely.get_parts(geometries))
+    assert shapely.is_closed(rings).all() and (shapely.get_num_coordinates(rings) >= 4).all()
+    lines = geometries[(shapely.get_type_id(geometries) == 1) & ~shapely.is_empty(geometries)]
+    assert (shapely.get_num_coordinates(lines) >= 2).all()
+
+def test_modes_on_no_features():
+    assert simplify_features_vectorized([], 0.5) == simplify_features([], 0.5) == []
+    assert simplify_features_topology([], 0.5) == []
+    assert simplify_features_budget([], vertex_budget=10) == []
+
+def test_modes_do_not_modify_input():
+    before = repr(FEATURES)
+    simplify_features_vectorized(FEATURES, 0.5)
+    simplify_features_topology(FEATURES, 0.5)
+    simplify_features_budget(FEATURES, vertex_budget=20)
+    assert repr(FEATURES) == before
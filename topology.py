@@ -0,0 +1,306 @@
+import numpy as np
+import shapely
+
+def polygon_rings(geometry):
+    # Rings per polygon of a Polygon or MultiPolygon as coordinate arrays without the closing vertex
+    polygons = shapely.get_parts(geometry)
+    return [[shapely.get_coordinates(ring)[:-1] for ring in [polygon.exterior, *polygon.interiors]]
+            for polygon in polygons]
+
+def find_junctions(rings):
+    """
+    Marks the junction vertices of a set of rings.
+
+    A vertex is a junction when the rings passing through it do not all have the same
+    two neighbours there, i.e. where a shared boundary begins, ends or branches.
+
+    Returns:
+    vertex_ids (list): Per ring, an integer id per vertex shared by identical coordinates.
+    is_junction (numpy.ndarray): Boolean flag per vertex id.
+    """
+    lengths = np.array([len(ring) for ring in rings])
+    coords = np.concatenate(rings)
+    _, ids = np.unique(coords, axis=0, return_inverse=True)
+    ids = ids.ravel()
+
+    # Index of the previous and next vertex within each ring
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    position = np.arange(len(coords)) - starts
+    ring_lengths = np.repeat(lengths, lengths)
+    previous_ids = ids[starts + (position - 1) % ring_lengths]
+    next_ids = ids[starts + (position + 1) % ring_lengths]
+
+    neighbours = np.column_stack((ids, np.minimum(previous_ids, next_ids), np.maximum(previous_ids, next_ids)))
+    distinct = np.unique(neighbours, axis=0)
+    is_junction = np.bincount(distinct[:, 0], minlength=ids.max() + 1) > 1
+
+    vertex_ids = np.split(ids, np.cumsum(lengths)[:-1])
+    return vertex_ids, is_junction
+
+def arc_lines(arcs):
+    lengths = [len(arc) for arc in arcs]
+    return shapely.linestrings(np.concatenate(arcs), indices=np.repeat(np.arange(len(arcs)), lengths))
+
+def meet_elsewhere(lines, a, b):
+    # Whether lines a and b intersect anywhere but at their end points
+    starts = shapely.get_coordinates(shapely.get_point(lines, 0))
+    ends = shapely.get_coordinates(shapely.get_point(lines, -1))
+    end_points = shapely.multipoints(np.stack([starts[a], ends[a], starts[b], ends[b]], axis=1))
+    return ~shapely.is_empty(shapely.difference(shapely.intersection(lines[a], lines[b]), end_points))
+
+def swept_rings(originals, lines, arcs):
+    """
+    Rings enclosing the area each simplified segment of the given arcs swept over: the
+    original vertices it replaced, closed by the segment itself. The rings may cross
+    themselves where the segment crosses the original arc.
+
+    Returns:
+    ring_coords (numpy.ndarray): Coordinates of all rings, each closed.
+    ring_starts (numpy.ndarray): Offset of each ring in ring_coords.
+    ring_lengths (numpy.ndarray): Number of coordinates of each ring.
+    ring_arcs (numpy.ndarray): Arc of each ring.
+    unmatched (numpy.ndarray): Arcs whose simplified vertices could not be matched to
+        their original vertices in order (repeated coordinates).
+    """
+    original_coords, original_owners = shapely.get_coordinates(originals[arcs], return_index=True)
+    simplified_coords, simplified_owners = shapely.get_coordinates(lines[arcs], return_index=True)
+    original_counts = np.bincount(original_owners, minlength=len(arcs))
+    original_starts = np.cumsum(original_counts) - original_counts
+    simplified_counts = np.bincount(simplified_owners, minlength=len(arcs))
+    simplified_ends = np.cumsum(simplified_counts) - 1
+
+    # Simplification keeps a subset of the original vertices; find their positions
+    keys = np.empty(len(original_coords), dtype=[('arc', np.int64), ('x', np.float64), ('y', np.float64)])
+    keys['arc'], keys['x'], keys['y'] = original_owners, original_coords[:, 0], original_coords[:, 1]
+    order = np.argsort(keys, kind='stable')
+    queries = np.empty(len(simplified_coords), dtype=keys.dtype)
+    queries['arc'], queries['x'], queries['y'] = simplified_owners, simplified_coords[:, 0], simplified_coords[:, 1]
+    positions = order[np.minimum(np.searchsorted(keys[order], queries), len(keys) - 1)]
+    # The last vertex of a closed arc repeats its first
+    positions[simplified_ends] = original_starts + original_counts - 1
+
+    # A ring per simplified segment that replaced at least one vertex
+    first, second = positions[:-1], positions[1:]
+    same_arc = simplified_owners[:-1] == simplified_owners[1:]
+    unmatched = np.unique(simplified_owners[:-1][same_arc & (second <= first)])
+    segments = np.flatnonzero(same_arc & (second - first > 1) & ~np.isin(simplified_owners[:-1], unmatched))
+    first, second = first[segments], second[segments]
+    ring_lengths = second - first + 2
+    ring_starts = np.cumsum(ring_lengths) - ring_lengths
+    gather = np.repeat(first - ring_starts, ring_lengths) + np.arange(ring_lengths.sum())
+    gather[ring_starts + ring_lengths - 1] = first  # Close the ring along the segment
+    return (original_coords[gather], ring_starts, ring_lengths, arcs[simplified_owners[:-1][segments]],
+            arcs[unmatched])
+
+def conflicting_arcs(originals, lines, candidates):
+    """
+    Indices of the simplified arcs that break the topology of their neighbours.
+
+    Arcs of valid polygons only meet at their end points (the junctions). A simplified
+    arc conflicts with another arc when they intersect anywhere else, or when a vertex
+    of the other arc lies in the area a simplified segment swept over (see
+    swept_rings), i.e. simplification moved the arc across it (e.g. a small polygon left
+    outside the notch it was in). Only arcs near the candidate arcs are checked, using
+    STRtrees; both arcs of a conflicting pair are returned. Pairs whose original arcs
+    already meet elsewhere are left alone.
+    """
+    tree = shapely.STRtree(lines)
+    left, right = tree.query(lines[candidates], predicate="intersects")
+    pairs = np.column_stack((candidates[left], right))
+    pairs = np.unique(np.sort(pairs[pairs[:, 0] != pairs[:, 1]], axis=1), axis=0)
+    pairs = pairs[meet_elsewhere(lines, pairs[:, 0], pairs[:, 1])]
+    conflicts = [pairs[~meet_elsewhere(originals, pairs[:, 0], pairs[:, 1])].ravel()]
+
+    nearby = np.union1d(candidates, tree.query(lines[candidates])[1])
+    moved = nearby[shapely.get_num_coordinates(lines[nearby]) < shapely.get_num_coordinates(originals[nearby])]
+    if len(moved) == 0:
+        return np.unique(np.concatenate(conflicts)).astype(np.int64)
+    ring_coords, ring_starts, ring_lengths, ring_arcs, unmatched = swept_rings(originals, lines, moved)
+    conflicts.append(unmatched)
+    if len(ring_starts):
+        boxes = shapely.box(np.minimum.reduceat(ring_coords[:, 0], ring_starts),
+                            np.minimum.reduceat(ring_coords[:, 1], ring_starts),
+                            np.maximum.reduceat(ring_coords[:, 0], ring_starts),
+                            np.maximum.reduceat(ring_coords[:, 1], ring_starts))
+        coordinates, owners = shapely.get_coordinates(lines, return_index=True)
+        rings, hits = shapely.STRtree(shapely.points(coordinates)).query(boxes)
+        points = coordinates[hits]
+        # Skip the arc's own vertices and the segment's end points, which other arcs may share
+        keep = ((owners[hits] != ring_arcs[rings]) &
+                ~np.all(points == ring_coords[ring_starts[rings]], axis=1) &
+                ~np.all(points == ring_coords[ring_starts[rings] + ring_lengths[rings] - 2], axis=1))
+        rings, hits, points = rings[keep], hits[keep], points[keep]
+
+        # Even-odd test with one row per (point, ring edge)
+        edge_counts = ring_lengths[rings] - 1
+        rows = np.repeat(np.arange(len(hits)), edge_counts)
+        edges = (np.repeat(ring_starts[rings] - np.cumsum(edge_counts) + edge_counts, edge_counts) +
+                 np.arange(edge_counts.sum()))
+        (x0, y0), (x1, y1) = ring_coords[edges].T, ring_coords[edges + 1].T
+        px, py = points[rows, 0], points[rows, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossings = ((y0 > py) != (y1 > py)) & (px < x0 + (x1 - x0) * (py - y0) / (y1 - y0))
+        inside = np.bincount(rows, weights=crossings, minlength=len(hits)) % 2 == 1
+        conflicts.extend([ring_arcs[rings[inside]], owners[hits[inside]]])
+    return np.unique(np.concatenate(conflicts)).astype(np.int64)
+
+def simplify_arcs(arcs, tolerance, attempts=4):
+    """
+    Simplifies a list of arc coordinate arrays in one shapely call.
+
+    Each arc is simplified on its own, so a simplified arc can cross or swallow a
+    neighbouring arc (e.g. a notch cut across a small polygon inside it). Conflicting
+    arcs (see conflicting_arcs) are simplified again from the original arcs with half
+    the tolerance, up to attempts times, and are then kept unsimplified.
+    """
+    if not arcs:
+        return []
+    originals = arc_lines(arcs)
+    lines = shapely.simplify(originals, tolerance, preserve_topology=True)
+    tolerances = np.full(len(arcs), float(tolerance))
+    offenders = conflicting_arcs(originals, lines, np.arange(len(arcs)))
+    while True:
+        offenders = offenders[tolerances[offenders] > 0]
+        if len(offenders) == 0:
+            break
+        tolerances[offenders] /= 2
+        tolerances[offenders[tolerances[offenders] < tolerance / 2 ** attempts]] = 0
+        lines[offenders] = np.where(tolerances[offenders] > 0,
+                                    shapely.simplify(originals[offenders], tolerances[offenders], preserve_topology=True),
+                                    originals[offenders])
+        offenders = conflicting_arcs(originals, lines, offenders)
+    simplified = [shapely.get_coordinates(line) for line in lines]
+    # Keep closed arcs that collapsed below a valid ring unsimplified
+    return [
+        original if len(coords) < 4 and np.array_equal(original[0], original[-1]) else coords
+        for original, coords in zip(arcs, simplified)
+    ]
+
+class Topology:
+    """
+    Polygons decomposed into arcs, so that boundaries shared by neighbouring polygons
+    are stored and simplified exactly once.
+
+    Build it once with Topology.from_geometries and call to_geometries for each tolerance;
+    simplified arcs are cached per tolerance.
+    """
+
+    def __init__(self, arcs, shapes, others):
+        self.arcs = arcs  # Coordinate array per arc
+        self.shapes = shapes  # Per geometry: (type id, polygons -> rings -> [(arc index, reversed)]), or None
+        self.others = others  # Geometries that are not polygons, by index
+        self._simplified = {}
+
+    @classmethod
+    def from_geometries(cls, geometries):
+        geometries = np.asarray(geometries, dtype=object)
+        is_polygonal = np.isin(shapely.get_type_id(geometries), [3, 6]) & ~shapely.is_empty(geometries)
+        others = {i: geometries[i] for i in np.flatnonzero(~is_polygonal)}
+
+        polygon_indices = np.flatnonzero(is_polygonal)
+        rings_by_geometry = [polygon_rings(geometries[i]) for i in polygon_indices]
+        all_rings = [ring for polygons in rings_by_geometry for rings in polygons for ring in rings]
+        if not all_rings:
+            return cls([], [None] * len(geometries), others)
+        vertex_ids, is_junction = find_junctions(all_rings)
+
+        arcs, arc_index = [], {}
+
+        def add_arc(coords, ids):
+            # Arcs are keyed on their vertex ids, so the same boundary walked in the
+            # opposite direction by the neighbouring polygon maps to the same arc
+            key, reverse_key = tuple(ids), tuple(ids[::-1])
+            if key in arc_index:
+                return (arc_index[key], False)
+            if reverse_key in arc_index:
+                return (arc_index[reverse_key], True)
+            arc_index[key] = len(arcs)
+            arcs.append(coords)
+            return (len(arcs) - 1, False)
+
+        def cut_ring(coords, ids):
+            junctions = np.flatnonzero(is_junction[ids])
+            if len(junctions) == 0:
+                # Closed arc; start at the smallest vertex id so that two rings tracing the
+                # same closed boundary (in either direction) yield the same arc
+                start = int(np.argmin(ids))
+                coords, ids = np.roll(coords, -start, axis=0), np.roll(ids, -start)
+                return [add_arc(np.vstack([coords, coords[:1]]), np.append(ids, ids[0]))]
+            coords = np.roll(coords, -junctions[0], axis=0)
+            ids = np.roll(ids, -junctions[0])
+            cuts = np.append(junctions - junctions[0], len(ids))
+            closed_coords = np.vstack([coords, coords[:1]])
+            closed_ids = np.append(ids, ids[0])
+            return [add_arc(closed_coords[start:end + 1], closed_ids[start:end + 1])
+                    for start, end in zip(cuts[:-1], cuts[1:])]
+
+        shapes = [None] * len(geometries)
+        ring_number = 0
+        for i, polygons in zip(polygon_indices, rings_by_geometry):
+            shape = []
+            for rings in polygons:
+                ring_refs = []
+                for ring in rings:
+                    ring_refs.append(cut_ring(ring, vertex_ids[ring_number]))
+                    ring_number += 1
+                shape.append(ring_refs)
+            shapes[i] = (shapely.get_type_id(geometries[i]), shape)
+        return cls(arcs, shapes, others)
+
+    @property
+    def vertex_count(self):
+        return sum(len(arc) for arc in self.arcs)
+
+    def simplified_arcs(self, tolerance):
+        # Simplify every arc exactly once per tolerance; arc end points (junctions) are kept
+        if tolerance not in self._simplified:
+            self._simplified[tolerance] = simplify_arcs(self.arcs, tolerance)
+        return self._simplified[tolerance]
+
+    def pyramid(self, tolerances):
+        """
+        Yields (tolerance, geometries) for an ascending tolerance ladder.
+
+        Each level's arcs are simplified from the previous, finer level's arcs rather
+        than from the original ones, so coarse levels cost little.
+        """
+        arcs = self.arcs
+        for tolerance in sorted(tolerances):
+            arcs = simplify_arcs(arcs, tolerance)
+            yield tolerance, self.build_geometries(arcs, tolerance)
+
+    def to_geometries(self, tolerance=0):
+        """
+        Rebuilds the geometries from the arcs simplified with the given tolerance.
+
+        Rings that collapse below four vertices are dropped. Non-polygon geometries are
+        simplified on their own.
+        """
+        arcs = self.simplified_arcs(tolerance) if tolerance else self.arcs
+        return self.build_geometries(arcs, tolerance)
+
+    def build_geometries(self, arcs, tolerance):
+        # Assemble polygons from the given arcs; other geometries are simplified with tolerance
+        geometries = np.empty(len(self.shapes), dtype=object)
+        for i, shape in enumerate(self.shapes):
+            if shape is None:
+                geometries[i] = shapely.simplify(self.others[i], tolerance, preserve_topology=True)
+                continue
+            type_id, shape = shape
+            polygons = []
+            for ring_refs in shape:
+                rings = []
+                for refs in ring_refs:
+                    parts = [arcs[arc][::-1] if reverse else arcs[arc] for arc, reverse in refs]
+                    ring = np.concatenate([parts[0]] + [part[1:] for part in parts[1:]])
+                    rings.append(ring)
+                if len(rings[0]) < 4:
+                    continue
+                polygons.append(shapely.Polygon(rings[0], [ring for ring in rings[1:] if len(ring) >= 4]))
+            if not polygons:
+                geometries[i] = shapely.Polygon()
+            elif len(polygons) == 1 and type_id == 3:
+                geometries[i] = polygons[0]
+            else:
+                geometries[i] = shapely.MultiPolygon(polygons)
+        return geometries